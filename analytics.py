@@ -0,0 +1,231 @@
+"""Portfolio analytics for /summary.
+
+Everything here reads rollup tables, never ``duct_entries`` itself:
+``project_totals``/``project_gauge_totals`` (rollups.py) plus two more kept
+by triggers the same way, ``project_type_totals`` (per project and duct
+type) and ``daily_totals`` (per day a duct was entered). Their size depends
+on the number of projects and days, not ducts, so the summary stays fast on
+millions of duct rows.
+"""
+from datetime import date
+
+TYPE_COLUMNS = ('duct_count', 'total_qty', 'total_area', 'total_weight')
+DAILY_COLUMNS = ('duct_count', 'total_qty', 'total_area', 'total_weight')
+
+AT_RISK_HORIZON_DAYS = 14
+# A project is behind when its finished share trails the elapsed share of
+# its schedule by more than this.
+BEHIND_SCHEDULE_MARGIN = 0.25
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS project_type_totals (
+        project_id INTEGER NOT NULL,
+        duct_type TEXT NOT NULL,
+        duct_count INTEGER NOT NULL DEFAULT 0,
+        total_qty INTEGER NOT NULL DEFAULT 0,
+        total_area REAL NOT NULL DEFAULT 0,
+        total_weight REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (project_id, duct_type)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        day TEXT PRIMARY KEY,
+        duct_count INTEGER NOT NULL DEFAULT 0,
+        total_qty INTEGER NOT NULL DEFAULT 0,
+        total_area REAL NOT NULL DEFAULT 0,
+        total_weight REAL NOT NULL DEFAULT 0
+    )
+    ''',
+]
+
+
+def _apply(row, sign):
+    """Trigger body adding (sign='+') or removing (sign='-') one duct row."""
+    n = '1' if sign == '+' else '-1'
+    values = f"{n}, {sign}IFNULL({row}.quantity, 0), {sign}IFNULL({row}.area, 0), {sign}IFNULL({row}.weight, 0)"
+    return f'''
+        INSERT INTO project_type_totals (project_id, duct_type, {', '.join(TYPE_COLUMNS)})
+        VALUES ({row}.project_id, IFNULL({row}.duct_type, ''), {values})
+        ON CONFLICT(project_id, duct_type) DO UPDATE SET
+            {', '.join(f'{c} = {c} + excluded.{c}' for c in TYPE_COLUMNS)};
+        DELETE FROM project_type_totals
+        WHERE project_id = {row}.project_id AND duct_type = IFNULL({row}.duct_type, '') AND duct_count <= 0;
+        INSERT INTO daily_totals (day, {', '.join(DAILY_COLUMNS)})
+        VALUES (IFNULL({row}.created_on, ''), {values})
+        ON CONFLICT(day) DO UPDATE SET
+            {', '.join(f'{c} = {c} + excluded.{c}' for c in DAILY_COLUMNS)};
+    '''
+
+
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS duct_entries_analytics_insert
+    AFTER INSERT ON duct_entries
+    BEGIN {_apply('NEW', '+')} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS duct_entries_analytics_delete
+    AFTER DELETE ON duct_entries
+    BEGIN {_apply('OLD', '-')} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS duct_entries_analytics_update
+    AFTER UPDATE OF project_id, duct_type, quantity, area, weight, created_on ON duct_entries
+    BEGIN {_apply('OLD', '-')} {_apply('NEW', '+')} END
+    ''',
+]
+
+
+def install(cur):
+    for statement in TABLES + TRIGGERS:
+        cur.execute(statement)
+    rebuild(cur)
+
+
+def rebuild(cur):
+    """Recompute the analytics rollups from ``duct_entries``."""
+    cur.execute("DELETE FROM project_type_totals")
+    cur.execute("DELETE FROM daily_totals")
+    cur.execute(f'''
+        INSERT INTO project_type_totals (project_id, duct_type, {', '.join(TYPE_COLUMNS)})
+        SELECT project_id, IFNULL(duct_type, ''), COUNT(*), IFNULL(SUM(quantity), 0),
+               IFNULL(SUM(area), 0), IFNULL(SUM(weight), 0)
+        FROM duct_entries GROUP BY project_id, IFNULL(duct_type, '')
+    ''')
+    cur.execute(f'''
+        INSERT INTO daily_totals (day, {', '.join(DAILY_COLUMNS)})
+        SELECT IFNULL(created_on, ''), COUNT(*), IFNULL(SUM(quantity), 0),
+               IFNULL(SUM(area), 0), IFNULL(SUM(weight), 0)
+        FROM duct_entries GROUP BY IFNULL(created_on, '')
+    ''')
+
+
+def _rows(cur):
+    return [dict(row) for row in cur.fetchall()]
+
+
+def by_gauge(cur):
+    cur.execute('''
+        SELECT gauge, SUM(duct_count) AS duct_count, SUM(total_qty) AS total_qty,
+               ROUND(SUM(total_area), 2) AS total_area, ROUND(SUM(total_weight), 2) AS total_weight
+        FROM project_gauge_totals GROUP BY gauge ORDER BY gauge
+    ''')
+    return _rows(cur)
+
+
+def by_type(cur):
+    cur.execute('''
+        SELECT duct_type, SUM(duct_count) AS duct_count, SUM(total_qty) AS total_qty,
+               ROUND(SUM(total_area), 2) AS total_area, ROUND(SUM(total_weight), 2) AS total_weight
+        FROM project_type_totals GROUP BY duct_type ORDER BY SUM(total_area) DESC
+    ''')
+    return _rows(cur)
+
+
+def by_vendor(cur, limit=20):
+    """The vendors with the most sqm across their projects."""
+    cur.execute('''
+        SELECT p.vendor_id, v.name AS vendor_name, COUNT(*) AS projects,
+               SUM(t.duct_count) AS duct_count, ROUND(SUM(t.total_area), 2) AS total_area,
+               ROUND(SUM(t.total_weight), 2) AS total_weight
+        FROM project_totals t
+        JOIN projects p ON p.id = t.project_id
+        LEFT JOIN vendors v ON v.id = p.vendor_id
+        GROUP BY p.vendor_id
+        ORDER BY SUM(t.total_area) DESC
+        LIMIT ?
+    ''', (limit,))
+    return _rows(cur)
+
+
+def by_month(cur, months=12, today=None):
+    """Ducts entered per month over the last ``months`` months."""
+    today = today or date.today()
+    first = today.year * 12 + today.month - months  # (year * 12 + month - 1) of the first month
+    start = date(first // 12, first % 12 + 1, 1)
+    cur.execute('''
+        SELECT substr(day, 1, 7) AS month, SUM(duct_count) AS duct_count, SUM(total_qty) AS total_qty,
+               ROUND(SUM(total_area), 2) AS total_area, ROUND(SUM(total_weight), 2) AS total_weight
+        FROM daily_totals
+        WHERE day >= ?
+        GROUP BY month ORDER BY month
+    ''', (start.isoformat(),))
+    return _rows(cur)
+
+
+def by_day(cur, since, until=None):
+    """Daily entry totals between two ISO dates (inclusive)."""
+    cur.execute(f'''
+        SELECT day, {', '.join(DAILY_COLUMNS)} FROM daily_totals
+        WHERE day >= ? AND day <= ? ORDER BY day
+    ''', (since, until or date.today().isoformat()))
+    return _rows(cur)
+
+
+def stage_completion(cur):
+    """Sqm through each production stage against the portfolio's total sqm."""
+    cur.execute('''
+        SELECT ROUND(IFNULL(SUM(p.total_sqm), 0), 2) AS total_sqm,
+               ROUND(IFNULL(SUM(pp.sheet_cutting_sqm), 0), 2) AS sheet_cutting_sqm,
+               ROUND(IFNULL(SUM(pp.plasma_fabrication_sqm), 0), 2) AS plasma_fabrication_sqm,
+               ROUND(IFNULL(SUM(pp.boxing_assembly_sqm), 0), 2) AS boxing_assembly_sqm
+        FROM projects p LEFT JOIN production_progress pp ON pp.project_id = p.id
+    ''')
+    totals = dict(cur.fetchone())
+    total = totals['total_sqm']
+    stages = []
+    for key, label in (('sheet_cutting_sqm', 'Sheet Cutting'),
+                       ('plasma_fabrication_sqm', 'Plasma & Fabrication'),
+                       ('boxing_assembly_sqm', 'Boxing & Assembly')):
+        stages.append({'stage': label, 'sqm': totals[key],
+                       'percent': round(100 * totals[key] / total, 1) if total else 0.0})
+    return {'total_sqm': total, 'stages': stages}
+
+
+def at_risk(cur, today=None, horizon_days=AT_RISK_HORIZON_DAYS, limit=50):
+    """Unfinished projects that are overdue, due soon, or behind their schedule."""
+    today = (today or date.today()).isoformat()
+    cur.execute('''
+        SELECT * FROM (
+            SELECT p.id, p.client_name, v.name AS vendor_name, p.status, p.start_date, p.end_date,
+                   p.total_sqm, IFNULL(pp.boxing_assembly_sqm, 0) AS done_sqm,
+                   IFNULL(pp.boxing_assembly_sqm, 0) / p.total_sqm AS progress,
+                   MIN(1.0, MAX(0.0, (julianday(:today) - julianday(p.start_date))
+                       / NULLIF(julianday(p.end_date) - julianday(p.start_date), 0))) AS elapsed,
+                   CAST(julianday(p.end_date) - julianday(:today) AS INTEGER) AS days_left
+            FROM projects p
+            LEFT JOIN production_progress pp ON pp.project_id = p.id
+            LEFT JOIN vendors v ON v.id = p.vendor_id
+            WHERE p.total_sqm > 0 AND IFNULL(pp.boxing_assembly_sqm, 0) < p.total_sqm
+              AND p.end_date IS NOT NULL AND p.end_date != ''
+        )
+        WHERE days_left <= :horizon OR progress + :margin < elapsed
+        ORDER BY end_date, id
+        LIMIT :limit
+    ''', {'today': today, 'horizon': horizon_days, 'margin': BEHIND_SCHEDULE_MARGIN, 'limit': limit})
+    projects = []
+    for row in cur.fetchall():
+        project = dict(row)
+        project['progress'] = round(100 * project['progress'], 1)
+        project['elapsed'] = round(100 * (project['elapsed'] or 0), 1)
+        if project['days_left'] < 0:
+            project['risk'] = 'overdue'
+        elif project['days_left'] <= horizon_days:
+            project['risk'] = 'due soon'
+        else:
+            project['risk'] = 'behind schedule'
+        projects.append(project)
+    return projects
+
+
+def summary(cur, today=None):
+    return {
+        'by_gauge': by_gauge(cur),
+        'by_type': by_type(cur),
+        'by_vendor': by_vendor(cur),
+        'by_month': by_month(cur, today=today),
+        'stages': stage_completion(cur),
+        'at_risk': at_risk(cur, today=today),
+    }
@@ -1,143 +1,125 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify
-from datetime import datetime
-from io import BytesIO
-import sqlite3
+from flask import (Blueprint, Flask, current_app, flash, jsonify, redirect, render_template, request,
+                   send_file, session, url_for)
+from datetime import date, datetime, timedelta
+import gzip
+import json
+import logging
 import os
-import pandas as pd
-import math
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib import colors
-from num2words import num2words
-
-app = Flask(__name__)
-app.secret_key = 'secretkey'
-def get_db():
-    conn = sqlite3.connect("database.db")
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
+import secrets
+import sqlite3
+
+import click
+
+import analytics
+import bulk_export
+import costing
+import db
+import duct_batch
+import duct_calc
+import duct_import
+import export_cache
+import exports
+import jobs
+import listing
+import metrics
+import migrations
+import profiler
+import progress_log
+import rollups
+import search
+import sync
+import takeoff
+import uploads
+import vendor_cache
+import write_queue
+from db import get_db
+
+log = logging.getLogger(__name__)
+
+bp = Blueprint('main', __name__)
+
+
+def create_app(config=None):
+    """Build the application.
+
+    Configuration comes from the environment (``SECRET_KEY``, ``DATABASE_PATH``,
+    and any ``FLASK_*`` variable, e.g. ``FLASK_JOB_WORKERS``), then ``config``.
+    Nothing here opens a connection or starts a thread, so the app can be
+    built once in the gunicorn master (``preload_app``) and shared by the
+    forked workers; export libraries are only imported on first use.
+    """
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
+    app.config.from_prefixed_env()
+    if config:
+        app.config.update(config)
+    if not app.config["SECRET_KEY"]:
+        log.warning("SECRET_KEY is not set; using a random key, sessions will not survive a restart")
+        app.config["SECRET_KEY"] = secrets.token_hex(32)
+
+    db.init_app(app)
+    jobs.init_app(app)
+    export_cache.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    uploads.init_app(app)
+    write_queue.init_app(app)
+    app.register_blueprint(bp)
+    app.cli.command("migrate")(migrate_command)
+    app.cli.command("compact-production")(compact_production_command)
+    app.cli.command("reprice")(reprice_command)
+    app.cli.command("recalc")(recalc_command)
+    app.config.setdefault("REPRICE_WORKERS", int(os.environ.get("REPRICE_WORKERS", 1)))
+    app.config.setdefault("BULK_EXPORT_WORKERS", int(os.environ.get("BULK_EXPORT_WORKERS", os.cpu_count() or 1)))
+    return app
+
+
+def migrate_command():
+    """Apply pending schema migrations."""
+    migrations.main([db.database_path()])
+
+
+def compact_production_command():
+    """Roll old production events into daily buckets."""
+    conn = db.connect(db.database_path())
+    try:
+        compacted = progress_log.compact(conn)
+    finally:
+        conn.close()
+    print(f"✅ Compacted {compacted} production events")
 
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS projects (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vendor_id INTEGER,
-            quotation_ro TEXT,
-            start_date TEXT,
-            end_date TEXT,
-            location TEXT,
-            incharge TEXT,
-            notes TEXT,
-            file_name TEXT,
-            enquiry_id TEXT,
-            client_name TEXT,
-            site_location TEXT,
-            engineer_name TEXT,
-            mobile TEXT,
-            status TEXT DEFAULT 'new',
-            total_sqm REAL DEFAULT 0,
-            FOREIGN KEY(vendor_id) REFERENCES vendors(id)
-        )
-    ''')
-
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS duct_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            project_id INTEGER,
-            duct_no TEXT,
-            duct_type TEXT,
-            factor TEXT,
-            width1 REAL,
-            height1 REAL,
-            width2 REAL,
-            height2 REAL,
-            length_or_radius REAL,
-            quantity INTEGER,
-            degree_or_offset TEXT,
-            gauge TEXT,
-            area REAL DEFAULT 0,
-            nuts_bolts TEXT,
-            cleat TEXT,
-            gasket TEXT,
-            corner_pieces TEXT,
-            weight REAL DEFAULT 0,
-            FOREIGN KEY (project_id) REFERENCES projects(id)
-        )
-    ''')
-
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS vendors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            gst TEXT,
-            address TEXT,
-            bank_name TEXT,
-            account_number TEXT,
-            ifsc TEXT
-        )
-    ''')
-
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS vendor_contacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vendor_id INTEGER,
-            name TEXT,
-            phone TEXT,
-            email TEXT,
-            FOREIGN KEY(vendor_id) REFERENCES vendors(id)
-        )
-    ''')
-
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            role TEXT,
-            contact TEXT,
-            email TEXT UNIQUE,
-            password TEXT
-        )
-    ''')
-
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS production_progress (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            project_id INTEGER,
-            sheet_cutting_sqm REAL DEFAULT 0,
-            plasma_fabrication_sqm REAL DEFAULT 0,
-            boxing_assembly_sqm REAL DEFAULT 0
-        )
-    ''')
-
-    cur.execute('''
-        INSERT OR IGNORE INTO users (email, name, role, contact, password)
-        VALUES (?, ?, ?, ?, ?)
-    ''', ("admin@ducting.com", "Admin", "Admin", "9999999999", "admin123"))
-
-    cur.execute('''
-        INSERT OR IGNORE INTO vendors (id, name, gst, address, bank_name, account_number, ifsc)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (1, "Dummy Vendor Pvt Ltd", "29ABCDE1234F2Z5", "123 Main Street, City", "Axis Bank", "1234567890", "UTIB0000123"))
-
-    cur.execute('''
-        INSERT OR IGNORE INTO vendor_contacts (vendor_id, name, phone, email)
-        VALUES (?, ?, ?, ?)
-    ''', (1, "Mr. Dummy", "9876543210", "dummy@vendor.com"))
 
-    conn.commit()
-    conn.close()
+def reprice_command():
+    """Re-price every open project at the current rates."""
+    priced = costing.reprice_open(db.database_path(), workers=current_app.config["REPRICE_WORKERS"])
+    print(f"✅ Re-priced {priced} open projects")
+
+
+@click.option("--project", "project_id", type=int, help="Only this project (default: all).")
+def recalc_command(project_id):
+    """Recompute stored duct areas, gauges and weights after a factor or gauge-rule change."""
+    conn = db.connect(db.database_path())
+    try:
+        cur = conn.cursor()
+        if project_id is None:
+            cur.execute("SELECT id FROM projects ORDER BY id")
+            project_ids = [row[0] for row in cur.fetchall()]
+        else:
+            project_ids = [project_id]
+        updated = 0
+        for pid in project_ids:
+            changed = duct_calc.recalculate_project(conn, pid)
+            if changed:
+                rollups.rebuild(cur, pid)
+            conn.commit()
+            updated += changed
+    finally:
+        conn.close()
+    print(f"✅ Recalculated {updated} ducts in {len(project_ids)} projects")
 
-@app.before_first_request
-def setup_database():
-    print("🔧 Initializing DB...")
-    init_db()
 
 # ---------- ✅ Login ----------
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
@@ -152,28 +134,28 @@ def login():
             session['user'] = user['name']
             session['role'] = user['role']
             flash("✅ Login successful!", "success")
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('.dashboard'))
         else:
             flash("❌ Invalid credentials!", "danger")
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
 
     return render_template("login.html")
 
 # ---------- ✅ Logout ----------
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     flash("🔒 You have been logged out.", "success")
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 # ---------- ✅ Dashboard ----------
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
     if 'user' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     return render_template("dashboard.html", user=session['user'])
 
-@app.route('/vendor_registration', methods=['GET', 'POST'])
+@bp.route('/vendor_registration', methods=['GET', 'POST'])
 def vendor_registration():
     if request.method == 'POST':
         vendor_name = request.form['vendor_name']
@@ -191,58 +173,118 @@ def vendor_registration():
                 'email': request.form.getlist('contact_email')[i],
             })
 
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO vendors (name, gst, address, bank_name, account_number, ifsc) VALUES (?, ?, ?, ?, ?, ?)",
-                    (vendor_name, gst, address, bank_name, account_number, ifsc))
-        vendor_id = cur.lastrowid
+        def register(cur):
+            cur.execute("INSERT INTO vendors (name, gst, address, bank_name, account_number, ifsc) VALUES (?, ?, ?, ?, ?, ?)",
+                        (vendor_name, gst, address, bank_name, account_number, ifsc))
+            vendor_id = cur.lastrowid
 
-        for contact in contacts:
-            cur.execute("INSERT INTO vendor_contacts (vendor_id, name, phone, email) VALUES (?, ?, ?, ?)",
-                        (vendor_id, contact['name'], contact['phone'], contact['email']))
+            for contact in contacts:
+                cur.execute("INSERT INTO vendor_contacts (vendor_id, name, phone, email) VALUES (?, ?, ?, ?)",
+                            (vendor_id, contact['name'], contact['phone'], contact['email']))
 
-        conn.commit()
+        write_queue.write(register)
+        vendor_cache.invalidate()
         flash("✅ Vendor registered successfully!", "success")
-        return redirect(url_for('vendor_registration'))
+        return redirect(url_for('.vendor_registration'))
 
     return render_template('vendor_registration.html')
 
 
-@app.route('/api/vendor/<int:vendor_id>')
+@bp.route('/api/vendor/<int:vendor_id>')
 def get_vendor_info(vendor_id):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT gst, address FROM vendors WHERE id = ?", (vendor_id,))
-    vendor = cur.fetchone()
+    vendor = vendor_cache.get(get_db, vendor_id)
     if vendor:
-        return {'gst': vendor['gst'], 'address': vendor['address']}
+        return vendor
     else:
         return {}, 404
 
-@app.route('/projects')
+def _filter_vendor():
+    """The vendor the listing is filtered by, so the filter box can show its name."""
+    vendor_id = request.args.get('vendor_id', type=int)
+    return vendor_cache.get(get_db, vendor_id) if vendor_id else None
+
+
+@bp.route('/projects')
 def projects():
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM projects ORDER BY id DESC")
-    projects = cur.fetchall()
-    cur.execute("SELECT * FROM vendors ORDER BY id DESC")
-    vendors = cur.fetchall()
-    conn.close()
+    projects, next_cursor = listing.page_projects(cur, request.args)
 
     project = projects[0] if projects else None
+    totals = rollups.project_totals(cur, project['id']) if project else None
+
+    return render_template('projects.html',
+                           projects=projects,
+                           next_url=listing.next_page_url(next_cursor),
+                           filters=request.args,
+                           filter_vendor=_filter_vendor(),
+                           project=project,
+                           totals=totals,
+                           enquiry_id="ENQ" + str(datetime.now().timestamp()).replace(".", ""))
+
+
+@bp.route('/project/<int:project_id>')
+def open_project(project_id):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {listing.PROJECT_COLUMNS}
+        FROM projects p LEFT JOIN vendors v ON v.id = p.vendor_id
+        WHERE p.id = ?
+    """, (project_id,))
+    project = cur.fetchone()
+    if not project:
+        flash("Project not found", "danger")
+        return redirect(url_for('.projects'))
+
+    projects, next_cursor = listing.page_projects(cur, request.args)
+    cur.execute("SELECT * FROM duct_entries WHERE project_id = ? ORDER BY id", (project_id,))
+    entries = cur.fetchall()
+    totals = rollups.project_totals(cur, project_id)
+    drawings = uploads.project_files(cur, project_id)
+    quote = _project_quote(project_id)
 
     return render_template('projects.html',
                            projects=projects,
-                           vendors=vendors,
+                           next_url=listing.next_page_url(next_cursor),
+                           filters=request.args,
+                           filter_vendor=_filter_vendor(),
                            project=project,
+                           drawings=drawings,
+                           quote=quote,
+                           entries=entries,
+                           totals=totals,
                            enquiry_id="ENQ" + str(datetime.now().timestamp()).replace(".", ""))
 
 
-@app.route('/create_project', methods=['POST'])
+@bp.route('/api/projects')
+def api_projects():
+    projects, next_cursor = listing.page_projects(get_db().cursor(), request.args)
+    return jsonify({'items': [dict(p) for p in projects], 'next_cursor': next_cursor})
+
+
+@bp.route('/api/vendors')
+def api_vendors():
+    if 'ids' in request.args:
+        try:
+            ids = [int(i) for i in request.args['ids'].split(',') if i.strip()]
+        except ValueError:
+            return jsonify({'error': "'ids' must be a comma-separated list of vendor ids"}), 400
+        if len(ids) > listing.MAX_PAGE_SIZE:
+            return jsonify({'error': f"At most {listing.MAX_PAGE_SIZE} ids per request"}), 400
+        found = vendor_cache.lookup(get_db, ids)
+        return jsonify({'items': [found[i] for i in dict.fromkeys(ids) if i in found],
+                        'missing': [i for i in dict.fromkeys(ids) if i not in found]})
+    vendors, next_cursor = listing.page_vendors(get_db().cursor(), request.args)
+    return jsonify({'items': [dict(v) for v in vendors], 'next_cursor': next_cursor})
+
+
+@bp.route('/create_project', methods=['POST'])
 def create_project():
     if 'user' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
+    received = None
     try:
         vendor_id = request.form['vendor_id']
         project_name = request.form['project_name']
@@ -255,10 +297,9 @@ def create_project():
         file_name = None
 
         if file and file.filename != '':
-            uploads_dir = os.path.join('static', 'uploads')
-            os.makedirs(uploads_dir, exist_ok=True)
-            file_name = file.filename
-            file.save(os.path.join(uploads_dir, file_name))
+            received = uploads.receive(file.stream, current_app.config['UPLOAD_DIR'], file.filename,
+                                       current_app.config['UPLOAD_MAX_BYTES'])
+            file_name = received.file_name
 
         conn = get_db()
         cur = conn.cursor()
@@ -273,18 +314,25 @@ def create_project():
             '', incharge, notes, file_name,
             enquiry_no, project_name
         ))
+        if received:
+            uploads.attach(conn, current_app.config['UPLOAD_DIR'], received, cur.lastrowid, session['user'])
 
         conn.commit()
-        conn.close()
         flash("✅ Project added successfully!", "success")
-        return redirect(url_for('projects'))
+        return redirect(url_for('.projects'))
 
+    except uploads.UploadTooLarge as e:
+        flash(f"❌ {e}", "danger")
+        return redirect(url_for('.projects'))
     except Exception as e:
         print("❌ Error while creating project:", e)
         return "Bad Request", 400
+    finally:
+        if received:
+            received.discard()
 
 
-@app.route('/add_measurement', methods=['POST'])
+@bp.route('/add_measurement', methods=['POST'])
 def add_measurement():
     project_id = request.form['project_id']
     client_name = request.form['client_name']
@@ -292,441 +340,618 @@ def add_measurement():
     engineer_name = request.form['engineer_name']
     mobile = request.form['mobile']
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('''
-        UPDATE projects SET
-        client_name = ?, site_location = ?, engineer_name = ?, mobile = ?, status = ?
-        WHERE id = ?
-    ''', (client_name, site_location, engineer_name, mobile, 'preparation', project_id))
-    conn.commit()
+    def update(cur):
+        cur.execute('''
+            UPDATE projects SET
+            client_name = ?, site_location = ?, engineer_name = ?, mobile = ?, status = ?
+            WHERE id = ?
+        ''', (client_name, site_location, engineer_name, mobile, 'preparation', project_id))
+
+    write_queue.write(update)
     return '', 200
 
-@app.route('/add_duct', methods=['POST'])
+@bp.route('/add_duct', methods=['POST'])
 def add_duct():
-    import math
     project_id = request.form['project_id']
-    duct_no = request.form['duct_no']
-    duct_type = request.form['duct_type'].upper()
-    w1 = float(request.form.get('width1') or 0)
-    h1 = float(request.form.get('height1') or 0)
-    w2 = float(request.form.get('width2') or 0)
-    h2 = float(request.form.get('height2') or 0)
-    qty = int(request.form.get('quantity') or 0)
-    length = float(request.form.get('length_or_radius') or 0)
-    deg = float(request.form.get('degree_or_offset') or 0)
-    factor = float(request.form.get('factor') or 1.0)
-
-    # Calculate area based on type
-    area = 0
-    if duct_type == 'ST':
-        area = 2 * (w1 + h1) / 1000 * (length / 1000) * qty
-    elif duct_type == 'RED':
-        area = (w1 + h1 + w2 + h2) / 1000 * (length / 1000) * qty * factor
-    elif duct_type == 'DUM':
-        area = (w1 * h1) / 1000000 * qty
-    elif duct_type == 'OFFSET':
-        area = (w1 + h1 + w2 + h2) / 1000 * ((length + deg) / 1000) * qty * factor
-    elif duct_type == 'SHOE':
-        area = (w1 + h1) * 2 / 1000 * (length / 1000) * qty * factor
-    elif duct_type == 'VANES':
-        area = w1 / 1000 * (2 * math.pi * (w1 / 1000) / 4) * qty
-    elif duct_type == 'ELB':
-        area = 2 * (w1 + h1) / 1000 * ((h1 / 2 / 1000) + (length / 1000) * (math.pi * (deg / 180))) * qty * factor
-
-    # Gauge logic
-    gauge = '18g'
-    if w1 <= 751 and h1 <= 751:
-        gauge = '24g'
-    elif w1 <= 1201 and h1 <= 1201:
-        gauge = '22g'
-    elif w1 <= 1800 and h1 <= 1800:
-        gauge = '20g'
-
-    nuts_bolts = qty * 4
-
-    cleat_factor = 12
-    if gauge == '24g':
-        cleat_factor = 4
-    elif gauge == '22g':
-        cleat_factor = 8
-    elif gauge == '20g':
-        cleat_factor = 10
-    cleat = qty * cleat_factor
-
-    gasket = (w1 + h1 + w2 + h2) / 1000 * qty
-    corner_pieces = 0 if duct_type == 'DUM' else qty * 8
+    duct = {
+        'duct_no': request.form['duct_no'],
+        'duct_type': request.form['duct_type'].upper(),
+        'width1': float(request.form.get('width1') or 0),
+        'height1': float(request.form.get('height1') or 0),
+        'width2': float(request.form.get('width2') or 0),
+        'height2': float(request.form.get('height2') or 0),
+        'quantity': int(request.form.get('quantity') or 0),
+        'length_or_radius': float(request.form.get('length_or_radius') or 0),
+        'degree_or_offset': float(request.form.get('degree_or_offset') or 0),
+        'factor': float(request.form.get('factor') or 1.0),
+    }
+    duct.update(duct_calc.compute_one(**duct))
+
+    def insert(cur):
+        cur.execute('''
+            INSERT INTO duct_entries (
+                project_id, duct_no, duct_type, width1, height1, width2, height2,
+                quantity, length_or_radius, degree_or_offset, factor,
+                area, gauge, nuts_bolts, cleat, gasket, corner_pieces, weight
+            ) VALUES (:project_id, :duct_no, :duct_type, :width1, :height1, :width2, :height2,
+                      :quantity, :length_or_radius, :degree_or_offset, :factor,
+                      :area, :gauge, :nuts_bolts, :cleat, :gasket, :corner_pieces, :weight)
+        ''', {**duct, 'project_id': project_id})
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO duct_entries (
-            project_id, duct_no, duct_type, width1, height1, width2, height2,
-            quantity, length_or_radius, degree_or_offset, factor,
-            area, gauge, nuts_bolts, cleat, gasket, corner_pieces
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        project_id, duct_no, duct_type, w1, h1, w2, h2,
-        qty, length, deg, factor,
-        round(area, 2), gauge, round(nuts_bolts, 2), round(cleat, 2),
-        round(gasket, 2), round(corner_pieces, 2)
-    ))
-    conn.commit()
-    conn.close()
+    try:
+        write_queue.write(insert)
+    except sqlite3.IntegrityError as e:
+        if "FOREIGN KEY" in str(e):
+            flash("Project not found", "danger")
+            return redirect(url_for('.projects'))
+        flash(f"Duct entry not added: {e}", "danger")
+        return redirect(url_for('.open_project', project_id=project_id))
 
     flash("Duct entry added successfully!", "success")
-    return redirect(url_for('open_project', project_id=project_id))
+    return redirect(url_for('.open_project', project_id=project_id))
+
+
+@bp.route('/api/projects/<int:project_id>/ducts/batch', methods=['POST'])
+def api_duct_batch(project_id):
+    payload = request.get_json(silent=True)
+    try:
+        operations, atomic = duct_batch.parse(payload)
+    except duct_batch.BatchError as e:
+        return jsonify({'error': str(e)}), 400
 
+    conn = get_db()
+    if conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone() is None:
+        return jsonify({'error': 'Project not found'}), 404
+    report = duct_batch.apply(conn, project_id, operations, atomic=atomic)
+    return jsonify(report), 200 if report['committed'] else 409
+
+
+@bp.route('/import_ducts/<int:project_id>', methods=['POST'])
+def import_ducts(project_id):
+    file = request.files.get('schedule_file')
+    wants_json = request.args.get('format') == 'json'
+    if not file or file.filename == '':
+        if wants_json:
+            return jsonify({'error': 'No file uploaded'}), 400
+        flash("❌ Choose a duct schedule to import.", "danger")
+        return redirect(url_for('.open_project', project_id=project_id))
+
+    conn = get_db()
+    if conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone() is None:
+        if wants_json:
+            return jsonify({'error': 'Project not found'}), 404
+        flash("Project not found", "danger")
+        return redirect(url_for('.projects'))
+    try:
+        report = duct_import.import_ducts(conn, project_id, duct_import.read_rows(file))
+    except duct_import.ScheduleFormatError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(f"❌ Import failed: {e}", "danger")
+        return redirect(url_for('.open_project', project_id=project_id))
 
-@app.route("/edit_duct/<int:entry_id>", methods=["GET", "POST"])
+    if wants_json:
+        return jsonify(report)
+
+    flash(f"✅ Imported {report['imported']} duct entries.", "success")
+    for error in report['errors'][:10]:
+        flash(f"Row {error['row']}: {error['error']}", "danger")
+    if len(report['errors']) > 10:
+        flash(f"... and {len(report['errors']) - 10} more rows skipped.", "danger")
+    return redirect(url_for('.open_project', project_id=project_id))
+
+
+@bp.route("/edit_duct/<int:entry_id>", methods=["GET", "POST"])
 def edit_duct(entry_id):
     conn = get_db()
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     cur.execute("SELECT * FROM duct_entries WHERE id = ?", (entry_id,))
     entry = cur.fetchone()
 
     if not entry:
         flash("Entry not found", "danger")
-        return redirect(url_for("projects"))
+        return redirect(url_for(".projects"))
 
     project_id = entry["project_id"]
 
     if request.method == "POST":
         data = {
             "duct_no": request.form.get("duct_no"),
-            "duct_type": request.form.get("duct_type"),
-            "width1": request.form.get("width1"),
-            "height1": request.form.get("height1"),
-            "width2": request.form.get("width2"),
-            "height2": request.form.get("height2"),
-            "length_or_radius": request.form.get("length_or_radius"),
-            "degree_or_offset": request.form.get("degree_or_offset"),
-            "quantity": request.form.get("quantity"),
-            "gauge": request.form.get("gauge"),
-            "factor": request.form.get("factor"),
-            "area": request.form.get("area"),
-            "nuts_bolts": request.form.get("nuts_bolts"),
-            "cleat": request.form.get("cleat"),
-            "gasket": request.form.get("gasket"),
-            "corner_pieces": request.form.get("corner_pieces")
+            "duct_type": (request.form.get("duct_type") or "").upper(),
+            "width1": float(request.form.get("width1") or 0),
+            "height1": float(request.form.get("height1") or 0),
+            "width2": float(request.form.get("width2") or 0),
+            "height2": float(request.form.get("height2") or 0),
+            "length_or_radius": float(request.form.get("length_or_radius") or 0),
+            "degree_or_offset": float(request.form.get("degree_or_offset") or 0),
+            "quantity": int(request.form.get("quantity") or 0),
+            "factor": float(request.form.get("factor") or 1.0),
         }
+        data.update(duct_calc.compute_one(**data))
 
-        cur.execute("""
-            UPDATE duct_entries SET
-              duct_no = :duct_no,
-              duct_type = :duct_type,
-              width1 = :width1,
-              height1 = :height1,
-              width2 = :width2,
-              height2 = :height2,
-              length_or_radius = :length_or_radius,
-              degree_or_offset = :degree_or_offset,
-              quantity = :quantity,
-              gauge = :gauge,
-              factor = :factor,
-              area = :area,
-              nuts_bolts = :nuts_bolts,
-              cleat = :cleat,
-              gasket = :gasket,
-              corner_pieces = :corner_pieces
-            WHERE id = :entry_id
-        """, {**data, "entry_id": entry_id})
-        conn.commit()
-        conn.close()
+        def update(cur):
+            cur.execute("""
+                UPDATE duct_entries SET
+                  duct_no = :duct_no,
+                  duct_type = :duct_type,
+                  width1 = :width1,
+                  height1 = :height1,
+                  width2 = :width2,
+                  height2 = :height2,
+                  length_or_radius = :length_or_radius,
+                  degree_or_offset = :degree_or_offset,
+                  quantity = :quantity,
+                  gauge = :gauge,
+                  factor = :factor,
+                  area = :area,
+                  nuts_bolts = :nuts_bolts,
+                  cleat = :cleat,
+                  gasket = :gasket,
+                  corner_pieces = :corner_pieces,
+                  weight = :weight
+                WHERE id = :entry_id
+            """, {**data, "entry_id": entry_id})
+
+        try:
+            write_queue.write(update)
+        except sqlite3.IntegrityError as e:
+            flash(f"Entry not updated: {e}", "danger")
+            return render_template("edit_duct_entry.html", entry=entry)
         flash("Entry updated successfully", "success")
-        return redirect(url_for('open_project', project_id=project_id))
+        return redirect(url_for('.open_project', project_id=project_id))
 
-    conn.close()
     return render_template("edit_duct_entry.html", entry=entry)
 
 
-@app.route("/delete_duct/<int:entry_id>", methods=["POST"])
+@bp.route("/delete_duct/<int:entry_id>", methods=["POST"])
 def delete_duct(entry_id):
-    conn = get_db()
-    cur = conn.cursor()
+    def delete(cur):
+        cur.execute("DELETE FROM duct_entries WHERE id = ? RETURNING project_id", (entry_id,))
+        return cur.fetchone()
 
-    cur.execute("SELECT project_id FROM duct_entries WHERE id = ?", (entry_id,))
-    result = cur.fetchone()
+    result = write_queue.write(delete)
 
     if result:
-        project_id = result[0]
-        cur.execute("DELETE FROM duct_entries WHERE id = ?", (entry_id,))
-        conn.commit()
         flash("Entry deleted successfully", "success")
     else:
         flash("Entry not found", "danger")
+        return redirect(url_for(".projects"))
 
-    conn.close()
-    return redirect(url_for("open_project", project_id=project_id))
-
-@app.route('/export_pdf/<int:project_id>')
-def export_pdf(project_id):
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import A4
-    from reportlab.platypus import Table, TableStyle
-    from reportlab.lib import colors
-    from io import BytesIO
-    from num2words import num2words
-    import os
-
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-
-    conn = sqlite3.connect('database.db')
-    c = conn.cursor()
-    c.execute("""
-        SELECT client_name, site_location, engineer_name, mobile, start_date, end_date
-        FROM projects WHERE id = ?
-    """, (project_id,))
-    proj = c.fetchone()
-    client_name = proj[0] if proj else "Project"
-    site_location = proj[1] if proj else ""
-    engineer_name = proj[2] if proj else ""
-    mobile = proj[3] if proj else ""
-    start_date = proj[4] if proj else ""
-    end_date = proj[5] if proj else ""
-
-    logo_path = os.path.join("static", "logo.png")
-    if os.path.exists(logo_path):
-        p.drawImage(logo_path, 50, height - 80, width=80, preserveAspectRatio=True, mask='auto')
-
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(200, height - 50, "Vanes Engineering Pvt Ltd")
-    p.setFont("Helvetica", 10)
-    p.drawString(200, height - 65, "No. 23, Industrial Estate, Chennai")
-    p.drawString(200, height - 78, "Email: info@vanesengineering.com | Phone: +91-98765-43210")
-
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, height - 110, f"Client: {client_name}")
-    p.drawString(300, height - 110, f"Site: {site_location}")
-    p.drawString(50, height - 125, f"Engineer: {engineer_name}")
-    p.drawString(300, height - 125, f"Mobile: {mobile}")
-    p.drawString(50, height - 140, f"Duration: {start_date} to {end_date}")
-
-    c.execute("""
-        SELECT duct_no, duct_type, width1, height1, quantity, area, weight
-        FROM duct_entries WHERE project_id = ?
-    """, (project_id,))
-    entries = c.fetchall()
-    conn.close()
-
-    data = [["Duct No", "Type", "Width", "Height", "Qty", "Area", "Weight"]]
-    total_qty = total_area = total_weight = 0
-
-    for row in entries:
-        w = float(row[2]) if row[2] else 0
-        h = float(row[3]) if row[3] else 0
-        qty = float(row[4]) if row[4] else 0
-        area = float(row[5]) if row[5] else 0
-        weight = float(row[6]) if row[6] else 0
-        data.append([row[0], row[1], w, h, qty, area, weight])
-        total_qty += qty
-        total_area += area
-        total_weight += weight
-
-    data.append(["", "", "", "Total", total_qty, round(total_area, 2), round(total_weight, 2)])
-
-    table = Table(data, colWidths=[60, 55, 50, 50, 50, 60, 60])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER')
-    ]))
-    table.wrapOn(p, width, height)
-    table.drawOn(p, 50, height - 190 - 25 * len(data))
-
-    def convert_to_words(value):
-        try:
-            int_part = int(value)
-            decimal_part = int(round((value - int_part) * 100))
-            return f"{num2words(int_part).capitalize()} point {num2words(decimal_part)}"
-        except:
-            return "Not available"
-
-    area_words = convert_to_words(round(total_area, 2))
-    weight_words = convert_to_words(round(total_weight, 2))
-
-    p.setFont("Helvetica-Bold", 10)
-    p.drawString(50, height - 210 - 25 * len(data), f"Total Area in Words: {area_words} sq.m")
-    p.drawString(50, height - 225 - 25 * len(data), f"Total Weight in Words: {weight_words} kg")
-
-    p.setFont("Helvetica", 10)
-    p.drawString(50, 80, "Engineer Signature: __________________")
-    p.drawString(300, 80, "Client Signature: __________________")
+    return redirect(url_for(".open_project", project_id=result[0]))
 
-    p.showPage()
-    p.save()
-    buffer.seek(0)
+def send_export(kind, project_id):
+    """Serve a project export from the cache, rendering it on a miss.
 
-    return send_file(buffer, as_attachment=True,
-                     download_name=f"{client_name}_duct_sheet.pdf",
-                     mimetype='application/pdf')
+    The ETag is derived from the project's content version, so a client
+    holding the current file gets a 304 without anything being rendered.
+    """
+    conn = get_db()
+    cache = current_app.extensions['export_cache']
+    write, mimetype, name_pattern = jobs.KINDS[kind]
+    with export_cache.snapshot(conn):
+        cur = conn.cursor()
+        version = export_cache.project_version(cur, project_id)
+        etag = export_cache.etag(project_id, version, kind)
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            header = exports.project_header(cur, project_id)
+            cached = cache.get(project_id, version, kind)
+            if cached is None:
+                with metrics.render_timer(kind):
+                    cached = cache.put(project_id, version, kind, lambda fh: write(conn, project_id, fh))
+            response = send_file(cached, as_attachment=True,
+                                 download_name=name_pattern.format(project_id=project_id, **header),
+                                 mimetype=mimetype, conditional=False)
+            response.content_length = os.fstat(cached.fileno()).st_size
+    response.set_etag(etag)
+    # Always revalidate; the ETag makes that a cheap 304.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/export_pdf/<int:project_id>')
+def export_pdf(project_id):
+    return send_export('pdf', project_id)
 
 
-@app.route("/export_excel/<int:project_id>")
+@bp.route("/export_excel/<int:project_id>")
 def export_excel(project_id):
-    try:
-        conn = sqlite3.connect("database.db")
-        query = "SELECT * FROM duct_entries WHERE project_id = ?"
-        df = pd.read_sql_query(query, conn, params=(project_id,))
-        conn.close()
-
-        if df.empty:
-            return "No data available for this project.", 404
-
-        file_path = f"project_{project_id}_entries.xlsx"
-        df.to_excel(file_path, index=False)
-
-        return send_file(file_path, as_attachment=True)
+    conn = get_db()
+    if not rollups.project_totals(conn.cursor(), project_id)['duct_count']:
+        return "No data available for this project.", 404
 
+    try:
+        return send_export('excel', project_id)
     except Exception as e:
         return f"Error exporting data: {e}", 500
 
+
+@bp.route("/export_bulk")
+def export_bulk():
+    """PDF and XLSX of every project matching the listing filters, as one streamed ZIP."""
+    kinds = [kind for kind in (request.args.get('kinds') or ','.join(bulk_export.KINDS)).split(',') if kind]
+    unknown = [kind for kind in kinds if kind not in jobs.KINDS]
+    if unknown or not kinds:
+        return jsonify({'error': f"kinds must be a comma-separated subset of {', '.join(jobs.KINDS)}"}), 400
+    projects = bulk_export.select_projects(get_db().cursor(), request.args)
+    if not projects:
+        return "No projects match these filters.", 404
+
+    stream = bulk_export.stream(db.database_path(), current_app.extensions['export_cache'], projects,
+                                kinds, current_app.config['BULK_EXPORT_WORKERS'])
+    response = current_app.response_class(stream, mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment',
+                         filename=f"duct_sheets_{datetime.now():%Y%m%d_%H%M}.zip")
+    # Let proxies pass each file on as soon as it is rendered.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ---------- ✅ Project Drawings ----------
+def _store_drawing(project_id, stream, file_name):
+    """Stream an upload into storage and attach it to a project; returns the file id."""
+    upload_dir = current_app.config['UPLOAD_DIR']
+    received = uploads.receive(stream, upload_dir, file_name, current_app.config['UPLOAD_MAX_BYTES'])
+    try:
+        conn = get_db()
+        file_id = uploads.attach(conn, upload_dir, received, project_id, session.get('user'))
+        conn.commit()
     finally:
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
+        received.discard()
+    jobs.ensure_started().notify()
+    return file_id
 
 
-@app.route("/production/<int:project_id>")
+def _project_exists(project_id):
+    cur = get_db().cursor()
+    cur.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,))
+    return cur.fetchone() is not None
+
+
+@bp.route('/project/<int:project_id>/drawings', methods=['POST'])
+def upload_drawing(project_id):
+    file = request.files.get('drawing_file')
+    if not file or file.filename == '':
+        flash("❌ Choose a drawing to upload.", "danger")
+    elif not _project_exists(project_id):
+        flash("Project not found", "danger")
+        return redirect(url_for('.projects'))
+    else:
+        try:
+            _store_drawing(project_id, file.stream, file.filename)
+            flash("✅ Drawing uploaded.", "success")
+        except uploads.UploadTooLarge as e:
+            flash(f"❌ {e}", "danger")
+    return redirect(url_for('.open_project', project_id=project_id))
+
+
+@bp.route('/api/projects/<int:project_id>/drawings/<path:file_name>', methods=['PUT'])
+def api_upload_drawing(project_id, file_name):
+    """Raw request body upload: streamed straight to storage without form parsing."""
+    if not _project_exists(project_id):
+        return jsonify({'error': 'Project not found'}), 404
+    try:
+        file_id = _store_drawing(project_id, request.stream, file_name)
+    except uploads.UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    drawing = uploads.get_file(get_db().cursor(), file_id)
+    return jsonify({'id': file_id, 'file_name': drawing['file_name'], 'sha256': drawing['sha256'],
+                    'size': drawing['size'], 'url': url_for('.download_file', file_id=file_id)}), 201
+
+
+def _send_stored(path, mimetype, etag, download_name=None):
+    """A stored file with Range support; its content never changes, so it may be cached for good."""
+    inline = mimetype in uploads.INLINE_MIMETYPES
+    response = send_file(os.path.abspath(path), mimetype=mimetype if inline else 'application/octet-stream',
+                         as_attachment=not inline, download_name=download_name,
+                         conditional=True, etag=etag, max_age=365 * 24 * 3600)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/files/<int:file_id>')
+def download_file(file_id):
+    drawing = uploads.get_file(get_db().cursor(), file_id)
+    path = drawing and uploads.path(current_app.config['UPLOAD_DIR'], drawing['sha256'])
+    if not drawing or not os.path.exists(path):
+        return "File not found.", 404
+    return _send_stored(path, drawing['mimetype'], drawing['sha256'], drawing['file_name'])
+
+
+@bp.route('/files/<int:file_id>/thumbnail')
+def file_thumbnail(file_id):
+    drawing = uploads.get_file(get_db().cursor(), file_id)
+    if not drawing or drawing['thumbnail'] != 'done':
+        return "Thumbnail not available.", 404
+    path = uploads.thumbnail_path(current_app.config['UPLOAD_DIR'], drawing['sha256'])
+    if not os.path.exists(path):
+        return "Thumbnail not available.", 404
+    return _send_stored(path, 'image/jpeg', f"{drawing['sha256']}-thumb")
+
+
+# ---------- ✅ Background Export Jobs ----------
+@bp.route('/jobs/export/<kind>/<int:project_id>', methods=['POST'])
+def enqueue_export(kind, project_id):
+    if kind not in jobs.KINDS:
+        return jsonify({'error': f"Unknown export kind '{kind}'"}), 404
+    conn = get_db()
+    job_id = jobs.enqueue(conn, kind, project_id)
+    conn.commit()
+    jobs.ensure_started().notify()
+    return jsonify({'id': job_id, 'status': 'queued',
+                    'status_url': url_for('.job_status', job_id=job_id)}), 202
+
+
+@bp.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = jobs.get(get_db(), job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    result = {key: job[key] for key in ('id', 'kind', 'project_id', 'status', 'progress',
+                                        'error', 'created_at', 'started_at', 'finished_at')}
+    if job['status'] == 'done':
+        result['download_url'] = url_for('.job_download', job_id=job_id)
+    return jsonify(result)
+
+
+@bp.route('/jobs/<int:job_id>/download')
+def job_download(job_id):
+    job = jobs.get(get_db(), job_id)
+    if not job or job['status'] != 'done' or not os.path.exists(job['artifact_path']):
+        return "Export not available.", 404
+    return send_file(os.path.abspath(job['artifact_path']), as_attachment=True,
+                     download_name=job['download_name'],
+                     mimetype=jobs.KINDS[job['kind']][1])
+
+
+@bp.route("/production/<int:project_id>")
 def production(project_id):
     conn = get_db()
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
 
     cur.execute("SELECT * FROM projects WHERE id = ?", (project_id,))
     project = cur.fetchone()
     if not project:
         flash("Project not found", "danger")
-        return redirect(url_for('projects'))
+        return redirect(url_for('.projects'))
 
     cur.execute("SELECT * FROM duct_entries WHERE project_id = ?", (project_id,))
     ducts = cur.fetchall()
-
-    total_area = 0
-    total_weight = 0
-
-    for duct in ducts:
-        try:
-            width = float(duct["width1"])
-            height = float(duct["height1"])
-            qty = int(duct["quantity"])
-            area = round(width * height * qty, 2)
-            weight = round(area * 0.035, 2)
-
-            cur.execute("""
-                UPDATE duct_entries
-                SET area = ?, weight = ?
-                WHERE id = ?
-            """, (area, weight, duct["id"]))
-
-            total_area += area
-            total_weight += weight
-        except Exception as e:
-            print("Calculation error:", e)
-
-    cur.execute("UPDATE projects SET total_sqm = ? WHERE id = ?", (total_area, project_id))
-    conn.commit()
+    totals = rollups.project_totals(cur, project_id)
+    gauges = rollups.gauge_totals(cur, project_id)
+    sheets = takeoff.project_takeoff(cur, project_id)
+    history = progress_log.history(cur, project_id, limit=20)
 
     cur.execute("SELECT * FROM production_progress WHERE project_id = ?", (project_id,))
-    progress = cur.fetchone()
-
-    if not progress:
-        cur.execute("""
-            INSERT INTO production_progress (project_id, sheet_cutting_sqm, plasma_fabrication_sqm, boxing_assembly_sqm)
-            VALUES (?, 0, 0, 0)
-        """, (project_id,))
-        conn.commit()
-        cur.execute("SELECT * FROM production_progress WHERE project_id = ?", (project_id,))
-        progress = cur.fetchone()
-
-    conn.close()
+    progress = cur.fetchone() or {
+        'sheet_cutting_sqm': 0, 'plasma_fabrication_sqm': 0, 'boxing_assembly_sqm': 0
+    }
 
     return render_template("production.html",
                            project=project,
                            ducts=ducts,
                            progress=progress,
-                           total_area=total_area,
-                           total_weight=total_weight)
+                           totals=totals,
+                           gauges=gauges,
+                           sheets=sheets,
+                           sheet_totals=takeoff.totals(sheets),
+                           sheet_size=(takeoff.SHEET_LENGTH, takeoff.SHEET_WIDTH),
+                           history=history,
+                           stage_labels={stage: label for stage, _, label in progress_log.STAGES},
+                           total_area=totals['total_area'],
+                           total_weight=totals['total_weight'])
+
+
+@bp.route("/update_production/<int:project_id>", methods=["POST"])
+def update_production(project_id):
+    values = {stage: float(request.form.get(stage) or 0) for stage, _, _ in progress_log.STAGES}
+    user = session.get('user')
 
+    try:
+        write_queue.write(lambda cur: progress_log.record(cur, project_id, values, recorded_by=user))
+    except sqlite3.IntegrityError:
+        flash("Project not found", "danger")
+        return redirect(url_for('.projects'))
+    return redirect(url_for('.production', project_id=project_id))
 
-@app.route("/update_production/<int:project_id>", methods=["POST"])
-def update_production(project_id):
-    sheet_cutting = float(request.form.get("sheet_cutting") or 0)
-    plasma_fabrication = float(request.form.get("plasma_fabrication") or 0)
-    boxing_assembly = float(request.form.get("boxing_assembly") or 0)
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE production_progress
-        SET sheet_cutting_sqm = ?, plasma_fabrication_sqm = ?, boxing_assembly_sqm = ?
-        WHERE project_id = ?
-    """, (sheet_cutting, plasma_fabrication, boxing_assembly, project_id))
-    conn.commit()
-    conn.close()
-    return redirect(url_for('production', project_id=project_id))
+@bp.route("/api/production/<int:project_id>/as_of")
+def api_production_as_of(project_id):
+    day = request.args.get('date') or datetime.now().date().isoformat()
+    try:
+        totals = progress_log.as_of(get_db().cursor(), project_id, day)
+    except ValueError:
+        return jsonify({'error': "date must be YYYY-MM-DD"}), 400
+    return jsonify({'project_id': project_id, 'date': day, 'stages': totals})
+
+
+@bp.route("/api/production/throughput")
+def api_production_throughput():
+    try:
+        until = date.fromisoformat(request.args['until']) if request.args.get('until') else date.today()
+        since = date.fromisoformat(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': "since/until must be YYYY-MM-DD"}), 400
+    since = since or until - timedelta(days=30)
+    if since > until:
+        return jsonify({'error': "since must not be after until"}), 400
+    since, until = since.isoformat(), until.isoformat()
+    project_id = request.args.get('project_id', type=int)
+    rows = progress_log.throughput(get_db().cursor(), since, until, project_id)
+    return jsonify({'since': since, 'until': until, 'project_id': project_id, 'items': rows})
 
 # ---------- ✅ View All Projects in Production ----------
-@app.route("/production_overview")
+OVERVIEW_COLUMNS = listing.PROJECT_COLUMNS + """,
+    IFNULL(t.total_qty, 0) AS total_qty, IFNULL(t.total_weight, 0) AS total_weight
+"""
+OVERVIEW_JOINS = "LEFT JOIN project_totals t ON t.project_id = p.id"
+
+@bp.route("/production_overview")
 def production_overview():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM projects")
-    projects = cur.fetchall()
-    conn.close()
-    return render_template("production_overview.html", projects=projects)
+    projects, next_cursor = listing.page_projects(get_db().cursor(), request.args,
+                                                  columns=OVERVIEW_COLUMNS, joins=OVERVIEW_JOINS)
+    return render_template("production_overview.html", projects=projects,
+                           next_url=listing.next_page_url(next_cursor), filters=request.args)
+
+
+@bp.route("/api/production_overview")
+def api_production_overview():
+    projects, next_cursor = listing.page_projects(get_db().cursor(), request.args,
+                                                  columns=OVERVIEW_COLUMNS, joins=OVERVIEW_JOINS)
+    return jsonify({'items': [dict(p) for p in projects], 'next_cursor': next_cursor})
 
 
 # ---------- ✅ Summary Placeholder ----------
-@app.route('/summary')
+@bp.route('/summary')
 def summary():
-    return "<h2>Summary Coming Soon...</h2>"
+    return render_template('summary.html', summary=analytics.summary(get_db().cursor()))
 
 
-# ---------- ✅ Submit Full Project and Move to Production ----------
-@app.route('/submit_all/<project_id>', methods=['POST'])
-def submit_all(project_id):
+@bp.route('/api/summary')
+def api_summary():
+    return jsonify(analytics.summary(get_db().cursor()))
+
+
+# ---------- ✅ Costing ----------
+def _project_quote(project_id):
+    """The project's current quote, storing it if it had to be re-priced."""
+    quote, stale_row = costing.quote(get_db(), project_id)
+    if stale_row is not None:
+        write_queue.write(lambda cur: costing.store(cur, [stale_row]))
+    return quote
+
+
+def _publish_rates(values, note):
+    user = session.get('user')
+    version = write_queue.write(lambda cur: costing.publish_rates(cur, values, user, note))
+    costing.reprice_in_background(db.database_path(), workers=current_app.config["REPRICE_WORKERS"])
+    return version
+
+
+@bp.route('/rates', methods=['GET', 'POST'])
+def rates():
+    if request.method == 'POST':
+        try:
+            version = _publish_rates(request.form, request.form.get('note'))
+            flash(f"✅ Rates v{version} published; open projects are being re-priced.", "success")
+        except ValueError as e:
+            flash(f"❌ {e}", "danger")
+        return redirect(url_for('.rates'))
+
+    cur = get_db().cursor()
+    return render_template('rates.html', items=costing.ITEMS, rates=costing.rates(cur),
+                           version=costing.current_version(cur), versions=costing.versions(cur))
+
+
+@bp.route('/api/rates', methods=['GET', 'POST'])
+def api_rates():
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Expected a JSON object of rates'}), 400
+        try:
+            version = _publish_rates(payload.get('rates') or {}, payload.get('note'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'version': version}), 201
+
+    cur = get_db().cursor()
+    version = request.args.get('version', type=int) or costing.current_version(cur)
+    try:
+        table = costing.rates(cur, version)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'version': version, 'rates': table,
+                    'items': [{'item': item, 'label': label, 'unit': unit} for item, label, unit in costing.ITEMS]})
+
+
+@bp.route('/api/projects/<int:project_id>/quote')
+def api_project_quote(project_id):
+    if not _project_exists(project_id):
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify(_project_quote(project_id))
+
+
+# ---------- ✅ Search ----------
+def _search_kinds():
+    kind = request.args.get('type')
+    return (kind,) if kind in search.KINDS else search.KINDS
+
+
+@bp.route('/search')
+def search_view():
+    q = (request.args.get('q') or '').strip()
+    hits, next_cursor = search.search(get_db().cursor(), q, _search_kinds(), request.args)
+    return render_template('search.html', q=q, hits=hits, kind=request.args.get('type') or '',
+                           next_url=listing.next_page_url(next_cursor))
+
+
+@bp.route('/api/search')
+def api_search():
+    q = (request.args.get('q') or '').strip()
+    hits, next_cursor = search.search(get_db().cursor(), q, _search_kinds(), request.args)
+    return jsonify({'q': q, 'items': hits, 'next_cursor': next_cursor})
+
+
+# ---------- ✅ Tablet Sync ----------
+def _compact_json(payload):
+    """JSON without whitespace, gzipped when the client accepts it."""
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    response = current_app.response_class(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@bp.route('/api/sync')
+def api_sync():
+    since = request.args.get('since', 0, type=int)
+    project_id = request.args.get('project_id', type=int)
+    limit = max(1, min(request.args.get('limit', sync.PAGE_SIZE, type=int), sync.MAX_PAGE_SIZE))
     conn = get_db()
-    cur = conn.cursor()
+    with export_cache.snapshot(conn):
+        payload = sync.changes(conn.cursor(), since, project_id, limit)
+    return _compact_json(payload)
 
-    # ✅ Mark project as submitted
-    cur.execute("UPDATE projects SET status = 'submitted' WHERE id = ?", (project_id,))
 
-    # Optional: Lock duct entries (commented for now)
-    # cur.execute("UPDATE duct_entries SET status = 'locked' WHERE project_id = ?", (project_id,))
+# ---------- ✅ Submit Full Project and Move to Production ----------
+@bp.route('/submit_all/<project_id>', methods=['POST'])
+def submit_all(project_id):
+    def submit(cur):
+        # ✅ Mark project as submitted
+        cur.execute("UPDATE projects SET status = 'submitted' WHERE id = ?", (project_id,))
 
-    conn.commit()
-    conn.close()
+        # Optional: Lock duct entries (commented for now)
+        # cur.execute("UPDATE duct_entries SET status = 'locked' WHERE project_id = ?", (project_id,))
+
+    write_queue.write(submit)
 
     flash("✅ Project submitted and moved to production.", "success")
-    return redirect(url_for('production', project_id=project_id))
+    return redirect(url_for('.production', project_id=project_id))
 
 
 # ---------- ✅ Delete Project ----------
-@app.route('/project/<int:project_id>/delete', methods=['POST'])
+@bp.route('/project/<int:project_id>/delete', methods=['POST'])
 def delete_project(project_id):
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # Delete related ducts and project
-    cur.execute("DELETE FROM duct_entries WHERE project_id = ?", (project_id,))
-    cur.execute("DELETE FROM production_progress WHERE project_id = ?", (project_id,))
-    cur.execute("DELETE FROM projects WHERE id = ?", (project_id,))
-    
-    conn.commit()
-    conn.close()
-    
+    def delete(cur):
+        # Ducts and production progress go with it (ON DELETE CASCADE)
+        cur.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+
+    write_queue.write(delete)
+
     flash("🗑️ Project deleted successfully!", "success")
-    return redirect(url_for('projects'))
+    return redirect(url_for('.projects'))
 
 
 # ---------- ✅ Run App -------
-
-# ... your routes ...
+app = create_app()
 
 if __name__ == "__main__":
+    migrations.main([db.database_path(app)])
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
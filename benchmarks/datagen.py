@@ -0,0 +1,213 @@
+"""Seeded synthetic ERP data: vendors, contacts, projects and ducts.
+
+The same seed and sizes always produce the same database, so benchmark runs
+are comparable::
+
+    python -m benchmarks.datagen bench.db --projects 10000 --ducts 2000000
+
+Ducts are spread over projects with a skewed (log-normal) distribution, like
+real order books: most projects are small, a few are very large.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import analytics
+import costing
+import db
+import duct_calc
+import migrations
+import progress_log
+import rollups
+import search
+
+CHUNK = 50_000
+
+# (type, share of ducts)
+DUCT_MIX = (('ST', 0.50), ('ELB', 0.18), ('RED', 0.12), ('OFFSET', 0.07),
+            ('SHOE', 0.05), ('DUM', 0.05), ('VANES', 0.03))
+SIDES = np.arange(150, 2450, 50)
+STATUSES = ('new', 'preparation', 'submitted')
+NAME_PARTS = ('Aero', 'Blue', 'Crest', 'Delta', 'Echo', 'Fair', 'Galaxy', 'Helix', 'Indus',
+              'Jade', 'Kite', 'Lotus', 'Metro', 'Nova', 'Orbit', 'Prime', 'Quest', 'Royal',
+              'Sigma', 'Titan', 'Unity', 'Vertex', 'Wave', 'Zenith')
+NAME_SUFFIXES = ('HVAC', 'Engineers', 'Airtech', 'Projects', 'Infra', 'Builders', 'Systems')
+CITIES = ('Chennai', 'Bengaluru', 'Hyderabad', 'Mumbai', 'Pune', 'Delhi', 'Kochi', 'Coimbatore')
+
+
+def _name(rng):
+    return f"{rng.choice(NAME_PARTS)} {rng.choice(NAME_PARTS)} {rng.choice(NAME_SUFFIXES)}"
+
+
+def _vendors(cur, rng, count):
+    cur.executemany('''
+        INSERT INTO vendors (name, gst, address, bank_name, account_number, ifsc)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((f"{_name(rng)} {i}", f"33AAACB{i:04d}Z{i % 10}", f"{i} Industrial Estate, {rng.choice(CITIES)}",
+           "Axis Bank", f"{rng.integers(10**11, 10**12)}", f"UTIB000{i % 10000:04d}")
+          for i in range(1, count + 1)))
+    cur.execute("SELECT id FROM vendors")
+    vendor_ids = [row[0] for row in cur.fetchall()]
+    contacts = []
+    for vendor_id in vendor_ids:
+        for n in range(int(rng.integers(1, 4))):
+            contacts.append((vendor_id, f"Contact {vendor_id}-{n}",
+                             f"9{rng.integers(10**8, 10**9)}", f"c{vendor_id}_{n}@example.com"))
+    cur.executemany("INSERT INTO vendor_contacts (vendor_id, name, phone, email) VALUES (?, ?, ?, ?)",
+                    contacts)
+    return vendor_ids
+
+
+def _projects(cur, rng, count, vendor_ids):
+    start = date(2024, 1, 1)
+    rows = []
+    for i in range(1, count + 1):
+        begin = start + timedelta(days=int(rng.integers(0, 730)))
+        rows.append((int(rng.choice(vendor_ids)), f"QR-{i:06d}", begin.isoformat(),
+                     (begin + timedelta(days=int(rng.integers(14, 180)))).isoformat(),
+                     rng.choice(CITIES), f"Engineer {i % 97}", f"ENQ{i:08d}", f"{_name(rng)} Tower {i}",
+                     rng.choice(CITIES), f"Engineer {i % 97}", f"9{rng.integers(10**8, 10**9)}",
+                     STATUSES[int(rng.choice(3, p=(0.3, 0.5, 0.2)))]))
+    cur.executemany('''
+        INSERT INTO projects (vendor_id, quotation_ro, start_date, end_date, location, incharge,
+                              enquiry_id, client_name, site_location, engineer_name, mobile, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    cur.execute("SELECT id, start_date FROM projects ORDER BY id")
+    rows = cur.fetchall()
+    return (np.array([row[0] for row in rows]),
+            {row[0]: date.fromisoformat(row[1]).toordinal() for row in rows})
+
+
+def _duct_chunk(rng, project_ids, numbers, starts):
+    n = len(project_ids)
+    types, shares = zip(*DUCT_MIX)
+    duct_type = np.array(types)[rng.choice(len(types), size=n, p=shares)]
+    width1 = rng.choice(SIDES, size=n).astype(float)
+    height1 = np.minimum(rng.choice(SIDES, size=n), width1).astype(float)
+    reducing = (duct_type == 'RED') | (duct_type == 'OFFSET')
+    width2 = np.where(reducing, np.maximum(width1 - 50 * rng.integers(1, 6, size=n), 150), 0.0)
+    height2 = np.where(reducing, height1, 0.0)
+    length = np.where(duct_type == 'ELB', rng.choice((150, 200, 300), size=n),
+                      rng.choice((300, 600, 900, 1200), size=n, p=(0.1, 0.2, 0.2, 0.5))).astype(float)
+    quantity = rng.integers(1, 13, size=n)
+    degree = np.where(duct_type == 'ELB', rng.choice((45, 90), size=n),
+                      np.where(duct_type == 'OFFSET', rng.choice((100, 150, 200), size=n), 0))
+    factor = np.ones(n)
+    derived = duct_calc.compute(duct_type=duct_type, width1=width1, height1=height1, width2=width2,
+                                height2=height2, length_or_radius=length, quantity=quantity,
+                                degree_or_offset=degree, factor=factor)
+    duct_no = [f"D-{number}" for number in numbers.tolist()]
+    # Ducts are entered over the first two months after the project starts.
+    offsets = rng.integers(0, 60, size=n).tolist()
+    created_on = [date.fromordinal(starts[pid] + days).isoformat()
+                  for pid, days in zip(project_ids.tolist(), offsets)]
+    inputs = zip(project_ids.tolist(), duct_no, created_on, duct_type.tolist(), width1.tolist(), height1.tolist(),
+                 width2.tolist(), height2.tolist(), length.tolist(), quantity.tolist(),
+                 degree.tolist(), factor.tolist())
+    return ((*row, *values) for row, values in zip(inputs, duct_calc.iter_derived(derived)))
+
+
+def _ducts(conn, rng, count, project_ids, starts, progress=None):
+    cur = conn.cursor()
+    weights = rng.lognormal(0.0, 1.0, size=len(project_ids))
+    owners = np.sort(rng.choice(project_ids, size=count, p=weights / weights.sum()))
+    # Duct numbers run D-1, D-2, ... within each project.
+    firsts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    numbers = np.arange(count) - np.repeat(firsts, np.diff(np.r_[firsts, count])) + 1
+    # Row-at-a-time rollup/version/search triggers would dominate a bulk load;
+    # they are dropped for the load and everything rebuilt in one pass after.
+    cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'duct_entries'")
+    triggers = cur.fetchall()
+    for name, _ in triggers:
+        cur.execute(f"DROP TRIGGER {name}")
+    for offset in range(0, count, CHUNK):
+        chunk = owners[offset:offset + CHUNK]
+        cur.executemany(f'''
+            INSERT INTO duct_entries (project_id, duct_no, created_on, duct_type, width1, height1, width2, height2,
+                                      length_or_radius, quantity, degree_or_offset, factor,
+                                      {', '.join(duct_calc.DERIVED_COLUMNS)})
+            VALUES ({', '.join('?' * (12 + len(duct_calc.DERIVED_COLUMNS)))})
+        ''', _duct_chunk(rng, chunk, numbers[offset:offset + CHUNK], starts))
+        if progress:
+            progress(offset + len(chunk))
+    for _, sql in triggers:
+        cur.execute(sql)
+    rollups.rebuild(cur)
+    analytics.rebuild(cur)
+    search.rebuild(cur)
+
+
+def _progress(cur, rng, today=None):
+    """Production progress for projects past 'new', logged as a few updates each.
+
+    Each stage trails the one before; updates are spread from the project's
+    start to its end date (or today), so the event log has real history.
+    """
+    today = today or date.today()
+    cur.execute("SELECT id, total_sqm, status, start_date, end_date FROM projects WHERE status != 'new' ORDER BY id")
+    for project_id, total_sqm, status, start_date, end_date in cur.fetchall():
+        cutting = 1.0 if status == 'submitted' else float(rng.uniform(0.2, 1.0))
+        plasma = cutting if status == 'submitted' else cutting * float(rng.uniform(0.5, 1.0))
+        boxing = plasma if status == 'submitted' else plasma * float(rng.uniform(0.3, 1.0))
+        begin = date.fromisoformat(start_date).toordinal()
+        end = max(begin, min(date.fromisoformat(end_date), today).toordinal())
+        updates = int(rng.integers(1, 6))
+        days = np.sort(rng.integers(begin, end + 1, size=updates))
+        for n, day in enumerate(days.tolist(), start=1):
+            share = n / updates
+            at = f"{date.fromordinal(day).isoformat()}T{int(rng.integers(8, 18)):02d}:00:00"
+            progress_log.record(cur, project_id, {
+                'sheet_cutting': round(total_sqm * cutting * share, 2),
+                'plasma_fabrication': round(total_sqm * plasma * share, 2),
+                'boxing_assembly': round(total_sqm * boxing * share, 2),
+            }, recorded_by="datagen", recorded_at=at)
+
+
+def generate(path, vendors=200, projects=1000, ducts=100_000, seed=42, progress=None):
+    """Create a fresh, migrated database at ``path`` filled with synthetic data."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = db.connect(path)
+    try:
+        migrations.migrate(conn)
+        rng = np.random.default_rng(seed)
+        conn.execute("BEGIN")
+        cur = conn.cursor()
+        vendor_ids = _vendors(cur, rng, vendors)
+        project_ids, starts = _projects(cur, rng, projects, vendor_ids)
+        _ducts(conn, rng, ducts, project_ids, starts, progress)
+        _progress(cur, rng)
+        conn.execute("COMMIT")
+        progress_log.compact(conn)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    costing.reprice_open(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark database.")
+    parser.add_argument("path")
+    parser.add_argument("--vendors", type=int, default=200)
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--ducts", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+
+    def progress(done):
+        print(f"\r  {done:,}/{args.ducts:,} ducts", end="", file=sys.stderr, flush=True)
+
+    generate(args.path, args.vendors, args.projects, args.ducts, args.seed, progress)
+    print(f"\n✅ {args.path}: {args.vendors} vendors, {args.projects} projects, {args.ducts:,} ducts "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
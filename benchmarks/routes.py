@@ -0,0 +1,216 @@
+"""Latency and throughput of the hot routes against a synthetic database.
+
+Requests go through the real app (``create_app``) with the Flask test
+client, so everything from routing to SQLite is measured, minus the network.
+``--workers N`` runs N processes at once against the same database, the way
+gunicorn workers share it::
+
+    python -m benchmarks.routes --projects 10000 --ducts 2000000 --workers 4
+    python -m benchmarks.routes --save-baseline benchmarks/baseline.json
+    python -m benchmarks.routes --baseline benchmarks/baseline.json --tolerance 0.2
+
+The generated database is cached next to the baseline (``--db``). Each run
+works on a copy, so the writes from ``add_duct`` never leak into the next run.
+Exports bypass the export cache so every request measures a full render.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import migrations
+from benchmarks import datagen
+
+# Requests per worker for each scenario (scaled by --scale).
+DEFAULT_COUNTS = {
+    "projects": 200,
+    "projects_filtered": 200,
+    "production": 200,
+    "add_duct": 200,
+    "export_pdf": 10,
+    "export_excel": 10,
+}
+
+
+def _request(client, scenario, rng, project_ids):
+    project_id = rng.choice(project_ids)
+    if scenario == "projects":
+        return client.get("/projects")
+    if scenario == "projects_filtered":
+        return client.get(f"/projects?status=production&from=2025-{rng.randint(1, 12):02d}-01")
+    if scenario == "production":
+        return client.get(f"/production/{project_id}")
+    if scenario == "add_duct":
+        side = rng.choice(datagen.SIDES.tolist())
+        return client.post("/add_duct", data={
+            "project_id": project_id, "duct_no": "BENCH", "duct_type": "ST",
+            "width1": side, "height1": min(side, 600), "quantity": rng.randint(1, 12),
+            "length_or_radius": 1200,
+        })
+    if scenario == "export_pdf":
+        return client.get(f"/export_pdf/{project_id}")
+    if scenario == "export_excel":
+        return client.get(f"/export_excel/{project_id}")
+    raise ValueError(f"unknown scenario '{scenario}'")
+
+
+def _worker(db_path, plan, seed):
+    """Run ``plan`` (a list of scenario names) in this process; returns latencies."""
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    from app import create_app
+
+    workdir = tempfile.mkdtemp(prefix="bench-worker-")
+    app = create_app({
+        "DATABASE": db_path,
+        "SECRET_KEY": "benchmark",
+        "JOB_WORKERS": 0,
+        "EXPORT_JOB_DIR": os.path.join(workdir, "jobs"),
+        "EXPORT_CACHE_DIR": os.path.join(workdir, "cache"),
+        "EXPORT_CACHE_MAX_BYTES": 0,
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+    })
+    with sqlite3.connect(db_path) as conn:
+        project_ids = [row[0] for row in conn.execute("SELECT project_id FROM project_totals")]
+    rng = random.Random(seed)
+    client = app.test_client()
+    latencies = {name: [] for name in set(plan)}
+    errors = {name: 0 for name in set(plan)}
+    for scenario in plan:
+        started = time.perf_counter()
+        response = _request(client, scenario, rng, project_ids)
+        response.get_data()
+        latencies[scenario].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors[scenario] += 1
+    shutil.rmtree(workdir, ignore_errors=True)
+    return latencies, errors
+
+
+def run(db_path, counts, workers=1, seed=0):
+    """Run every worker's plan; returns per-scenario stats and overall throughput."""
+    plans = []
+    for i in range(workers):
+        plan = [name for name, count in counts.items() for _ in range(count)]
+        if workers > 1:
+            # Mix the scenarios so concurrent workers contend like real traffic.
+            random.Random(seed + i).shuffle(plan)
+        plans.append(plan)
+
+    started = time.perf_counter()
+    if workers == 1:
+        results = [_worker(db_path, plans[0], seed)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_worker, [db_path] * workers, plans,
+                                    [seed + i for i in range(workers)]))
+    wall = time.perf_counter() - started
+
+    stats = {}
+    for name in counts:
+        samples = np.array([t for latencies, _ in results for t in latencies.get(name, ())]) * 1000
+        if not len(samples):
+            continue
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+        stats[name] = {
+            "requests": len(samples),
+            "errors": sum(failed.get(name, 0) for _, failed in results),
+            # Per-worker rate when the scenario runs back to back.
+            "rps": round(1000 / samples.mean(), 1),
+            "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2),
+        }
+    total = sum(s["requests"] for s in stats.values())
+    return {"workers": workers, "wall_s": round(wall, 2),
+            "throughput_rps": round(total / wall, 1), "scenarios": stats}
+
+
+def compare(result, baseline, tolerance):
+    """Scenarios whose p95 regressed by more than ``tolerance`` against ``baseline``."""
+    if baseline.get("workers") != result["workers"]:
+        return [f"baseline was measured with {baseline.get('workers')} worker(s), "
+                f"this run used {result['workers']}"]
+    regressions = []
+    for name, stats in result["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before and stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} -> {stats['p95_ms']:.1f} ms")
+    return regressions
+
+
+def report(result, baseline=None):
+    print(f"{'scenario':<18} {'n':>6} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, s in result["scenarios"].items():
+        line = (f"{name:<18} {s['requests']:>6} {s['errors']:>4} {s['rps']:>8.1f} "
+                f"{s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if before and before["p95_ms"]:
+            line += f"  p95 {100 * (s['p95_ms'] / before['p95_ms'] - 1):+.0f}%"
+        print(line)
+    print(f"{result['workers']} worker(s), {result['wall_s']}s wall, "
+          f"{result['throughput_rps']} req/s overall")
+
+
+def _load(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot routes on synthetic data.")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "erp-bench.db"),
+                        help="generated database, reused while the sizes and seed match")
+    parser.add_argument("--vendors", type=int, default=200)
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--ducts", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the request counts")
+    parser.add_argument("--only", nargs="*", choices=sorted(DEFAULT_COUNTS), help="scenarios to run")
+    parser.add_argument("--baseline", help="compare against this result file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression")
+    parser.add_argument("--save-baseline", help="write the result here")
+    args = parser.parse_args(argv)
+
+    # The database is regenerated only when the requested data set changes.
+    spec = {"vendors": args.vendors, "projects": args.projects, "ducts": args.ducts, "seed": args.seed}
+    spec_path = args.db + ".json"
+    if not (os.path.exists(args.db) and os.path.exists(spec_path)
+            and _load(spec_path) == spec):
+        print(f"generating {args.db} ...", file=sys.stderr)
+        datagen.generate(args.db, **spec)
+        with open(spec_path, "w") as fh:
+            json.dump(spec, fh)
+
+    counts = {name: max(1, int(count * args.scale)) for name, count in DEFAULT_COUNTS.items()
+              if not args.only or name in args.only}
+    with tempfile.TemporaryDirectory() as workdir:
+        working_copy = os.path.join(workdir, "bench.db")
+        with sqlite3.connect(args.db) as source, sqlite3.connect(working_copy) as target:
+            source.backup(target)
+        # A database generated by an older checkout may predate newer migrations.
+        migrations.main([working_copy])
+        result = run(working_copy, counts, args.workers)
+    result["data"] = spec
+
+    baseline = _load(args.baseline) if args.baseline else None
+    report(result, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fh:
+            json.dump(result, fh, indent=2)
+    if baseline:
+        regressions = compare(result, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"❌ {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Worker cold-start benchmark.
+
+Each run starts a fresh interpreter that imports the app, builds it and
+serves the login page, the same work a new gunicorn worker does before its
+first response. Reports import time, time to first response and resident
+memory, and fails if a budget is exceeded or an export library was
+imported eagerly::
+
+    python -m benchmarks.startup --runs 5 --max-import-ms 600 --max-rss-mb 80
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed to render exports; must not be loaded at startup.
+LAZY_MODULES = ("reportlab", "xlsxwriter", "openpyxl", "num2words", "pandas")
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get("/")
+served = time.perf_counter()
+rss_kb = 0
+with open("/proc/self/status") as fh:
+    for line in fh:
+        if line.startswith("VmRSS:"):
+            rss_kb = int(line.split()[1])
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (served - start) * 1000,
+    "status": response.status_code,
+    "rss_mb": rss_kb / 1024,
+    "loaded": sorted({name.split(".")[0] for name in sys.modules} & set(json.loads(sys.argv[1]))),
+}))
+'''
+
+
+def probe(workdir):
+    env = dict(os.environ,
+               DATABASE_PATH=os.path.join(workdir, "startup.db"),
+               EXPORT_JOB_DIR=os.path.join(workdir, "jobs"),
+               EXPORT_CACHE_DIR=os.path.join(workdir, "cache"),
+               SECRET_KEY="benchmark",
+               PYTHONDONTWRITEBYTECODE="1")
+    out = subprocess.run([sys.executable, "-c", PROBE, json.dumps(LAZY_MODULES)],
+                         cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-rss-mb", type=float)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        sys.path.insert(0, ROOT)
+        import migrations
+        migrations.main([os.path.join(workdir, "startup.db")])
+        probe(workdir)  # warm the bytecode and OS file caches
+        runs = [probe(workdir) for _ in range(args.runs)]
+
+    summary = {
+        "runs": args.runs,
+        "import_ms": statistics.median(r["import_ms"] for r in runs),
+        "first_response_ms": statistics.median(r["first_response_ms"] for r in runs),
+        "rss_mb": max(r["rss_mb"] for r in runs),
+        "eager_modules": sorted({m for r in runs for m in r["loaded"]}),
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"import            {summary['import_ms']:8.1f} ms (median of {args.runs})")
+        print(f"first response    {summary['first_response_ms']:8.1f} ms")
+        print(f"rss               {summary['rss_mb']:8.1f} MB")
+        print(f"eager export libs {', '.join(summary['eager_modules']) or 'none'}")
+
+    failures = []
+    if summary["eager_modules"]:
+        failures.append(f"imported at startup: {', '.join(summary['eager_modules'])}")
+    if args.max_import_ms and summary["import_ms"] > args.max_import_ms:
+        failures.append(f"import took {summary['import_ms']:.0f} ms > {args.max_import_ms:.0f} ms")
+    if args.max_rss_mb and summary["rss_mb"] > args.max_rss_mb:
+        failures.append(f"rss {summary['rss_mb']:.1f} MB > {args.max_rss_mb:.0f} MB")
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Write throughput under concurrency, with and without the group-commit queue.
+
+Runs ``--workers`` processes (like gunicorn workers) with ``--threads``
+request threads each, all posting small writes (duct entries, production
+updates, site details) to the same database. Each mode runs on a fresh copy::
+
+    python -m benchmarks.writes --workers 4 --threads 8
+    python -m benchmarks.writes --modes queue --requests 500
+
+Reports requests/s, failed requests and latency percentiles per mode, and
+for the queue the average number of writes per commit.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import migrations
+import write_queue
+from benchmarks import datagen
+
+MODES = {"direct": False, "queue": True}
+
+
+def _request(client, rng, project_ids):
+    project_id = rng.choice(project_ids)
+    kind = rng.random()
+    if kind < 0.6:
+        side = rng.choice(datagen.SIDES.tolist())
+        return client.post("/add_duct", data={
+            "project_id": project_id, "duct_no": "LOAD", "duct_type": "ST",
+            "width1": side, "height1": min(side, 600), "quantity": rng.randint(1, 12),
+            "length_or_radius": 1200,
+        })
+    if kind < 0.9:
+        return client.post(f"/update_production/{project_id}", data={
+            "sheet_cutting": rng.randint(0, 500), "plasma_fabrication": rng.randint(0, 400),
+            "boxing_assembly": rng.randint(0, 300),
+        })
+    return client.post("/add_measurement", data={
+        "project_id": project_id, "client_name": "Load Test", "site_location": "Chennai",
+        "engineer_name": "Bench", "mobile": "9000000000",
+    })
+
+
+def _worker(db_path, use_queue, threads, requests, seed):
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    from app import create_app
+
+    workdir = tempfile.mkdtemp(prefix="bench-writes-")
+    app = create_app({
+        "DATABASE": db_path,
+        "SECRET_KEY": "benchmark",
+        "JOB_WORKERS": 0,
+        "EXPORT_JOB_DIR": os.path.join(workdir, "jobs"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "WRITE_QUEUE": use_queue,
+    })
+    with sqlite3.connect(db_path) as conn:
+        project_ids = [row[0] for row in conn.execute("SELECT id FROM projects")]
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+
+    def run(index):
+        rng = random.Random(seed * 1000 + index)
+        client = app.test_client()
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = _request(client, rng, project_ids)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                failures[0] += response.status_code >= 400
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    groups = (0, 0)
+    if use_queue:
+        with app.app_context():
+            writer = write_queue.writer()
+            groups = (writer.commits, writer.writes)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return latencies, failures[0], groups
+
+
+def run(db_path, use_queue, workers, threads, requests, seed=0):
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_worker, [db_path] * workers, [use_queue] * workers,
+                                [threads] * workers, [requests] * workers,
+                                [seed + i for i in range(workers)]))
+    wall = time.perf_counter() - started
+    samples = np.array([t for latencies, _, _ in results for t in latencies]) * 1000
+    p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+    commits = sum(groups[0] for _, _, groups in results)
+    writes = sum(groups[1] for _, _, groups in results)
+    return {
+        "requests": len(samples),
+        "failed": sum(failed for _, failed, _ in results),
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(samples) / wall, 1),
+        "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2),
+        "writes_per_commit": round(writes / commits, 2) if commits else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark concurrent writes.")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "erp-bench-writes.db"))
+    parser.add_argument("--projects", type=int, default=500)
+    parser.add_argument("--ducts", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="request threads per worker")
+    parser.add_argument("--requests", type=int, default=200, help="requests per thread")
+    parser.add_argument("--modes", nargs="*", choices=sorted(MODES), default=list(MODES))
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"generating {args.db} ...", file=sys.stderr)
+        datagen.generate(args.db, vendors=100, projects=args.projects, ducts=args.ducts, seed=args.seed)
+
+    results = {}
+    print(f"{'mode':<8} {'n':>7} {'failed':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'per commit':>10}")
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as workdir:
+            working_copy = os.path.join(workdir, "bench.db")
+            with sqlite3.connect(args.db) as source, sqlite3.connect(working_copy) as target:
+                source.backup(target)
+            migrations.main([working_copy])
+            result = results[mode] = run(working_copy, MODES[mode], args.workers, args.threads, args.requests)
+        print(f"{mode:<8} {result['requests']:>7} {result['failed']:>6} {result['throughput_rps']:>8.1f} "
+              f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['writes_per_commit'] or '-':>10}")
+    print(f"{args.workers} worker(s) x {args.threads} thread(s)")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Bulk export of many projects' duct sheets as one streamed ZIP.
+
+Each project's PDF and XLSX is rendered in a process pool, so rendering
+runs on every core instead of one request thread. Workers go through the
+export cache like single exports do: a project unchanged since its last
+export is not rendered again, and what they render is cached for the next
+single download. A finished file is hard-linked into a spool directory
+for this export, so cache eviction cannot remove it before it is sent.
+
+The archive is written to the response as it is built. ``projects.csv``
+goes out first, then each file as soon as its render finishes, in
+completion order. Only ``IN_FLIGHT_PER_WORKER`` renders per worker are
+queued ahead of what has been sent, and files are copied into the archive
+in ``CHUNK_SIZE`` pieces. Memory and spool space therefore stay bounded
+however many projects are selected. A project that fails to render is
+listed in ``errors.txt`` at the end instead of aborting the download.
+"""
+import csv
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+from werkzeug.utils import secure_filename
+
+import db
+import export_cache
+import exports
+import jobs
+import listing
+import metrics
+
+KINDS = ("pdf", "excel")
+# .xlsx files are zip archives already; deflating them again gains nothing.
+COMPRESSION = {"pdf": zipfile.ZIP_DEFLATED, "excel": zipfile.ZIP_STORED}
+IN_FLIGHT_PER_WORKER = 2
+CHUNK_SIZE = 1024 * 1024
+
+_worker = None  # (connection, export cache) in each pool process
+
+
+def select_projects(cur, args):
+    """Projects matching the listing's status/vendor/date-range filters, oldest first."""
+    clauses, params = listing.project_filters(args)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    cur.execute(f'''
+        SELECT p.id, p.client_name, p.status, p.start_date, v.name AS vendor_name
+        FROM projects p LEFT JOIN vendors v ON v.id = p.vendor_id
+        {where}
+        ORDER BY p.id
+    ''', params)
+    return cur.fetchall()
+
+
+def _start_worker(database, cache_dir, cache_max_bytes):
+    global _worker
+    _worker = (db.connect(database), export_cache.ExportCache(cache_dir, cache_max_bytes))
+
+
+def _render(project_id, kind, spool_dir):
+    """Link the project's current export into ``spool_dir``, rendering it on a cache miss.
+
+    Returns ``(file name, render seconds or None on a cache hit)``.
+    """
+    conn, cache = _worker
+    write, _, name_pattern = jobs.KINDS[kind]
+    seconds = None
+    with export_cache.snapshot(conn):
+        cur = conn.cursor()
+        version = export_cache.project_version(cur, project_id)
+        header = exports.project_header(cur, project_id)
+        cached = cache.get(project_id, version, kind)
+        if cached is None:
+            started = time.perf_counter()
+            cached = cache.put(project_id, version, kind, lambda fh: write(conn, project_id, fh))
+            seconds = time.perf_counter() - started
+    with cached:
+        target = _spooled(spool_dir, project_id, kind)
+        try:
+            os.link(cached.name, target)
+        except OSError:
+            # Evicted since it was opened, or another filesystem: copy what we hold open.
+            with open(target, "wb") as fh:
+                shutil.copyfileobj(cached, fh, CHUNK_SIZE)
+    return name_pattern.format(project_id=project_id, **header), seconds
+
+
+def _spooled(spool_dir, project_id, kind):
+    return os.path.join(spool_dir, f"{project_id}.{kind}")
+
+
+class _Output:
+    """Write-only sink for ZipFile whose contents the response generator takes as it goes."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def _manifest(projects):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["project_id", "client_name", "vendor", "status", "start_date", "folder"])
+    for project in projects:
+        writer.writerow([project["id"], project["client_name"], project["vendor_name"],
+                         project["status"], project["start_date"], f"{project['id']}/"])
+    return out.getvalue()
+
+
+def _add(archive, output, path, arcname, kind):
+    """Copy one file into the archive, yielding the compressed bytes as they are produced."""
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    info.compress_type = COMPRESSION[kind]
+    with open(path, "rb") as src, archive.open(info, "w") as dest:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dest.write(chunk)
+            yield output.take()
+    yield output.take()
+
+
+def stream(database, cache, projects, kinds=KINDS, workers=None):
+    """Generate a ZIP of ``kinds`` exports of ``projects``, rendered by ``workers`` processes."""
+    workers = max(1, workers or os.cpu_count() or 1)
+    os.makedirs(cache.directory, exist_ok=True)
+    spool_dir = tempfile.mkdtemp(prefix="bulk-", dir=cache.directory)
+    # spawn, not fork: this runs on a thread of a threaded web worker.
+    pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=_start_worker,
+                               initargs=(database, cache.directory, cache.max_bytes))
+    tasks = iter([(project["id"], kind) for project in projects for kind in kinds])
+    pending = {}  # future -> (project id, kind)
+    failed = []
+    output = _Output()
+    try:
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("projects.csv", _manifest(projects))
+            yield output.take()
+            while True:
+                while len(pending) < workers * IN_FLIGHT_PER_WORKER:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    pending[pool.submit(_render, *task, spool_dir)] = task
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    project_id, kind = pending.pop(future)
+                    try:
+                        name, seconds = future.result()
+                    except Exception as e:
+                        failed.append(f"{project_id} {kind}: {e}")
+                        continue
+                    if seconds is not None:
+                        metrics.observe("erp_export_render_seconds", {"kind": kind}, seconds)
+                    path = _spooled(spool_dir, project_id, kind)
+                    try:
+                        arcname = f"{project_id}/{secure_filename(name) or kind}"
+                        yield from _add(archive, output, path, arcname, kind)
+                    finally:
+                        os.remove(path)
+            if failed:
+                archive.writestr("errors.txt", "\n".join(failed) + "\n")
+        yield output.take()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(spool_dir, ignore_errors=True)
@@ -0,0 +1,343 @@
+"""Quotation costing from versioned rate tables.
+
+A rate table is a set of unit prices: sheet metal per kg for each gauge,
+each accessory per unit, labour per sqm of duct area and a wastage
+allowance on sheet weight. Rate tables are never edited; publishing new
+rates adds a version, so a stored quote always says exactly which prices
+it used. Versions are cached in memory per process once read.
+
+A project is priced from its rollups (``project_totals`` and
+``project_gauge_totals``), which are its duct entries summed by trigger,
+so pricing reads a handful of rows however many ducts there are. Quotes
+are stored in ``project_quotes`` with the rate version and the project's
+content version (see export_cache); a stored quote whose versions are
+both current is served as is. ``reprice_open()`` re-prices every open
+project after a rate change, in chunks, optionally across a process pool.
+"""
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import db
+import duct_calc
+import export_cache
+
+ACCESSORIES = (
+    ('nuts_bolts', 'Nuts & Bolts', 'per piece'),
+    ('cleat', 'Cleat', 'per unit'),
+    ('gasket', 'Gasket', 'per unit'),
+    ('corner_pieces', 'Corner Pieces', 'per piece'),
+)
+# (item, label, unit): every rate table prices all of these.
+ITEMS = (
+    *((f'sheet_{gauge}', f'Sheet {gauge}', 'per kg') for gauge in duct_calc.GAUGES),
+    ('wastage_pct', 'Sheet Wastage', '% of weight'),
+    *ACCESSORIES,
+    ('labour_sqm', 'Labour', 'per sqm'),
+)
+DEFAULT_RATES = {
+    'sheet_24g': 92.0, 'sheet_22g': 90.0, 'sheet_20g': 88.0, 'sheet_18g': 86.0,
+    'wastage_pct': 8.0,
+    'nuts_bolts': 2.5, 'cleat': 18.0, 'gasket': 6.0, 'corner_pieces': 4.0,
+    'labour_sqm': 140.0,
+}
+CLOSED_STATUSES = ('submitted',)   # quotation sent; its prices stay as quoted
+CHUNK_SIZE = 500          # projects priced per task / per write
+RATE_CACHE_SIZE = 16
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS rate_tables (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        created_by TEXT,
+        note TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rate_items (
+        version INTEGER NOT NULL REFERENCES rate_tables(version),
+        item TEXT NOT NULL,
+        rate REAL NOT NULL,
+        PRIMARY KEY (version, item)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS project_quotes (
+        project_id INTEGER PRIMARY KEY REFERENCES projects(id) ON DELETE CASCADE,
+        rate_version INTEGER NOT NULL,
+        content_version INTEGER NOT NULL,
+        sheet_cost REAL NOT NULL,
+        accessory_cost REAL NOT NULL,
+        labour_cost REAL NOT NULL,
+        total REAL NOT NULL,
+        breakdown TEXT NOT NULL,
+        priced_at TEXT NOT NULL
+    )
+    ''',
+]
+
+_rates_lock = threading.Lock()
+_rates = {}  # version -> {item: rate}; versions never change
+
+
+def install(cur):
+    for statement in TABLES:
+        cur.execute(statement)
+    cur.execute("SELECT 1 FROM rate_tables LIMIT 1")
+    if cur.fetchone() is None:
+        _insert_rates(cur, DEFAULT_RATES, None, "default rates")
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+# ---------- Rate tables ----------
+
+def validate_rates(values):
+    """Every item as a non-negative float; raises ValueError naming the bad item."""
+    rates = {}
+    for item, label, _ in ITEMS:
+        try:
+            rate = float(values[item])
+        except KeyError:
+            raise ValueError(f"missing rate for {label}")
+        except (TypeError, ValueError):
+            raise ValueError(f"rate for {label} must be a number")
+        if not rate >= 0:
+            raise ValueError(f"rate for {label} must not be negative")
+        rates[item] = rate
+    return rates
+
+
+def _insert_rates(cur, rates, created_by, note):
+    cur.execute("INSERT INTO rate_tables (created_at, created_by, note) VALUES (?, ?, ?)",
+                (_now(), created_by, note))
+    version = cur.lastrowid
+    cur.executemany("INSERT INTO rate_items (version, item, rate) VALUES (?, ?, ?)",
+                    ((version, item, rate) for item, rate in rates.items()))
+    return version
+
+
+def publish_rates(cur, values, created_by=None, note=None):
+    """Validate and store a new rate table; returns its version. The caller commits."""
+    return _insert_rates(cur, validate_rates(values), created_by, note)
+
+
+def current_version(cur):
+    cur.execute("SELECT MAX(version) FROM rate_tables")
+    return cur.fetchone()[0]
+
+
+def rates(cur, version=None):
+    """The rates of ``version`` (default: the current one) as ``{item: rate}``."""
+    version = version or current_version(cur)
+    cached = _rates.get(version)
+    if cached is not None:
+        return cached
+    cur.execute("SELECT item, rate FROM rate_items WHERE version = ?", (version,))
+    loaded = {row[0]: row[1] for row in cur.fetchall()}
+    if not loaded:
+        raise LookupError(f"no rate table version {version}")
+    with _rates_lock:
+        if len(_rates) >= RATE_CACHE_SIZE:
+            _rates.pop(next(iter(_rates)))
+        _rates[version] = loaded
+    return loaded
+
+
+def versions(cur, limit=20):
+    """The most recent rate table versions, newest first."""
+    cur.execute('''
+        SELECT version, created_at, created_by, note FROM rate_tables
+        ORDER BY version DESC LIMIT ?
+    ''', (limit,))
+    return [dict(row) for row in cur.fetchall()]
+
+
+# ---------- Pricing ----------
+
+def price(totals, gauges, rates):
+    """A quote from a project's totals and per-gauge totals (as rollups returns them)."""
+    wastage = 1 + rates['wastage_pct'] / 100
+    lines = []
+    for row in gauges:
+        kg = row['total_weight'] * wastage
+        rate = rates.get(f"sheet_{row['gauge']}", 0.0)
+        lines.append({'item': f"sheet_{row['gauge']}", 'quantity': round(kg, 2), 'rate': rate,
+                      'amount': round(kg * rate, 2)})
+    sheet_cost = sum(line['amount'] for line in lines)
+    for item, _, _ in ACCESSORIES:
+        quantity = totals[f'total_{item}']
+        lines.append({'item': item, 'quantity': round(quantity, 2), 'rate': rates[item],
+                      'amount': round(quantity * rates[item], 2)})
+    accessory_cost = sum(line['amount'] for line in lines[len(gauges):])
+    labour_cost = round(totals['total_area'] * rates['labour_sqm'], 2)
+    lines.append({'item': 'labour_sqm', 'quantity': round(totals['total_area'], 2),
+                  'rate': rates['labour_sqm'], 'amount': labour_cost})
+    return {
+        'sheet_cost': round(sheet_cost, 2),
+        'accessory_cost': round(accessory_cost, 2),
+        'labour_cost': labour_cost,
+        'total': round(sheet_cost + accessory_cost + labour_cost, 2),
+        'lines': lines,
+    }
+
+
+def _rollups(cur, project_ids):
+    """``{project_id: (totals, gauges)}`` for a list of projects, in two queries."""
+    marks = ', '.join('?' * len(project_ids))
+    found = {project_id: ({'total_area': 0.0, **{f'total_{item}': 0.0 for item, _, _ in ACCESSORIES}}, [])
+             for project_id in project_ids}
+    cur.execute(f'''
+        SELECT project_id, total_area, {', '.join(f'total_{item}' for item, _, _ in ACCESSORIES)}
+        FROM project_totals WHERE project_id IN ({marks})
+    ''', project_ids)
+    for row in cur.fetchall():
+        found[row['project_id']][0].update({key: row[key] for key in row.keys() if key != 'project_id'})
+    cur.execute(f'''
+        SELECT project_id, gauge, total_weight FROM project_gauge_totals
+        WHERE project_id IN ({marks}) ORDER BY project_id, gauge
+    ''', project_ids)
+    for row in cur.fetchall():
+        found[row['project_id']][1].append({'gauge': row['gauge'], 'total_weight': row['total_weight']})
+    return found
+
+
+def _content_versions(cur, project_ids):
+    marks = ', '.join('?' * len(project_ids))
+    cur.execute(f"SELECT project_id, version FROM project_versions WHERE project_id IN ({marks})",
+                project_ids)
+    versions = dict(cur.fetchall())
+    return {project_id: versions.get(project_id, 0) for project_id in project_ids}
+
+
+def price_projects(cur, project_ids, version=None):
+    """Fresh quotes for ``project_ids`` as rows for ``store()``. Read a consistent snapshot."""
+    version = version or current_version(cur)
+    table = rates(cur, version)
+    rollup = _rollups(cur, project_ids)
+    content = _content_versions(cur, project_ids)
+    priced_at = _now()
+    rows = []
+    for project_id in project_ids:
+        quote = price(*rollup[project_id], table)
+        rows.append((project_id, version, content[project_id], quote['sheet_cost'],
+                     quote['accessory_cost'], quote['labour_cost'], quote['total'],
+                     json.dumps(quote['lines']), priced_at))
+    return rows
+
+
+def store(cur, rows):
+    """Save quote rows from ``price_projects()``; the caller commits."""
+    cur.executemany('''
+        INSERT INTO project_quotes (project_id, rate_version, content_version, sheet_cost,
+                                    accessory_cost, labour_cost, total, breakdown, priced_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(project_id) DO UPDATE SET
+            rate_version = excluded.rate_version, content_version = excluded.content_version,
+            sheet_cost = excluded.sheet_cost, accessory_cost = excluded.accessory_cost,
+            labour_cost = excluded.labour_cost, total = excluded.total,
+            breakdown = excluded.breakdown, priced_at = excluded.priced_at
+    ''', rows)
+
+
+def _as_quote(row):
+    return {'project_id': row[0], 'rate_version': row[1], 'content_version': row[2],
+            'sheet_cost': row[3], 'accessory_cost': row[4], 'labour_cost': row[5],
+            'total': row[6], 'lines': json.loads(row[7]), 'priced_at': row[8]}
+
+
+def stored_quote(cur, project_id):
+    """The stored quote if it is still current (same rates, unchanged ducts), else None."""
+    cur.execute('''
+        SELECT q.project_id, q.rate_version, q.content_version, q.sheet_cost, q.accessory_cost,
+               q.labour_cost, q.total, q.breakdown, q.priced_at
+        FROM project_quotes q
+        WHERE q.project_id = ?
+          AND q.rate_version = (SELECT MAX(version) FROM rate_tables)
+          AND q.content_version = IFNULL((SELECT version FROM project_versions WHERE project_id = q.project_id), 0)
+    ''', (project_id,))
+    row = cur.fetchone()
+    return _as_quote(row) if row else None
+
+
+def quote(conn, project_id):
+    """``(quote, stale_row)``: the project's current quote.
+
+    ``stale_row`` is None when the stored quote was current; otherwise the
+    quote was just computed and ``stale_row`` is the row to ``store()``.
+    """
+    with export_cache.snapshot(conn):
+        cur = conn.cursor()
+        current = stored_quote(cur, project_id)
+        if current is not None:
+            return current, None
+        row = price_projects(cur, [project_id])[0]
+    return _as_quote(row), row
+
+
+# ---------- Re-pricing ----------
+
+def open_projects(cur):
+    marks = ', '.join('?' * len(CLOSED_STATUSES))
+    cur.execute(f"SELECT id FROM projects WHERE IFNULL(status, '') NOT IN ({marks}) ORDER BY id",
+                CLOSED_STATUSES)
+    return [row[0] for row in cur.fetchall()]
+
+
+def _price_chunk(database, project_ids, version):
+    """Pool task: price one chunk of projects on this process's own connection."""
+    conn = db.connect(database)
+    try:
+        with export_cache.snapshot(conn):
+            return price_projects(conn.cursor(), project_ids, version)
+    finally:
+        conn.close()
+
+
+def reprice_open(database, workers=1, version=None):
+    """Re-price every open project at ``version`` (default: current); returns how many.
+
+    With ``workers`` > 1 chunks are priced in a process pool; results are
+    written back chunk by chunk as they arrive. Pricing only reads rollups
+    (about 0.45 s for 8,000 projects in one process), so a pool pays for
+    starting its processes only on much larger books. Projects that change
+    meanwhile simply get a stale quote, which is re-priced on its next read.
+    """
+    conn = db.connect(database)
+    try:
+        cur = conn.cursor()
+        version = version or current_version(cur)
+        project_ids = open_projects(cur)
+        chunks = [project_ids[i:i + CHUNK_SIZE] for i in range(0, len(project_ids), CHUNK_SIZE)]
+        workers = min(workers or os.cpu_count() or 1, len(chunks))
+        if workers <= 1:
+            results = (_price_chunk(database, chunk, version) for chunk in chunks)
+            pool = None
+        else:
+            # spawn, not fork: this may run on a thread of a threaded web worker.
+            pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"))
+            results = pool.map(_price_chunk, [database] * len(chunks), chunks, [version] * len(chunks))
+        try:
+            for rows in results:
+                store(cur, rows)
+                conn.commit()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    finally:
+        conn.close()
+    return len(project_ids)
+
+
+def reprice_in_background(database, workers=1):
+    """Start ``reprice_open()`` on a daemon thread; stale quotes are priced on read meanwhile."""
+    thread = threading.Thread(target=reprice_open, args=(database, workers),
+                              name="reprice", daemon=True)
+    thread.start()
+    return thread
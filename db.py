@@ -0,0 +1,63 @@
+"""SQLite connection handling.
+
+Requests share one connection kept on ``flask.g`` and closed on app-context
+teardown. Every connection, in or out of a request, is opened through
+``connect()`` so it gets the same pragmas (WAL, busy timeout, ...).
+"""
+import os
+import sqlite3
+
+from flask import current_app, g
+
+DEFAULT_DATABASE = "database.db"
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+)
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+STATEMENT_CACHE_SIZE = 256
+
+
+def database_path(app=None):
+    """The configured database file (``DATABASE`` config, then ``DATABASE_PATH`` env)."""
+    app = app or current_app
+    return app.config.get("DATABASE") or os.environ.get("DATABASE_PATH", DEFAULT_DATABASE)
+
+
+def connect(path=None, **kwargs):
+    """Open a tuned connection outside of a request (scripts, background work)."""
+    path = path or os.environ.get("DATABASE_PATH", DEFAULT_DATABASE)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
+
+def get_db():
+    """The connection for the current request, opened on first use."""
+    if "db" not in g:
+        factory = current_app.extensions.get("db_connection_factory", sqlite3.Connection)
+        g.db = connect(database_path(), factory=factory)
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    conn.close()
+
+
+def init_app(app):
+    app.config.setdefault("DATABASE", os.environ.get("DATABASE_PATH", DEFAULT_DATABASE))
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,176 @@
+"""Batched duct edits for the JSON API.
+
+A batch is a list of create/update/delete operations on one project's
+ducts. Every operation is validated up front and the derived fields of all
+created and updated ducts are computed in one ``duct_calc`` pass; the
+writes then run in a single transaction, each inside its own savepoint so
+a failing operation is undone on its own. With ``atomic`` any failure
+rolls the whole batch back instead.
+"""
+import sqlite3
+
+import duct_calc
+import duct_import
+import rollups
+
+MAX_OPERATIONS = 5000
+EDITABLE_COLUMNS = ('duct_no',) + duct_calc.INPUT_COLUMNS
+ID_CHUNK = 500  # ids per IN (...) lookup, well under SQLite's variable limit
+
+INSERT_SQL = (f"INSERT INTO duct_entries ({', '.join(duct_import.INSERT_COLUMNS)}) "
+              f"VALUES ({', '.join(':' + column for column in duct_import.INSERT_COLUMNS)})")
+UPDATE_SQL = (f"UPDATE duct_entries SET "
+              f"{', '.join(f'{c} = :{c}' for c in EDITABLE_COLUMNS + duct_calc.DERIVED_COLUMNS)} "
+              f"WHERE id = :id AND project_id = :project_id")
+DELETE_SQL = "DELETE FROM duct_entries WHERE id = :id AND project_id = :project_id"
+
+
+class BatchError(ValueError):
+    """Raised when the request body as a whole is unusable."""
+
+
+def parse(payload):
+    """``(operations, atomic)`` from a request body.
+
+    Accepts a bare array of operations or ``{"operations": [...], "atomic": bool}``.
+    """
+    if isinstance(payload, list):
+        operations, atomic = payload, False
+    elif isinstance(payload, dict):
+        operations, atomic = payload.get('operations'), bool(payload.get('atomic', False))
+    else:
+        raise BatchError('Expected a JSON array of operations or {"operations": [...]}')
+    if not isinstance(operations, list):
+        raise BatchError("'operations' must be an array")
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError(f"At most {MAX_OPERATIONS} operations per batch")
+    return operations, atomic
+
+
+def _existing(cur, project_id, ids):
+    """The project's ducts among ``ids``, as ``{id: {column: value}}``."""
+    ids = list(ids)
+    rows = {}
+    for start in range(0, len(ids), ID_CHUNK):
+        chunk = ids[start:start + ID_CHUNK]
+        cur.execute(f'''
+            SELECT id, {', '.join(EDITABLE_COLUMNS)} FROM duct_entries
+            WHERE project_id = ? AND id IN ({', '.join('?' * len(chunk))})
+        ''', (project_id, *chunk))
+        rows.update({row['id']: {column: row[column] for column in EDITABLE_COLUMNS}
+                     for row in cur.fetchall()})
+    return rows
+
+
+def _fields(operation):
+    fields = operation.get('duct')
+    if not isinstance(fields, dict):
+        raise ValueError("'duct' must be an object")
+    unknown = sorted(set(fields) - set(EDITABLE_COLUMNS))
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def _check(operation, current):
+    """Validate one operation against the ducts as the batch has left them so far.
+
+    Returns ``(kind, duct id, duct)``; ``duct`` is None for deletes.
+    """
+    if not isinstance(operation, dict):
+        raise ValueError("operation must be an object")
+    kind = operation.get('op')
+    if kind == 'create':
+        return kind, None, duct_import.validate(_fields(operation))
+    if kind not in ('update', 'delete'):
+        raise ValueError("'op' must be one of create, update, delete")
+    entry_id = operation.get('id')
+    if type(entry_id) is not int:
+        raise ValueError("'id' must be an integer")
+    if entry_id not in current:
+        raise ValueError(f"duct {entry_id!r} not found in this project")
+    if kind == 'delete':
+        del current[entry_id]
+        return kind, entry_id, None
+    # Updates may send only the fields that changed.
+    duct = duct_import.validate({**current[entry_id], **_fields(operation)})
+    current[entry_id] = duct
+    return kind, entry_id, duct
+
+
+def apply(conn, project_id, operations, atomic=False):
+    """Apply a batch to a project's ducts and report on each operation.
+
+    Returns ``{'committed', 'applied', 'failed', 'results', 'totals', 'gauges'}``;
+    ``results`` has one entry per operation, in order, with its ``status``
+    ('ok', 'error' or, when an atomic batch fails, 'rolled_back'), the duct
+    ``id`` and, for creates and updates, the stored duct with its derived
+    fields. Commits or rolls back.
+    """
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        ids = {op.get('id') for op in operations if isinstance(op, dict) and type(op.get('id')) is int}
+        current = _existing(cur, project_id, ids)
+        results, writes = [], []
+        for index, operation in enumerate(operations):
+            result = {'index': index}
+            if isinstance(operation, dict):
+                result['op'] = operation.get('op')
+                if 'ref' in operation:
+                    result['ref'] = operation['ref']  # client's own key, echoed back
+            results.append(result)
+            try:
+                writes.append((result, *_check(operation, current)))
+            except ValueError as e:
+                result.update(status='error', error=str(e))
+
+        ducts = [duct for _, _, _, duct in writes if duct is not None]
+        if ducts:
+            derived = duct_calc.iter_derived(duct_calc.compute(
+                **{name: [duct[name] for duct in ducts] for name in duct_calc.INPUT_COLUMNS}))
+        failed = len(results) - len(writes)
+        for result, kind, entry_id, duct in writes:
+            if duct is not None:
+                duct = {**duct, **dict(zip(duct_calc.DERIVED_COLUMNS, next(derived)))}
+            if atomic and failed:
+                continue
+            params = {**(duct or {}), 'id': entry_id, 'project_id': project_id}
+            cur.execute("SAVEPOINT duct_batch_op")
+            try:
+                cur.execute({'create': INSERT_SQL, 'update': UPDATE_SQL, 'delete': DELETE_SQL}[kind], params)
+                if kind == 'create':
+                    entry_id = cur.lastrowid
+                cur.execute("RELEASE duct_batch_op")
+            except sqlite3.Error as e:
+                cur.execute("ROLLBACK TO duct_batch_op")
+                cur.execute("RELEASE duct_batch_op")
+                result.update(status='error', error=str(e))
+                failed += 1
+                continue
+            result.update(status='ok', id=entry_id)
+            if duct is not None:
+                result['duct'] = duct
+
+        committed = not (atomic and failed)
+        if committed:
+            conn.commit()
+        else:
+            conn.rollback()
+            for result in results:
+                if result.get('status') != 'error':
+                    result['status'] = 'rolled_back'
+                    if result['op'] == 'create':
+                        result.pop('id', None)
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {
+        'committed': committed,
+        'applied': sum(result['status'] == 'ok' for result in results),
+        'failed': failed,
+        'results': results,
+        'totals': rollups.project_totals(cur, project_id),
+        'gauges': rollups.gauge_totals(cur, project_id),
+    }
@@ -0,0 +1,154 @@
+"""Duct geometry engine.
+
+Every derived duct quantity (area, gauge, nuts & bolts, cleat, gasket,
+corner pieces, weight) is computed here, column-wise with NumPy, so a single
+form entry and a whole project of ducts go through exactly the same formulas.
+"""
+import numpy as np
+
+DUCT_TYPES = ('ST', 'RED', 'DUM', 'OFFSET', 'SHOE', 'VANES', 'ELB')
+
+# Gauge is picked from the larger of W1/H1: up to 751 -> 24g, up to 1201 -> 22g,
+# up to 1800 -> 20g, anything bigger -> 18g.
+GAUGE_LIMITS = (751, 1201, 1800)
+GAUGES = ('24g', '22g', '20g', '18g')
+CLEAT_FACTORS = {'24g': 4, '22g': 8, '20g': 10, '18g': 12}
+# Galvanised sheet weight in kg per sq.m for each gauge.
+SHEET_WEIGHT = {'24g': 4.95, '22g': 6.28, '20g': 7.85, '18g': 9.81}
+
+NUTS_BOLTS_PER_DUCT = 4
+CORNER_PIECES_PER_DUCT = 8
+
+INPUT_COLUMNS = ('duct_type', 'width1', 'height1', 'width2', 'height2',
+                 'length_or_radius', 'quantity', 'degree_or_offset', 'factor')
+DERIVED_COLUMNS = ('area', 'gauge', 'nuts_bolts', 'cleat', 'gasket',
+                   'corner_pieces', 'weight')
+
+
+def _floats(values, default=0.0):
+    """Convert a column to a float array, treating None/'' as ``default``."""
+    try:
+        arr = np.asarray(values, dtype=float)
+        if arr.ndim == 0:
+            arr = arr.reshape(1)
+        return np.where(np.isnan(arr), default, arr)
+    except (TypeError, ValueError):
+        return np.array([_float(v, default) for v in values], dtype=float)
+
+
+def _float(value, default=0.0):
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def gauge_index(width1, height1):
+    """Index into ``GAUGES`` for each duct, from its W1/H1 columns."""
+    largest = np.maximum(_floats(width1), _floats(height1))
+    return np.searchsorted(np.asarray(GAUGE_LIMITS, dtype=float), largest, side='left')
+
+
+def compute(duct_type, width1, height1, width2, height2,
+            length_or_radius, quantity, degree_or_offset, factor):
+    """Compute all derived fields for whole columns of ducts in one pass.
+
+    Each argument is a sequence with one value per duct. Returns a dict of
+    NumPy arrays keyed by ``DERIVED_COLUMNS`` (``gauge`` is an object array
+    of gauge labels), already rounded the way they are stored.
+    """
+    kind = np.char.upper(np.asarray([str(t or '') for t in duct_type], dtype=str))
+    w1 = _floats(width1)
+    h1 = _floats(height1)
+    w2 = _floats(width2)
+    h2 = _floats(height2)
+    length = _floats(length_or_radius)
+    qty = np.trunc(_floats(quantity))
+    deg = _floats(degree_or_offset)
+    fac = _floats(factor, default=1.0)
+
+    perimeter = (w1 + h1) / 1000
+    both_ends = (w1 + h1 + w2 + h2) / 1000
+    area = np.select(
+        [kind == 'ST', kind == 'RED', kind == 'DUM', kind == 'OFFSET',
+         kind == 'SHOE', kind == 'VANES', kind == 'ELB'],
+        [2 * perimeter * (length / 1000) * qty,
+         both_ends * (length / 1000) * qty * fac,
+         (w1 * h1) / 1000000 * qty,
+         both_ends * ((length + deg) / 1000) * qty * fac,
+         2 * perimeter * (length / 1000) * qty * fac,
+         w1 / 1000 * (2 * np.pi * (w1 / 1000) / 4) * qty,
+         2 * perimeter * ((h1 / 2 / 1000) + (length / 1000) * (np.pi * (deg / 180))) * qty * fac],
+        default=0.0,
+    )
+
+    idx = gauge_index(w1, h1)
+    cleat_factor = np.array([CLEAT_FACTORS[g] for g in GAUGES], dtype=float)[idx]
+    sheet_weight = np.array([SHEET_WEIGHT[g] for g in GAUGES], dtype=float)[idx]
+
+    area = np.round(area, 2)
+    return {
+        'area': area,
+        'gauge': np.array(GAUGES, dtype=object)[idx],
+        'nuts_bolts': np.round(qty * NUTS_BOLTS_PER_DUCT, 2),
+        'cleat': np.round(qty * cleat_factor, 2),
+        'gasket': np.round(both_ends * qty, 2),
+        'corner_pieces': np.where(kind == 'DUM', 0.0, qty * CORNER_PIECES_PER_DUCT),
+        'weight': np.round(area * sheet_weight, 2),
+    }
+
+
+def compute_rows(rows):
+    """Compute derived fields for an iterable of mappings (dicts or sqlite3.Row)."""
+    rows = list(rows)
+    columns = {name: [row[name] for row in rows] for name in INPUT_COLUMNS}
+    return compute(**columns)
+
+
+def compute_one(**fields):
+    """Compute derived fields for a single duct, returned as plain Python values."""
+    result = compute(**{name: [fields.get(name)] for name in INPUT_COLUMNS})
+    return {name: (str(values[0]) if name == 'gauge' else float(values[0]))
+            for name, values in result.items()}
+
+
+def iter_derived(result):
+    """Yield one tuple of ``DERIVED_COLUMNS`` values (as Python types) per duct."""
+    columns = [result[name].tolist() for name in DERIVED_COLUMNS]
+    return zip(*columns)
+
+
+def _same(stored, computed):
+    if isinstance(computed, str):
+        return stored == computed
+    try:
+        return float(stored) == computed
+    except (TypeError, ValueError):
+        return False
+
+
+def recalculate_project(conn, project_id):
+    """Recompute and store the derived fields of every duct in a project.
+
+    Used after a factor or gauge-rule change; the whole project is computed in
+    one vectorised pass and the ducts whose values changed are written back
+    with a single ``executemany`` (the rollup triggers follow). Returns the
+    number of ducts updated. The caller commits.
+    """
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT id, {', '.join(INPUT_COLUMNS)}, {', '.join(DERIVED_COLUMNS)}
+        FROM duct_entries WHERE project_id = ?
+    ''', (project_id,))
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+    changed = [(*derived, row['id']) for derived, row in zip(iter_derived(compute_rows(rows)), rows)
+               if not all(_same(row[name], value) for name, value in zip(DERIVED_COLUMNS, derived))]
+    cur.executemany(f'''
+        UPDATE duct_entries SET {', '.join(f'{name} = ?' for name in DERIVED_COLUMNS)}
+        WHERE id = ?
+    ''', changed)
+    return len(changed)
@@ -0,0 +1,171 @@
+"""Bulk duct-schedule import from Excel (.xlsx) or CSV.
+
+Rows are streamed from the upload, validated, pushed through the duct
+engine in batches and written with ``executemany`` in one transaction.
+Bad rows are reported back individually and do not abort the file.
+"""
+import csv
+import io
+import math
+import os
+import zipfile
+from xml.etree.ElementTree import ParseError
+
+import duct_calc
+
+BATCH_SIZE = 1000
+
+# Spreadsheet headers we accept for each duct_entries column.
+HEADER_ALIASES = {
+    'duct_no': ('duct_no', 'duct no', 'duct', 'no'),
+    'duct_type': ('duct_type', 'type', 'duct type'),
+    'width1': ('width1', 'w1', 'width 1'),
+    'height1': ('height1', 'h1', 'height 1'),
+    'width2': ('width2', 'w2', 'width 2'),
+    'height2': ('height2', 'h2', 'height 2'),
+    'length_or_radius': ('length_or_radius', 'length', 'len', 'length/radius', 'radius'),
+    'quantity': ('quantity', 'qty'),
+    'degree_or_offset': ('degree_or_offset', 'degree', 'deg', 'offset', 'deg/offset', 'degree/offset'),
+    'factor': ('factor',),
+}
+REQUIRED_COLUMNS = ('duct_no', 'duct_type', 'width1', 'height1', 'quantity')
+NUMERIC_COLUMNS = ('width1', 'height1', 'width2', 'height2', 'length_or_radius',
+                   'degree_or_offset', 'factor')
+
+INSERT_COLUMNS = ('project_id', 'duct_no') + duct_calc.INPUT_COLUMNS + duct_calc.DERIVED_COLUMNS
+
+
+class ScheduleFormatError(ValueError):
+    """Raised when the file as a whole cannot be read (bad format or header)."""
+
+
+def _header_map(header):
+    lookup = {alias: column for column, aliases in HEADER_ALIASES.items() for alias in aliases}
+    mapping = {}
+    for index, name in enumerate(header):
+        column = lookup.get(str(name or '').strip().lower())
+        if column and column not in mapping:
+            mapping[column] = index
+    missing = [c for c in REQUIRED_COLUMNS if c not in mapping]
+    if missing:
+        raise ScheduleFormatError("Missing column(s): " + ", ".join(missing))
+    return mapping
+
+
+def _iter_xlsx(stream):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    except (zipfile.BadZipFile, InvalidFileException, ParseError, KeyError, IndexError, OSError) as e:
+        raise ScheduleFormatError("The file is not a readable .xlsx workbook") from e
+
+
+def _iter_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    except UnicodeDecodeError as e:
+        raise ScheduleFormatError("The CSV file is not UTF-8 text") from e
+    except csv.Error as e:
+        raise ScheduleFormatError(f"The CSV file could not be read: {e}") from e
+
+
+def read_rows(file_storage):
+    """Yield ``(row_number, {column: raw value})`` for every data row of an upload."""
+    ext = os.path.splitext(file_storage.filename or '')[1].lower()
+    if ext in ('.xlsx', '.xlsm'):
+        rows = _iter_xlsx(file_storage.stream)
+    elif ext == '.csv':
+        rows = _iter_csv(file_storage.stream)
+    else:
+        raise ScheduleFormatError("Unsupported file type, upload .xlsx or .csv")
+
+    header = next(rows, None)
+    if header is None:
+        raise ScheduleFormatError("The file is empty")
+    mapping = _header_map(header)
+
+    for number, values in enumerate(rows, start=2):
+        if not values or all(v is None or str(v).strip() == '' for v in values):
+            continue
+        yield number, {column: (values[index] if index < len(values) else None)
+                       for column, index in mapping.items()}
+
+
+def validate(raw):
+    """Normalise one raw row; returns the duct dict or raises ValueError."""
+    duct_no = str(raw.get('duct_no') or '').strip()
+    if not duct_no:
+        raise ValueError("duct_no is required")
+    duct_type = str(raw.get('duct_type') or '').strip().upper()
+    if duct_type not in duct_calc.DUCT_TYPES:
+        raise ValueError(f"unknown duct type '{raw.get('duct_type')}'")
+
+    duct = {'duct_no': duct_no, 'duct_type': duct_type}
+    for column in NUMERIC_COLUMNS:
+        value = raw.get(column)
+        if value is None or str(value).strip() == '':
+            duct[column] = 1.0 if column == 'factor' else 0.0
+            continue
+        try:
+            duct[column] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{column} is not a number: '{value}'")
+        if not math.isfinite(duct[column]):
+            raise ValueError(f"{column} must be a finite number")
+        if duct[column] < 0:
+            raise ValueError(f"{column} cannot be negative")
+
+    try:
+        quantity = float(raw.get('quantity'))
+    except (TypeError, ValueError):
+        raise ValueError(f"quantity is not a number: '{raw.get('quantity')}'")
+    if not math.isfinite(quantity) or quantity <= 0 or quantity != int(quantity):
+        raise ValueError("quantity must be a positive whole number")
+    duct['quantity'] = int(quantity)
+    return duct
+
+
+def _insert_batch(cur, project_id, batch):
+    result = duct_calc.compute(**{name: [d[name] for d in batch] for name in duct_calc.INPUT_COLUMNS})
+    cur.executemany(
+        f"INSERT INTO duct_entries ({', '.join(INSERT_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in INSERT_COLUMNS)})",
+        ((project_id, d['duct_no'], *(d[name] for name in duct_calc.INPUT_COLUMNS), *derived)
+         for d, derived in zip(batch, duct_calc.iter_derived(result))))
+
+
+def import_ducts(conn, project_id, rows, batch_size=BATCH_SIZE):
+    """Validate and insert ``rows`` (from ``read_rows``) into a project.
+
+    Everything is written in one transaction; invalid rows are skipped and
+    returned as ``{'row': n, 'error': msg}`` entries in the report.
+    """
+    cur = conn.cursor()
+    imported = 0
+    errors = []
+    batch = []
+    try:
+        for number, raw in rows:
+            try:
+                batch.append(validate(raw))
+            except ValueError as e:
+                errors.append({'row': number, 'error': str(e)})
+                continue
+            if len(batch) >= batch_size:
+                _insert_batch(cur, project_id, batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            _insert_batch(cur, project_id, batch)
+            imported += len(batch)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {'imported': imported, 'errors': errors}
@@ -0,0 +1,171 @@
+"""On-disk cache of rendered project exports.
+
+Every project carries a content version (``project_versions``) that
+triggers bump on any write to its ducts, project row or production
+progress. Rendered files are stored under (project, version, format), so a
+cached file is valid for exactly as long as nothing in the project changed,
+and the same key doubles as a strong ETag. The directory is kept under a
+size cap by evicting the least recently used files.
+"""
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+# Bump when the export layout changes so old cached files stop matching.
+FORMAT_VERSION = 2
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+EXTENSIONS = {"pdf": "pdf", "excel": "xlsx"}
+
+
+def _bump(project_id):
+    return f'''
+        INSERT INTO project_versions (project_id, version) VALUES ({project_id}, 1)
+        ON CONFLICT(project_id) DO UPDATE SET version = version + 1;
+    '''
+
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS project_versions (
+        project_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+]
+
+TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS duct_entries_version_insert AFTER INSERT ON duct_entries "
+    f"BEGIN {_bump('NEW.project_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS duct_entries_version_update AFTER UPDATE ON duct_entries "
+    f"BEGIN {_bump('OLD.project_id')} {_bump('NEW.project_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS duct_entries_version_delete AFTER DELETE ON duct_entries "
+    f"BEGIN {_bump('OLD.project_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS projects_version_update AFTER UPDATE ON projects "
+    f"BEGIN {_bump('NEW.id')} END",
+    "CREATE TRIGGER IF NOT EXISTS projects_version_delete AFTER DELETE ON projects "
+    "BEGIN DELETE FROM project_versions WHERE project_id = OLD.id; END",
+    f"CREATE TRIGGER IF NOT EXISTS production_progress_version_insert AFTER INSERT ON production_progress "
+    f"BEGIN {_bump('NEW.project_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS production_progress_version_update AFTER UPDATE ON production_progress "
+    f"BEGIN {_bump('NEW.project_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS production_progress_version_delete AFTER DELETE ON production_progress "
+    f"BEGIN {_bump('OLD.project_id')} END",
+]
+
+
+def install(cur):
+    for statement in TABLES + TRIGGERS:
+        cur.execute(statement)
+
+
+def project_version(cur, project_id):
+    cur.execute("SELECT version FROM project_versions WHERE project_id = ?", (project_id,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+@contextmanager
+def snapshot(conn):
+    """Read transaction so the version and the rendered content agree."""
+    started = not conn.in_transaction
+    if started:
+        conn.execute("BEGIN")
+    try:
+        yield
+    finally:
+        if started and conn.in_transaction:
+            conn.rollback()
+
+
+def etag(project_id, version, fmt):
+    key = f"{project_id}:{version}:{fmt}:{FORMAT_VERSION}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class ExportCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+
+    def path(self, project_id, version, fmt):
+        return os.path.join(self.directory,
+                            f"p{project_id}-v{version}-f{FORMAT_VERSION}.{EXTENSIONS[fmt]}")
+
+    def get(self, project_id, version, fmt):
+        """The cached file opened for reading, or None. A hit refreshes its LRU position.
+
+        Files are handed out open so that eviction by another worker cannot
+        pull them out from under a response that is still being sent.
+        """
+        path = self.path(project_id, version, fmt)
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        os.utime(fh.fileno())
+        return fh
+
+    def put(self, project_id, version, fmt, write):
+        """Render into the cache with ``write(fh)`` and return the result opened for reading."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(project_id, version, fmt)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(tmp_path, "wb") as fh:
+                write(fh)
+            os.replace(tmp_path, path)
+            fh = open(path, "rb")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._drop_stale(project_id, version, fmt)
+        self.evict()
+        return fh
+
+    def _drop_stale(self, project_id, version, fmt):
+        """Older versions of this export can never be served again."""
+        prefix = f"p{project_id}-v"
+        suffix = f".{EXTENSIONS[fmt]}"
+        current = os.path.basename(self.path(project_id, version, fmt))
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(prefix) and entry.name.endswith(suffix) and entry.name != current:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        """Delete least recently used files until the cache fits under its cap."""
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".part") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        finally:
+            self._evict_lock.release()
+
+
+def init_app(app):
+    app.config.setdefault("EXPORT_CACHE_DIR", os.environ.get("EXPORT_CACHE_DIR", "export_cache"))
+    app.config.setdefault("EXPORT_CACHE_MAX_BYTES",
+                          int(os.environ.get("EXPORT_CACHE_MAX_MB", DEFAULT_MAX_BYTES // (1024 * 1024)))
+                          * 1024 * 1024)
+    app.extensions["export_cache"] = ExportCache(app.config["EXPORT_CACHE_DIR"],
+                                                 app.config["EXPORT_CACHE_MAX_BYTES"])
@@ -0,0 +1,368 @@
+"""Project duct-sheet exports.
+
+Exports read ducts straight off the cursor and write them out row by row,
+so memory stays flat however large the project is.
+"""
+import os
+import tempfile
+from functools import lru_cache
+
+import rollups
+import takeoff
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # spill the finished document to disk past this
+
+COMPANY_NAME = "Vanes Engineering Pvt Ltd"
+COMPANY_ADDRESS = "No. 23, Industrial Estate, Chennai"
+COMPANY_CONTACT = "Email: info@vanesengineering.com | Phone: +91-98765-43210"
+LOGO_PATH = os.path.join("static", "logo.png")
+
+PDF_COLUMNS = ["Duct No", "Type", "Width", "Height", "Qty", "Area", "Weight"]
+PDF_COL_WIDTHS = [70, 60, 60, 60, 50, 70, 70]
+PDF_TAKEOFF_COL_WIDTHS = [50, 55, 85, 55, 70, 80, 90]
+# Ducts per LongTable chunk; splitting one huge table across pages costs
+# more the longer it is, chunks keep the layout work linear.
+PDF_CHUNK_ROWS = 500
+
+# (column, header, width, number format)
+EXCEL_COLUMNS = [
+    ("duct_no", "Duct No", 12, None),
+    ("duct_type", "Type", 9, None),
+    ("width1", "W1", 8, "0"),
+    ("height1", "H1", 8, "0"),
+    ("width2", "W2", 8, "0"),
+    ("height2", "H2", 8, "0"),
+    ("length_or_radius", "Length/Radius", 13, "0"),
+    ("degree_or_offset", "Deg/Offset", 11, "0.##"),
+    ("quantity", "Qty", 7, "0"),
+    ("factor", "Factor", 8, "0.00"),
+    ("gauge", "Gauge", 8, None),
+    ("area", "Area (sq.m)", 12, "0.00"),
+    ("weight", "Weight (kg)", 12, "0.00"),
+    ("nuts_bolts", "Nuts & Bolts", 12, "0"),
+    ("cleat", "Cleat", 8, "0"),
+    ("gasket", "Gasket", 9, "0.00"),
+    ("corner_pieces", "Corner Pieces", 13, "0"),
+]
+NUMERIC_EXCEL_COLUMNS = {"width1", "height1", "width2", "height2", "length_or_radius",
+                         "degree_or_offset", "quantity", "factor", "area", "weight",
+                         "nuts_bolts", "cleat", "gasket", "corner_pieces"}
+# Totals row: duct column -> key in rollups.project_totals()
+EXCEL_TOTALS = {"quantity": "total_qty", "area": "total_area", "weight": "total_weight",
+                "nuts_bolts": "total_nuts_bolts", "cleat": "total_cleat",
+                "gasket": "total_gasket", "corner_pieces": "total_corner_pieces"}
+
+# (key in takeoff.takeoff() rows, header, width, two decimals)
+TAKEOFF_COLUMNS = [
+    ("gauge", "Gauge", 10, False),
+    ("pieces", "Pieces", 10, False),
+    ("blank_area", "Blank Area (sq.m)", 17, True),
+    ("sheets", "Sheets", 9, False),
+    ("utilization", "Utilization %", 13, False),
+    ("offcut", "Offcut (sq.m)", 13, True),
+    ("sheet_weight", "Sheet Weight (kg)", 17, True),
+]
+
+
+def _number(value):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+PROGRESS_EVERY = 1000  # rows between progress callbacks
+
+
+def write_excel(conn, project_id, fh, progress=None):
+    """Write the project's duct sheet as an .xlsx workbook into ``fh``.
+
+    ``progress``, if given, is called with the completed fraction (0-1).
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(fh, {"constant_memory": True})
+    header = workbook.add_format({"bold": True, "bg_color": "#D9D9D9", "border": 1,
+                                  "align": "center", "valign": "vcenter"})
+    formats = {column: workbook.add_format({"num_format": fmt}) if fmt else None
+               for column, _, _, fmt in EXCEL_COLUMNS}
+    total_formats = {column: workbook.add_format({"bold": True, "top": 2, "num_format": fmt or "General"})
+                     for column, _, _, fmt in EXCEL_COLUMNS}
+
+    sheet = workbook.add_worksheet("Duct Entries")
+    for col, (_, title, width, _) in enumerate(EXCEL_COLUMNS):
+        sheet.set_column(col, col, width)
+        sheet.write(0, col, title, header)
+    sheet.freeze_panes(1, 0)
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {', '.join(column for column, _, _, _ in EXCEL_COLUMNS)}
+        FROM duct_entries WHERE project_id = ? ORDER BY id
+    """, (project_id,))
+    cells = [(col, column in NUMERIC_EXCEL_COLUMNS, formats[column])
+             for col, (column, _, _, _) in enumerate(EXCEL_COLUMNS)]
+    duct_count = rollups.project_totals(conn.cursor(), project_id)["duct_count"] or 1
+    row_index = 0
+    for row_index, row in enumerate(cur, start=1):
+        if progress and row_index % PROGRESS_EVERY == 0:
+            progress(min(row_index / duct_count, 1.0) * 0.95)
+        for col, numeric, fmt in cells:
+            value = row[col]
+            if value is None or value == "":
+                continue
+            if numeric:
+                value = _number(value)
+                if isinstance(value, float):
+                    sheet.write_number(row_index, col, value, fmt)
+                    continue
+            sheet.write_string(row_index, col, str(value), fmt)
+
+    totals = rollups.project_totals(cur, project_id)
+    total_row = row_index + 1
+    for col, (column, _, _, _) in enumerate(EXCEL_COLUMNS):
+        if col == 0:
+            sheet.write(total_row, col, "TOTAL", total_formats[column])
+        elif column in EXCEL_TOTALS:
+            sheet.write_number(total_row, col, totals[EXCEL_TOTALS[column]], total_formats[column])
+        else:
+            sheet.write_blank(total_row, col, None, total_formats[column])
+
+    summary = workbook.add_worksheet("Gauge Summary")
+    summary_columns = [("Gauge", 10), ("Ducts", 8), ("Qty", 8), ("Area (sq.m)", 12), ("Weight (kg)", 12)]
+    for col, (title, width) in enumerate(summary_columns):
+        summary.set_column(col, col, width)
+        summary.write(0, col, title, header)
+    decimal = workbook.add_format({"num_format": "0.00"})
+    gauges = rollups.gauge_totals(cur, project_id)
+    for r, gauge in enumerate(gauges, start=1):
+        summary.write(r, 0, gauge["gauge"] or "-")
+        summary.write_number(r, 1, gauge["duct_count"])
+        summary.write_number(r, 2, gauge["total_qty"])
+        summary.write_number(r, 3, gauge["total_area"], decimal)
+        summary.write_number(r, 4, gauge["total_weight"], decimal)
+    bold = workbook.add_format({"bold": True, "top": 2})
+    bold_decimal = workbook.add_format({"bold": True, "top": 2, "num_format": "0.00"})
+    r = len(gauges) + 1
+    summary.write(r, 0, "TOTAL", bold)
+    summary.write_number(r, 1, totals["duct_count"], bold)
+    summary.write_number(r, 2, totals["total_qty"], bold)
+    summary.write_number(r, 3, totals["total_area"], bold_decimal)
+    summary.write_number(r, 4, totals["total_weight"], bold_decimal)
+
+    sheets = takeoff.project_takeoff(cur, project_id)
+    nesting = workbook.add_worksheet("Sheet Takeoff")
+    for col, (_, title, width, _) in enumerate(TAKEOFF_COLUMNS):
+        nesting.set_column(col, col, width)
+        nesting.write(0, col, title, header)
+    rows = sheets + [dict(takeoff.totals(sheets), gauge="TOTAL")]
+    for r, row in enumerate(rows, start=1):
+        last = r == len(rows)
+        for col, (key, _, _, decimals) in enumerate(TAKEOFF_COLUMNS):
+            fmt = (bold_decimal if decimals else bold) if last else (decimal if decimals else None)
+            nesting.write(r, col, row[key], fmt)
+    nesting.write(len(rows) + 2, 0, f"Sheet size {takeoff.SHEET_WIDTH} x {takeoff.SHEET_LENGTH} mm")
+
+    workbook.close()
+    if progress:
+        progress(1.0)
+
+
+def excel_file(conn, project_id):
+    """The project's workbook in a rewound spooled temp file."""
+    fh = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write_excel(conn, project_id, fh)
+    fh.seek(0)
+    return fh
+
+
+def project_header(cur, project_id):
+    """Client/site details shown on every exported document."""
+    cur.execute("""
+        SELECT client_name, site_location, engineer_name, mobile, start_date, end_date
+        FROM projects WHERE id = ?
+    """, (project_id,))
+    proj = cur.fetchone()
+    keys = ("client_name", "site_location", "engineer_name", "mobile", "start_date", "end_date")
+    header = {key: (proj[key] if proj else None) or "" for key in keys}
+    header["client_name"] = header["client_name"] or "Project"
+    return header
+
+
+def convert_to_words(value):
+    from num2words import num2words
+    try:
+        int_part = int(value)
+        decimal_part = int(round((value - int_part) * 100))
+        return f"{num2words(int_part).capitalize()} point {num2words(decimal_part)}"
+    except Exception:
+        return "Not available"
+
+
+@lru_cache(maxsize=1)
+def _logo():
+    """The company logo as an ImageReader, loaded once per process."""
+    if not os.path.exists(LOGO_PATH):
+        return None
+    from reportlab.lib.utils import ImageReader
+    return ImageReader(LOGO_PATH)
+
+
+@lru_cache(maxsize=1)
+def _pdf_styles():
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.platypus import TableStyle
+
+    sample = getSampleStyleSheet()
+    return {
+        "info": ParagraphStyle("info", parent=sample["Normal"], fontName="Helvetica-Bold",
+                               fontSize=11, leading=15),
+        "words": ParagraphStyle("words", parent=sample["Normal"], fontName="Helvetica-Bold",
+                                fontSize=10, leading=14),
+        "table": TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ]),
+        "totals": TableStyle([
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ]),
+    }
+
+
+def _draw_page(canvas, doc):
+    """Letterhead and footer repeated on every page."""
+    from reportlab.lib.pagesizes import A4
+
+    width, height = A4
+    canvas.saveState()
+    logo = _logo()
+    if logo is not None:
+        canvas.drawImage(logo, 50, height - 80, width=80, height=50,
+                         preserveAspectRatio=True, mask='auto')
+    canvas.setFont("Helvetica-Bold", 16)
+    canvas.drawString(200, height - 50, COMPANY_NAME)
+    canvas.setFont("Helvetica", 10)
+    canvas.drawString(200, height - 65, COMPANY_ADDRESS)
+    canvas.drawString(200, height - 78, COMPANY_CONTACT)
+    canvas.line(50, height - 88, width - 50, height - 88)
+
+    canvas.setFont("Helvetica", 9)
+    canvas.drawString(50, 30, f"{doc.client_name} - Duct Sheet")
+    canvas.drawRightString(width - 50, 30, f"Page {doc.page}")
+    canvas.restoreState()
+
+
+def write_pdf(conn, project_id, fh, progress=None):
+    """Write the project's duct sheet PDF into ``fh``.
+
+    Ducts are laid out in chunked LongTables that split across pages with
+    the column headers repeated; the totals, amounts in words and the
+    signature block follow on the last page. ``progress``, if given, is
+    called with the completed fraction (0-1) as table rows are laid out.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import (BaseDocTemplate, Frame, KeepTogether, LongTable,
+                                    PageTemplate, Paragraph, Spacer, Table)
+
+    styles = _pdf_styles()
+    cur = conn.cursor()
+    header = project_header(cur, project_id)
+
+    width, height = A4
+    doc = BaseDocTemplate(fh, pagesize=A4, title=f"{header['client_name']} Duct Sheet",
+                          leftMargin=50, rightMargin=50, topMargin=100, bottomMargin=50)
+    doc.client_name = header["client_name"]
+    frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id="body")
+    doc.addPageTemplates([PageTemplate(id="sheet", frames=[frame], onPage=_draw_page)])
+
+    info = Table([
+        [Paragraph(f"Client: {header['client_name']}", styles["info"]),
+         Paragraph(f"Site: {header['site_location']}", styles["info"])],
+        [Paragraph(f"Engineer: {header['engineer_name']}", styles["info"]),
+         Paragraph(f"Mobile: {header['mobile']}", styles["info"])],
+        [Paragraph(f"Duration: {header['start_date']} to {header['end_date']}", styles["info"]), ""],
+    ], colWidths=[doc.width / 2, doc.width / 2])
+    story = [info, Spacer(1, 12)]
+
+    cur.execute("""
+        SELECT duct_no, duct_type, width1, height1, quantity, area, weight
+        FROM duct_entries WHERE project_id = ? ORDER BY id
+    """, (project_id,))
+    totals = rollups.project_totals(conn.cursor(), project_id)
+    total_row = ["", "", "", "Total", totals["total_qty"], totals["total_area"], totals["total_weight"]]
+
+    def table(rows, last):
+        if last:
+            rows.append(total_row)
+        t = LongTable([PDF_COLUMNS] + rows, colWidths=PDF_COL_WIDTHS, repeatRows=1)
+        t.setStyle(styles["table"])
+        if last:
+            t.setStyle(styles["totals"])
+        return t
+
+    rows = []
+    while True:
+        chunk = cur.fetchmany(PDF_CHUNK_ROWS)
+        for row in chunk:
+            rows.append([row[0], row[1], float(row[2] or 0), float(row[3] or 0),
+                         float(row[4] or 0), float(row[5] or 0), float(row[6] or 0)])
+        if len(chunk) < PDF_CHUNK_ROWS:
+            story.append(table(rows, last=True))
+            break
+        story.append(table(rows, last=False))
+        rows = []
+
+    sheets = takeoff.project_takeoff(cur, project_id)
+    if sheets:
+        rows = [[row[key] for key, _, _, _ in TAKEOFF_COLUMNS]
+                for row in sheets + [dict(takeoff.totals(sheets), gauge="Total")]]
+        nesting = Table([[title for _, title, _, _ in TAKEOFF_COLUMNS]] + rows,
+                        colWidths=PDF_TAKEOFF_COL_WIDTHS, repeatRows=1)
+        nesting.setStyle(styles["table"])
+        nesting.setStyle(styles["totals"])
+        story.append(Spacer(1, 16))
+        story.append(KeepTogether([
+            Paragraph(f"Sheet Takeoff ({takeoff.SHEET_WIDTH} x {takeoff.SHEET_LENGTH} mm sheets)",
+                      styles["words"]),
+            Spacer(1, 6),
+            nesting,
+        ]))
+
+    story.append(Spacer(1, 16))
+    story.append(KeepTogether([
+        Paragraph(f"Total Area in Words: {convert_to_words(round(totals['total_area'], 2))} sq.m",
+                  styles["words"]),
+        Paragraph(f"Total Weight in Words: {convert_to_words(round(totals['total_weight'], 2))} kg",
+                  styles["words"]),
+        Spacer(1, 40),
+        Table([["Engineer Signature: __________________", "Client Signature: __________________"]],
+              colWidths=[doc.width / 2, doc.width / 2]),
+    ]))
+
+    if progress:
+        laid_out = [0]
+        duct_count = totals["duct_count"] or 1
+
+        def after_flowable(flowable):
+            if isinstance(flowable, LongTable):
+                laid_out[0] += flowable._nrows - 1
+                progress(min(laid_out[0] / duct_count, 1.0) * 0.95)
+        doc.afterFlowable = after_flowable
+
+    doc.build(story)
+    if progress:
+        progress(1.0)
+
+
+def pdf_file(conn, project_id):
+    """The project's duct sheet PDF in a rewound spooled temp file."""
+    fh = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write_pdf(conn, project_id, fh)
+    fh.seek(0)
+    return fh
@@ -0,0 +1,23 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+The app is imported once in the master and shared copy-on-write by the
+workers. That is safe because building it opens no database connection and
+starts no threads: each worker opens its own connections and starts its
+export job and writer threads on first use.
+"""
+import os
+
+import metrics
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Threaded workers, so concurrent writes in a worker share group commits (write_queue.py).
+threads = int(os.environ.get("WEB_THREADS", 4))
+preload_app = True
+# Heartbeat files on tmpfs; a slow container disk can stall workers.
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def on_starting(server):
+    # Per-worker metric snapshots from a previous run would be summed in.
+    metrics.clear(os.environ.get("METRICS_DIR", metrics.DEFAULT_DIR))
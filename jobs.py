@@ -0,0 +1,282 @@
+"""Background export jobs.
+
+Jobs are rows in the ``export_jobs`` table, so any gunicorn worker can
+enqueue one and any worker's pool can run it. Each web worker runs a few
+job threads, started on its first request (after gunicorn has forked).
+Finished artifacts are kept on disk for ``JOB_RETENTION_HOURS`` and then
+cleaned up. Idle job threads also make the thumbnails of uploaded drawings.
+
+Running jobs carry a heartbeat, refreshed by their progress writes and by
+the pool's maintenance thread. A job whose heartbeat stops (its worker
+process died) is put back in the queue; a long render in a live worker is
+left alone. The maintenance thread also runs the periodic housekeeping
+tasks, each on its own interval, so none of it holds up an export.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+import db
+import exports
+import metrics
+import progress_log
+import sync
+import uploads
+
+log = logging.getLogger(__name__)
+
+KINDS = {
+    "pdf": (exports.write_pdf, "application/pdf", "{client_name}_duct_sheet.pdf"),
+    "excel": (exports.write_excel, exports.XLSX_MIMETYPE, "project_{project_id}_entries.xlsx"),
+}
+
+DEFAULT_WORKERS = 2
+DEFAULT_RETENTION_HOURS = 24
+POLL_INTERVAL = 1.0           # seconds an idle job thread waits before re-checking
+PROGRESS_INTERVAL = 0.5       # minimum seconds between progress writes
+HEARTBEAT_INTERVAL = 30       # seconds between heartbeats of a pool's running jobs
+STALE_AFTER = 5 * 60          # a running job without a heartbeat for this long is requeued
+# Periodic tasks, in seconds between runs.
+CLEANUP_INTERVAL = 5 * 60
+COMPACT_INTERVAL = 15 * 60
+GARBAGE_INTERVAL = 60 * 60
+PRUNE_INTERVAL = 60 * 60
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def enqueue(conn, kind, project_id):
+    """Queue an export job and return its id. The caller commits."""
+    if kind not in KINDS:
+        raise ValueError(f"unknown export kind '{kind}'")
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO export_jobs (kind, project_id, status, progress, created_at)
+        VALUES (?, ?, 'queued', 0, ?)
+    """, (kind, project_id, _now()))
+    return cur.lastrowid
+
+
+def get(conn, job_id):
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM export_jobs WHERE id = ?", (job_id,))
+    return cur.fetchone()
+
+
+def claim(conn):
+    """Atomically move the oldest queued job to running; returns it or None."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE export_jobs SET status = 'running', started_at = :now, heartbeat_at = :now, worker = :worker
+        WHERE id = (SELECT id FROM export_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+          AND status = 'queued'
+        RETURNING id, kind, project_id
+    """, {"now": _now(), "worker": f"{os.getpid()}:{threading.get_ident()}"})
+    job = cur.fetchone()
+    conn.commit()
+    return job
+
+
+def run(conn, job, artifact_dir):
+    """Render one claimed job to ``artifact_dir`` and record the outcome."""
+    write, _, name_pattern = KINDS[job["kind"]]
+    path = os.path.join(artifact_dir, f"job_{job['id']}.{'pdf' if job['kind'] == 'pdf' else 'xlsx'}")
+    last_write = [0.0]
+
+    def progress(fraction):
+        now = time.monotonic()
+        if fraction < 1.0 and now - last_write[0] < PROGRESS_INTERVAL:
+            return
+        last_write[0] = now
+        conn.execute("UPDATE export_jobs SET progress = ?, heartbeat_at = ? WHERE id = ?",
+                     (round(fraction, 3), _now(), job["id"]))
+        conn.commit()
+
+    tmp_path = path + ".part"
+    try:
+        header = exports.project_header(conn.cursor(), job["project_id"])
+        with open(tmp_path, "wb") as fh, metrics.render_timer(job["kind"]):
+            write(conn, job["project_id"], fh, progress=progress)
+        os.replace(tmp_path, path)
+        download_name = name_pattern.format(project_id=job["project_id"], **header)
+        conn.execute("""
+            UPDATE export_jobs SET status = 'done', progress = 1, artifact_path = ?,
+                   download_name = ?, finished_at = ?
+            WHERE id = ?
+        """, (path, download_name, _now(), job["id"]))
+    except Exception as e:
+        log.exception("export job %s failed", job["id"])
+        conn.rollback()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn.execute("UPDATE export_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                     (str(e), _now(), job["id"]))
+    conn.commit()
+
+
+def heartbeat(conn, pid=None):
+    """Mark the running jobs of process ``pid`` (this one by default) as alive. Commits."""
+    conn.execute("UPDATE export_jobs SET heartbeat_at = ? WHERE status = 'running' AND worker LIKE ?",
+                 (_now(), f"{pid or os.getpid()}:%"))
+    conn.commit()
+
+
+def cleanup(conn, retention_hours=DEFAULT_RETENTION_HOURS):
+    """Delete finished jobs (and their files) past retention; requeue jobs whose heartbeat stopped."""
+    cutoff = (datetime.now() - timedelta(hours=retention_hours)).isoformat(timespec="seconds")
+    stale = (datetime.now() - timedelta(seconds=STALE_AFTER)).isoformat(timespec="seconds")
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, artifact_path FROM export_jobs
+        WHERE status IN ('done', 'failed') AND finished_at < ?
+    """, (cutoff,))
+    expired = cur.fetchall()
+    for job in expired:
+        if job["artifact_path"] and os.path.exists(job["artifact_path"]):
+            os.remove(job["artifact_path"])
+    cur.executemany("DELETE FROM export_jobs WHERE id = ?", ((job["id"],) for job in expired))
+    cur.execute("""
+        UPDATE export_jobs SET status = 'queued', worker = NULL, started_at = NULL, heartbeat_at = NULL,
+               progress = 0
+        WHERE status = 'running' AND IFNULL(heartbeat_at, started_at) < ?
+    """, (stale,))
+    conn.commit()
+    return len(expired)
+
+
+class WorkerPool:
+    """A handful of threads pulling jobs from the queue table."""
+
+    def __init__(self, database, artifact_dir, workers=DEFAULT_WORKERS,
+                 retention_hours=DEFAULT_RETENTION_HOURS, upload_dir=uploads.DEFAULT_DIR):
+        self.database = database
+        self.artifact_dir = artifact_dir
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.retention_hours = retention_hours
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.periodic = []  # [name, interval, fn(conn), next run (monotonic)]
+        self.every(HEARTBEAT_INTERVAL, "job heartbeat", heartbeat)
+        self.every(CLEANUP_INTERVAL, "export job cleanup", lambda conn: cleanup(conn, self.retention_hours))
+        self.every(COMPACT_INTERVAL, "production log compaction", progress_log.compact)
+        self.every(GARBAGE_INTERVAL, "upload garbage collection",
+                   lambda conn: uploads.collect_garbage(conn, self.upload_dir))
+        self.every(PRUNE_INTERVAL, "sync tombstone pruning", sync.prune)
+
+    def every(self, interval, name, fn):
+        """Run ``fn(conn)`` every ``interval`` seconds on the maintenance thread, first at start."""
+        self.periodic.append([name, interval, fn, 0.0])
+
+    def start(self):
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"export-job-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        if self.workers:
+            thread = threading.Thread(target=self._maintain, name="export-job-maintenance", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def _maintain(self):
+        conn = db.connect(self.database)
+        try:
+            while not self.stopping.is_set():
+                for task in self.periodic:
+                    name, interval, fn, next_run = task
+                    if time.monotonic() < next_run:
+                        continue
+                    task[3] = time.monotonic() + interval
+                    try:
+                        fn(conn)
+                    except Exception:
+                        log.exception("periodic task %r failed", name)
+                        conn.rollback()
+                wait = min(task[3] for task in self.periodic) - time.monotonic()
+                self.stopping.wait(max(wait, 0))
+        finally:
+            conn.close()
+
+    def _loop(self):
+        conn = db.connect(self.database)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    job = claim(conn)
+                    # Thumbnails only run while no export is waiting.
+                    if job is None and uploads.make_next_thumbnail(conn, self.upload_dir):
+                        continue
+                except Exception:
+                    log.exception("export job queue unavailable")
+                    job = None
+                if job is None:
+                    self.wakeup.wait(POLL_INTERVAL)
+                    self.wakeup.clear()
+                    continue
+                run(conn, job, self.artifact_dir)
+        finally:
+            conn.close()
+
+
+def ensure_started(app=None):
+    """Start this process's job threads if they are not running yet."""
+    global _pool
+    if _pool is not None and _pool.pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            app = app or current_app
+            pool = WorkerPool(db.database_path(app), app.config["EXPORT_JOB_DIR"],
+                              workers=app.config["JOB_WORKERS"],
+                              retention_hours=app.config["JOB_RETENTION_HOURS"],
+                              upload_dir=app.config["UPLOAD_DIR"])
+            pool.pid = os.getpid()
+            pool.start()
+            _pool = pool
+    return _pool
+
+
+def init_app(app):
+    app.config.setdefault("EXPORT_JOB_DIR", os.environ.get("EXPORT_JOB_DIR", "export_jobs"))
+    app.config.setdefault("JOB_WORKERS", int(os.environ.get("JOB_WORKERS", DEFAULT_WORKERS)))
+    app.config.setdefault("JOB_RETENTION_HOURS",
+                          float(os.environ.get("JOB_RETENTION_HOURS", DEFAULT_RETENTION_HOURS)))
+    # Threads must not be started before gunicorn forks, so each worker
+    # starts its own pool when it handles its first request.
+    @app.before_request
+    def start_job_pool():
+        ensure_started()
+
+
+if __name__ == "__main__":
+    # Dedicated job runner: python jobs.py
+    logging.basicConfig(level=logging.INFO)
+    pool = WorkerPool(os.environ.get("DATABASE_PATH", db.DEFAULT_DATABASE),
+                      os.environ.get("EXPORT_JOB_DIR", "export_jobs"),
+                      workers=int(os.environ.get("JOB_WORKERS", DEFAULT_WORKERS)),
+                      retention_hours=float(os.environ.get("JOB_RETENTION_HOURS", DEFAULT_RETENTION_HOURS)),
+                      upload_dir=os.environ.get("UPLOAD_DIR", uploads.DEFAULT_DIR))
+    pool.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,128 @@
+"""Keyset (cursor) pagination for the project and vendor listings.
+
+Pages are fetched with ``WHERE <sort key> < cursor ORDER BY <sort key>
+LIMIT n`` so every page costs the same no matter how deep the user scrolls.
+Cursors are opaque url-safe strings handed back to the client.
+"""
+import base64
+import json
+
+from flask import request, url_for
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+PROJECT_COLUMNS = '''
+    p.*, p.client_name AS project_name, p.enquiry_id AS enquiry_no,
+    v.name AS vendor_name
+'''
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """Cursor values as a list, or None for a missing/garbled cursor.
+
+    ``types`` are the types ``encode_cursor`` was given, one per value; a
+    cursor of any other shape is treated as garbled.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    # type(), not isinstance(): JSON true/false must not pass for an int.
+    if any(type(value) is not expected for value, expected in zip(values, types)):
+        return None
+    return values
+
+
+def page_size(args):
+    try:
+        size = int(args.get('limit') or PAGE_SIZE)
+    except (TypeError, ValueError):
+        size = PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def next_page_url(next_cursor):
+    """URL of the next page of the current listing view, keeping its filters."""
+    if not next_cursor:
+        return None
+    args = request.args.to_dict()
+    args['cursor'] = next_cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def project_filters(args):
+    """SQL conditions and params for the status/vendor/date-range filters."""
+    clauses, params = [], []
+    if args.get('status'):
+        clauses.append("p.status = ?")
+        params.append(args['status'])
+    if args.get('vendor_id'):
+        clauses.append("p.vendor_id = ?")
+        params.append(args['vendor_id'])
+    if args.get('from'):
+        clauses.append("p.start_date >= ?")
+        params.append(args['from'])
+    if args.get('to'):
+        clauses.append("p.start_date <= ?")
+        params.append(args['to'])
+    return clauses, params
+
+
+def page_projects(cur, args, columns=PROJECT_COLUMNS, joins=''):
+    """One page of projects, newest first. Returns ``(rows, next_cursor)``."""
+    clauses, params = project_filters(args)
+    cursor = decode_cursor(args.get('cursor'), int)
+    if cursor:
+        clauses.append("p.id < ?")
+        params.append(cursor[0])
+    limit = page_size(args)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    cur.execute(f'''
+        SELECT {columns}
+        FROM projects p LEFT JOIN vendors v ON v.id = p.vendor_id {joins}
+        {where}
+        ORDER BY p.id DESC
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def page_vendors(cur, args):
+    """One page of vendors by name, optionally filtered by a name prefix."""
+    clauses, params = [], []
+    q = (args.get('q') or '').strip()
+    if q:
+        escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("name LIKE ? ESCAPE '\\'")
+        params.append(escaped + '%')
+    cursor = decode_cursor(args.get('cursor'), str, int)
+    if cursor:
+        clauses.append("(name COLLATE NOCASE, id) > (?, ?)")
+        params.extend(cursor)
+    limit = page_size(args)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    cur.execute(f'''
+        SELECT id, name, gst, address FROM vendors
+        {where}
+        ORDER BY name COLLATE NOCASE, id
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last['name'], last['id'])
+    return rows[:limit], next_cursor
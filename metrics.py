@@ -0,0 +1,305 @@
+"""Request, SQL and export instrumentation, served as Prometheus text at /metrics.
+
+Each process keeps its own counters and histograms in memory and
+periodically writes a snapshot to ``METRICS_DIR/worker-<pid>.json``. The
+/metrics view merges every snapshot in the directory, so whichever gunicorn
+worker answers the scrape reports the totals for all of them. Snapshots of
+exited workers are kept so counters never go backwards; the directory is
+cleared when gunicorn starts (see gunicorn.conf.py).
+
+Request connections from ``get_db()`` are opened with ``Connection`` below,
+which counts statements, the time spent in SQLite and the rows fetched, and
+charges them to the current request.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+
+DEFAULT_DIR = "metrics"
+FLUSH_INTERVAL = 1.0  # seconds between snapshot writes per process
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RENDER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000)
+GROUP_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+HELP = {
+    "erp_http_requests_total": ("counter", "Requests handled, by endpoint, method and status."),
+    "erp_http_request_duration_seconds": ("histogram", "Request latency by endpoint."),
+    "erp_sql_statements_per_request": ("histogram", "SQL statements executed per request."),
+    "erp_sql_statements_total": ("counter", "SQL statements executed by requests to an endpoint."),
+    "erp_sql_seconds_total": ("counter", "Time spent in SQLite by requests to an endpoint."),
+    "erp_sql_rows_total": ("counter", "Rows fetched from SQLite by requests to an endpoint."),
+    "erp_export_render_seconds": ("histogram", "Time to render a PDF/XLSX export."),
+    "erp_vendor_cache_total": ("counter", "Vendor record lookups, by cache hit or miss."),
+    "erp_write_group_size": ("histogram", "Writes applied per group commit."),
+    "erp_write_retries_total": ("counter", "Group commits retried because another process held the write lock."),
+}
+BUCKETS = {
+    "erp_http_request_duration_seconds": LATENCY_BUCKETS,
+    "erp_sql_statements_per_request": STATEMENT_BUCKETS,
+    "erp_export_render_seconds": RENDER_BUCKETS,
+    "erp_write_group_size": GROUP_BUCKETS,
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_last_flush = 0.0
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, labels, value=1):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    buckets = BUCKETS[name]
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist[i] += 1
+                break
+        else:
+            hist[len(buckets)] += 1
+        hist[-1] += value
+
+
+@contextmanager
+def render_timer(kind):
+    """Time an export render into ``erp_export_render_seconds``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("erp_export_render_seconds", {"kind": kind}, time.perf_counter() - started)
+
+
+# ---------- Connection instrumentation ----------
+
+def _charge(seconds, statements=0, rows=0):
+    if not has_request_context():
+        return
+    stats = g.get("sql_stats")
+    if stats is not None:
+        stats[0] += statements
+        stats[1] += seconds
+        stats[2] += rows
+
+
+class Cursor(sqlite3.Cursor):
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _charge(time.perf_counter() - started, statements=1)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _charge(time.perf_counter() - started, statements=1)
+
+    def executescript(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            _charge(time.perf_counter() - started, statements=1)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        _charge(time.perf_counter() - started, rows=row is not None)
+        return row
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = super().fetchmany(*args)
+        _charge(time.perf_counter() - started, rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        _charge(time.perf_counter() - started, rows=len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        _charge(time.perf_counter() - started, rows=1)
+        return row
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection whose cursors (including ``conn.execute``) are instrumented."""
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    # The C shortcuts do not go through cursor(), so route them explicitly.
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+
+# ---------- Request hooks ----------
+
+def _endpoint():
+    # The rule's endpoint rather than the path keeps label cardinality bounded.
+    return request.url_rule.endpoint if request.url_rule else "unmatched"
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.sql_stats = [0, 0.0, 0]
+
+
+def _after_request(response):
+    g.response_status = response.status_code
+    return response
+
+
+def _teardown_request(exc=None):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    endpoint = _endpoint()
+    status = g.pop("response_status", 500)
+    statements, sql_seconds, rows = g.pop("sql_stats", (0, 0.0, 0))
+    observe("erp_http_request_duration_seconds", {"endpoint": endpoint},
+            time.perf_counter() - started)
+    inc("erp_http_requests_total", {"endpoint": endpoint, "method": request.method, "status": str(status)})
+    observe("erp_sql_statements_per_request", {"endpoint": endpoint}, statements)
+    inc("erp_sql_statements_total", {"endpoint": endpoint}, statements)
+    inc("erp_sql_seconds_total", {"endpoint": endpoint}, sql_seconds)
+    inc("erp_sql_rows_total", {"endpoint": endpoint}, rows)
+    if time.perf_counter() - _last_flush >= FLUSH_INTERVAL:
+        flush(current_app.config["METRICS_DIR"])
+
+
+# ---------- Snapshots and exposition ----------
+
+def flush(directory):
+    """Write this process's metrics to its snapshot file."""
+    global _last_flush
+    with _lock:
+        _last_flush = time.perf_counter()
+        snapshot = {
+            "counters": [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            "histograms": [[name, dict(labels), list(hist)] for (name, labels), hist in _histograms.items()],
+        }
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"worker-{os.getpid()}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(snapshot, fh)
+    os.replace(tmp_path, path)
+
+
+def collect(directory):
+    """Merge every worker snapshot in ``directory``."""
+    counters, histograms = {}, {}
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path) as fh:
+                snapshot = json.load(fh)
+        except (OSError, ValueError):
+            continue  # being replaced, or a worker died mid-write
+        for name, labels, value in snapshot["counters"]:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, hist in snapshot["histograms"]:
+            key = _key(name, labels)
+            merged = histograms.setdefault(key, [0] * len(hist))
+            for i, value in enumerate(hist):
+                merged[i] += value
+    return counters, histograms
+
+
+def clear(directory):
+    """Remove all snapshots; run once before the workers start."""
+    if os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if entry.name.endswith((".json", ".tmp")):
+                os.remove(entry.path)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            continue
+        buckets = BUCKETS[name]
+        for (metric, labels), hist in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, hist):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            cumulative += hist[len(buckets)]
+            lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(hist[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    directory = current_app.config["METRICS_DIR"]
+    flush(directory)
+    return Response(render(*collect(directory)), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    app.config.setdefault("METRICS_DIR", os.environ.get("METRICS_DIR", DEFAULT_DIR))
+    app.extensions["db_connection_factory"] = Connection
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,446 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in order, inside its own transaction and is
+recorded in ``schema_version``. Run at deploy time, before the web workers
+start::
+
+    python migrations.py            # or: flask --app app migrate
+"""
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+import analytics
+import costing
+import db
+import export_cache
+import progress_log
+import rollups
+import search
+import sync
+import uploads
+import vendor_cache
+
+Migration = namedtuple("Migration", "version name apply foreign_keys_off")
+
+
+def _base_schema(cur):
+    # IF NOT EXISTS here only so databases created by the old init_db()
+    # are adopted as version 1 instead of failing.
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendor_id INTEGER,
+            quotation_ro TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            location TEXT,
+            incharge TEXT,
+            notes TEXT,
+            file_name TEXT,
+            enquiry_id TEXT,
+            client_name TEXT,
+            site_location TEXT,
+            engineer_name TEXT,
+            mobile TEXT,
+            status TEXT DEFAULT 'new',
+            total_sqm REAL DEFAULT 0,
+            FOREIGN KEY(vendor_id) REFERENCES vendors(id)
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS duct_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER,
+            duct_no TEXT,
+            duct_type TEXT,
+            factor TEXT,
+            width1 REAL,
+            height1 REAL,
+            width2 REAL,
+            height2 REAL,
+            length_or_radius REAL,
+            quantity INTEGER,
+            degree_or_offset TEXT,
+            gauge TEXT,
+            area REAL DEFAULT 0,
+            nuts_bolts TEXT,
+            cleat TEXT,
+            gasket TEXT,
+            corner_pieces TEXT,
+            weight REAL DEFAULT 0,
+            FOREIGN KEY (project_id) REFERENCES projects(id)
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS vendors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            gst TEXT,
+            address TEXT,
+            bank_name TEXT,
+            account_number TEXT,
+            ifsc TEXT
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS vendor_contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendor_id INTEGER,
+            name TEXT,
+            phone TEXT,
+            email TEXT,
+            FOREIGN KEY(vendor_id) REFERENCES vendors(id)
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            role TEXT,
+            contact TEXT,
+            email TEXT UNIQUE,
+            password TEXT
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS production_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER,
+            sheet_cutting_sqm REAL DEFAULT 0,
+            plasma_fabrication_sqm REAL DEFAULT 0,
+            boxing_assembly_sqm REAL DEFAULT 0
+        )
+    ''')
+
+    cur.execute('''
+        INSERT OR IGNORE INTO users (email, name, role, contact, password)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ("admin@ducting.com", "Admin", "Admin", "9999999999", "admin123"))
+
+    cur.execute('''
+        INSERT OR IGNORE INTO vendors (id, name, gst, address, bank_name, account_number, ifsc)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (1, "Dummy Vendor Pvt Ltd", "29ABCDE1234F2Z5", "123 Main Street, City", "Axis Bank", "1234567890", "UTIB0000123"))
+
+    cur.execute("SELECT 1 FROM vendor_contacts WHERE vendor_id = 1")
+    if cur.fetchone() is None:
+        cur.execute('''
+            INSERT INTO vendor_contacts (vendor_id, name, phone, email)
+            VALUES (?, ?, ?, ?)
+        ''', (1, "Mr. Dummy", "9876543210", "dummy@vendor.com"))
+
+
+def _project_rollups(cur):
+    rollups.install(cur)
+
+
+def _cascading_foreign_keys(cur):
+    # SQLite cannot alter a foreign key, so the child tables are rebuilt.
+    # Rows whose parent no longer exists are dropped; they were unreachable.
+    cur.execute('''
+        CREATE TABLE duct_entries_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+            duct_no TEXT,
+            duct_type TEXT,
+            factor TEXT,
+            width1 REAL,
+            height1 REAL,
+            width2 REAL,
+            height2 REAL,
+            length_or_radius REAL,
+            quantity INTEGER,
+            degree_or_offset TEXT,
+            gauge TEXT,
+            area REAL DEFAULT 0,
+            nuts_bolts TEXT,
+            cleat TEXT,
+            gasket TEXT,
+            corner_pieces TEXT,
+            weight REAL DEFAULT 0
+        )
+    ''')
+    cur.execute('''
+        INSERT INTO duct_entries_new
+        SELECT * FROM duct_entries WHERE project_id IN (SELECT id FROM projects)
+    ''')
+    cur.execute("DROP TABLE duct_entries")
+    cur.execute("ALTER TABLE duct_entries_new RENAME TO duct_entries")
+    # Dropping the table dropped its rollup triggers.
+    for statement in rollups.TRIGGERS:
+        cur.execute(statement)
+
+    cur.execute('''
+        CREATE TABLE vendor_contacts_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendor_id INTEGER NOT NULL REFERENCES vendors(id) ON DELETE CASCADE,
+            name TEXT,
+            phone TEXT,
+            email TEXT
+        )
+    ''')
+    cur.execute('''
+        INSERT INTO vendor_contacts_new
+        SELECT * FROM vendor_contacts WHERE vendor_id IN (SELECT id FROM vendors)
+    ''')
+    cur.execute("DROP TABLE vendor_contacts")
+    cur.execute("ALTER TABLE vendor_contacts_new RENAME TO vendor_contacts")
+
+    cur.execute('''
+        CREATE TABLE production_progress_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL UNIQUE REFERENCES projects(id) ON DELETE CASCADE,
+            sheet_cutting_sqm REAL DEFAULT 0,
+            plasma_fabrication_sqm REAL DEFAULT 0,
+            boxing_assembly_sqm REAL DEFAULT 0
+        )
+    ''')
+    # Keep the most recent progress row when a project has duplicates.
+    cur.execute('''
+        INSERT INTO production_progress_new
+        SELECT * FROM production_progress
+        WHERE id IN (SELECT MAX(id) FROM production_progress GROUP BY project_id)
+          AND project_id IN (SELECT id FROM projects)
+    ''')
+    cur.execute("DROP TABLE production_progress")
+    cur.execute("ALTER TABLE production_progress_new RENAME TO production_progress")
+
+    rollups.rebuild(cur)
+
+
+def _lookup_indexes(cur):
+    cur.execute("CREATE INDEX idx_duct_entries_project ON duct_entries(project_id)")
+    cur.execute("CREATE INDEX idx_vendor_contacts_vendor ON vendor_contacts(vendor_id)")
+    cur.execute("CREATE INDEX idx_projects_vendor ON projects(vendor_id)")
+
+
+def _listing_indexes(cur):
+    cur.execute("CREATE INDEX idx_projects_status ON projects(status)")
+    cur.execute("CREATE INDEX idx_projects_start_date ON projects(start_date)")
+    cur.execute("CREATE INDEX idx_vendors_name ON vendors(name COLLATE NOCASE)")
+
+
+def _export_jobs(cur):
+    cur.execute('''
+        CREATE TABLE export_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            project_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            worker TEXT,
+            artifact_path TEXT,
+            download_name TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    cur.execute("CREATE INDEX idx_export_jobs_status ON export_jobs(status, id)")
+
+
+def _project_versions(cur):
+    export_cache.install(cur)
+    cur.execute("INSERT INTO project_versions (project_id, version) SELECT id, 1 FROM projects")
+
+
+def _slow_queries(cur):
+    cur.execute('''
+        CREATE TABLE slow_queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fingerprint TEXT NOT NULL,
+            sql TEXT NOT NULL,
+            expanded_sql TEXT,
+            params TEXT,
+            duration_ms REAL NOT NULL,
+            route TEXT,
+            plan TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cur.execute("CREATE INDEX idx_slow_queries_fingerprint ON slow_queries(fingerprint)")
+
+
+def _duct_entry_dates(cur):
+    # created_on needs a non-constant default, which ALTER TABLE cannot add,
+    # so the table is rebuilt; its triggers and indexes are recreated as-is.
+    cur.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = 'duct_entries' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    """)
+    dependents = [row[0] for row in cur.fetchall()]
+    cur.execute('''
+        CREATE TABLE duct_entries_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+            duct_no TEXT,
+            duct_type TEXT,
+            factor TEXT,
+            width1 REAL,
+            height1 REAL,
+            width2 REAL,
+            height2 REAL,
+            length_or_radius REAL,
+            quantity INTEGER,
+            degree_or_offset TEXT,
+            gauge TEXT,
+            area REAL DEFAULT 0,
+            nuts_bolts TEXT,
+            cleat TEXT,
+            gasket TEXT,
+            corner_pieces TEXT,
+            weight REAL DEFAULT 0,
+            created_on TEXT NOT NULL DEFAULT (date('now'))
+        )
+    ''')
+    # Existing ducts have no entry date; the project's start is the best guess.
+    cur.execute('''
+        INSERT INTO duct_entries_new
+        SELECT d.*, COALESCE(NULLIF(p.start_date, ''), date('now'))
+        FROM duct_entries d JOIN projects p ON p.id = d.project_id
+    ''')
+    cur.execute("DROP TABLE duct_entries")
+    cur.execute("ALTER TABLE duct_entries_new RENAME TO duct_entries")
+    for sql in dependents:
+        cur.execute(sql)
+    analytics.install(cur)
+    cur.execute("CREATE INDEX idx_projects_end_date ON projects(end_date)")
+
+
+def _production_events(cur):
+    progress_log.install(cur)
+    # Progress so far becomes an opening event on the project's start date,
+    # the same backfill the duct entry dates got.
+    for stage, column, _ in progress_log.STAGES:
+        cur.execute(f'''
+            INSERT INTO production_events (project_id, stage, sqm_delta, sqm, recorded_at)
+            SELECT pp.project_id, ?, pp.{column}, pp.{column},
+                   COALESCE(NULLIF(p.start_date, ''), date('now')) || 'T00:00:00'
+            FROM production_progress pp JOIN projects p ON p.id = pp.project_id
+            WHERE IFNULL(pp.{column}, 0) != 0
+        ''', (stage,))
+
+
+def _search_indexes(cur):
+    search.install(cur)
+
+
+def _vendor_generation(cur):
+    vendor_cache.install(cur)
+
+
+def _drawing_uploads(cur):
+    uploads.install(cur)
+
+
+def _costing(cur):
+    costing.install(cur)
+    project_ids = costing.open_projects(cur)
+    for start in range(0, len(project_ids), costing.CHUNK_SIZE):
+        costing.store(cur, costing.price_projects(cur, project_ids[start:start + costing.CHUNK_SIZE]))
+
+
+def _sync_changes(cur):
+    sync.install(cur)
+    sync.backfill(cur)
+
+
+def _finite_duct_values(cur):
+    rollups.install(cur)
+
+
+def _export_job_heartbeats(cur):
+    cur.execute("ALTER TABLE export_jobs ADD COLUMN heartbeat_at TEXT")
+
+
+MIGRATIONS = [
+    Migration(1, "base schema", _base_schema, False),
+    Migration(2, "project rollups", _project_rollups, False),
+    Migration(3, "cascading foreign keys, unique production_progress", _cascading_foreign_keys, True),
+    Migration(4, "lookup indexes", _lookup_indexes, False),
+    Migration(5, "listing indexes", _listing_indexes, False),
+    Migration(6, "export job queue", _export_jobs, False),
+    Migration(7, "project content versions", _project_versions, False),
+    Migration(8, "slow query log", _slow_queries, False),
+    Migration(9, "duct entry dates, type and daily rollups", _duct_entry_dates, True),
+    Migration(10, "production event log", _production_events, False),
+    Migration(11, "full-text search indexes", _search_indexes, False),
+    Migration(12, "vendor cache generation", _vendor_generation, False),
+    Migration(13, "content-addressed drawing uploads", _drawing_uploads, False),
+    Migration(14, "rate tables and project quotes", _costing, False),
+    Migration(15, "row change tracking for tablet sync", _sync_changes, False),
+    Migration(16, "refuse infinite duct values", _finite_duct_values, False),
+    Migration(17, "export job heartbeats", _export_job_heartbeats, False),
+]
+
+
+def current_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    return conn.execute("SELECT IFNULL(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Apply every pending migration up to ``target``; returns the versions applied."""
+    conn.isolation_level = None  # we issue BEGIN/COMMIT ourselves
+    applied = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        if migration.foreign_keys_off:
+            # Can only be toggled outside a transaction.
+            conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Re-checked under the write lock so concurrent runners skip it.
+                if migration.version <= current_version(conn):
+                    conn.execute("ROLLBACK")
+                    continue
+                cur = conn.cursor()
+                migration.apply(cur)
+                if migration.foreign_keys_off:
+                    cur.execute("PRAGMA foreign_key_check")
+                    if cur.fetchone() is not None:
+                        raise RuntimeError(f"migration {migration.version} broke foreign keys")
+                cur.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                            (migration.version, migration.name, datetime.now().isoformat(timespec="seconds")))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            if migration.foreign_keys_off:
+                conn.execute("PRAGMA foreign_keys = ON")
+        applied.append(migration.version)
+    return applied
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    conn = db.connect(argv[0] if argv else None)
+    try:
+        applied = migrate(conn)
+        version = current_version(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"🔧 Applied migrations {applied}, schema at version {version}")
+    else:
+        print(f"✅ Schema up to date at version {version}")
+
+
+if __name__ == "__main__":
+    main()
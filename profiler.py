@@ -0,0 +1,318 @@
+"""Opt-in slow-query log for request connections.
+
+Enable with ``SQL_PROFILE=1`` (threshold ``SLOW_QUERY_MS``, default 100).
+Request connections are then opened with ``Connection`` below: each
+statement is timed from ``execute`` until its cursor is exhausted or reused
+(so the time spent fetching rows counts), and ``set_trace_callback`` records
+the SQL exactly as SQLite ran it, with the parameters bound in.
+
+Statements over the threshold are logged to the ``sql.slow`` logger and,
+after the response, stored in ``slow_queries`` with their normalized SQL,
+parameters, duration and route. Text parameters of statements on
+``SENSITIVE_TABLES`` are kept only as their length, in the log, the table
+and the expanded SQL alike. The first time a statement shape is seen
+slow in a process its ``EXPLAIN QUERY PLAN`` is captured too, so full scans
+show up on /admin/slow_queries without anyone reproducing the request.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import weakref
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, redirect, render_template, request, session, url_for
+
+import db
+import metrics
+
+log = logging.getLogger("sql.slow")
+
+DEFAULT_THRESHOLD_MS = 100
+KEEP_ROWS = 10_000          # slow_queries is trimmed to the most recent rows
+PLAN_CACHE_SIZE = 256       # statement shapes whose plan this process already captured
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+FULL_SCAN_TABLES = ("duct_entries", "projects")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+# Tables whose text parameters may be secrets (passwords, bank details, contacts).
+SENSITIVE_TABLES = ("users", "vendors", "vendor_contacts")
+_SENSITIVE = re.compile(rf"\b(?:{'|'.join(SENSITIVE_TABLES)})\b", re.I)
+_PLACEHOLDER = re.compile(r"'(?:[^']|'')*'|\?\d*|[:@$]\w+")
+
+_planned = {}  # fingerprint -> plan text
+
+
+def normalize(sql):
+    """SQL with literals replaced by ``?`` and whitespace collapsed."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?, ...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def _mask(value):
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    return value
+
+
+def redact(sql, params):
+    """``params`` with the text values masked if ``sql`` touches a sensitive table."""
+    if not _SENSITIVE.search(sql) or not isinstance(params, (tuple, list, dict)):
+        return params
+    if isinstance(params, dict):
+        return {name: _mask(value) for name, value in params.items()}
+    return [_mask(value) for value in params]
+
+
+def _expand(sql, params):
+    """``sql`` with (already redacted) ``params`` written in place of its placeholders."""
+    positional = iter(params) if isinstance(params, list) else iter(())
+
+    def bind(match):
+        token = match.group()
+        if token.startswith("'"):
+            return token
+        try:
+            value = params[token[1:]] if isinstance(params, dict) else next(positional)
+        except (KeyError, StopIteration):
+            return token
+        return "NULL" if value is None else repr(value)
+
+    return _PLACEHOLDER.sub(bind, sql)
+
+
+def _record(sql, params, seconds, expanded):
+    if not has_request_context():
+        return
+    threshold = current_app.config["SLOW_QUERY_MS"] / 1000
+    if seconds < threshold:
+        return
+    normalized = normalize(sql)
+    redacted = redact(sql, params)
+    if redacted is not params:
+        # The traced SQL has the raw values bound in.
+        expanded = _expand(sql, redacted)
+    record = {
+        "fingerprint": fingerprint(normalized),
+        "sql": normalized,
+        "raw_sql": sql,
+        "expanded": expanded or sql,
+        "params": redacted,
+        # Raw values, only for EXPLAIN QUERY PLAN; never logged or stored.
+        "plan_params": params,
+        "duration_ms": round(seconds * 1000, 2),
+        "route": request.endpoint or request.path,
+    }
+    log.warning("slow query %.1f ms [%s] %s params=%r",
+                record["duration_ms"], record["route"], normalized, redacted)
+    g.setdefault("slow_queries", []).append(record)
+
+
+class Cursor(metrics.Cursor):
+    """Times each statement from execute() until the cursor is exhausted or reused."""
+
+    _statement = None
+
+    def _start(self, sql, params):
+        self._finish()
+        self._statement = [sql, params, 0.0, None]
+        self.connection.pending.add(self)
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is not None:
+            self.connection.pending.discard(self)
+            _record(*statement)
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[2] += time.perf_counter() - started
+
+    def execute(self, sql, params=()):
+        self._start(sql, params)
+        result = self._timed(super().execute, sql, params)
+        # The trace callback fired while the statement started running.
+        self._statement[3] = self.connection.last_traced
+        return result
+
+    def executemany(self, sql, seq_of_params):
+        self._start(sql, "<many>")
+        result = self._timed(super().executemany, sql, seq_of_params)
+        self._finish()
+        return result
+
+    def executescript(self, script):
+        self._start(script, ())
+        result = self._timed(super().executescript, script)
+        self._finish()
+        return result
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed(super().fetchmany, *args)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+
+class Connection(metrics.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_traced = None
+        self.pending = weakref.WeakSet()
+        self.set_trace_callback(self._trace)
+
+    def _trace(self, sql):
+        self.last_traced = sql
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def finish_pending(self):
+        """Account for statements whose cursors were never read to the end."""
+        for cursor in list(self.pending):
+            cursor._finish()
+
+
+def _plan(conn, sql, params):
+    if params == "<many>" or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except Exception as e:  # e.g. the statement referenced a temp table
+        return f"(plan unavailable: {e})"
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+_KEYWORDS = {"WHERE", "LEFT", "INNER", "CROSS", "JOIN", "ON", "USING", "ORDER", "GROUP",
+             "LIMIT", "SET", "VALUES", "AND", "OR", "AS", "NATURAL"}
+
+
+def full_scans(plan, sql):
+    """Tables from FULL_SCAN_TABLES that ``plan`` reads without an index."""
+    if not plan:
+        return []
+    scans = []
+    for table in FULL_SCAN_TABLES:
+        names = {table} | {alias for alias in re.findall(rf"\b{table}\s+(?:AS\s+)?(\w+)", sql, re.I)
+                           if alias.upper() not in _KEYWORDS}
+        for name in names:
+            if re.search(rf"^\s*SCAN {name}\b(?!.*USING (COVERING )?INDEX)", plan, re.M):
+                scans.append(table)
+                break
+    return scans
+
+
+def _teardown_request(exc=None):
+    conn = g.get("db")
+    if isinstance(conn, Connection):
+        conn.finish_pending()
+    records = g.pop("slow_queries", None)
+    if not records:
+        return
+    # A separate connection: the request's may be mid-transaction or rolled back.
+    store = db.connect(db.database_path())
+    try:
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = []
+        for record in records:
+            plan = _planned.get(record["fingerprint"])
+            if plan is None:
+                plan = _plan(store, record["raw_sql"], record["plan_params"])
+                if len(_planned) >= PLAN_CACHE_SIZE:
+                    _planned.pop(next(iter(_planned)))
+                _planned[record["fingerprint"]] = plan
+                for table in full_scans(plan, record["sql"]):
+                    log.warning("full scan of %s in [%s] %s", table, record["route"], record["sql"])
+            rows.append((record["fingerprint"], record["sql"], record["expanded"],
+                         json.dumps(record["params"], default=str), record["duration_ms"],
+                         record["route"], plan, now))
+        store.executemany('''
+            INSERT INTO slow_queries (fingerprint, sql, expanded_sql, params, duration_ms, route, plan, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        store.execute("DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?",
+                      (KEEP_ROWS,))
+        store.commit()
+    except Exception:
+        log.exception("could not store slow queries")
+    finally:
+        store.close()
+
+
+def top_offenders(cur, limit=50):
+    """Statement shapes ordered by the total time they spent over the threshold."""
+    cur.execute('''
+        SELECT s.fingerprint, s.sql, COUNT(*) AS hits, ROUND(SUM(s.duration_ms), 1) AS total_ms,
+               ROUND(AVG(s.duration_ms), 1) AS avg_ms, MAX(s.duration_ms) AS max_ms,
+               MAX(s.created_at) AS last_seen, GROUP_CONCAT(DISTINCT s.route) AS routes,
+               (SELECT plan FROM slow_queries p WHERE p.fingerprint = s.fingerprint AND p.plan IS NOT NULL
+                ORDER BY p.id DESC LIMIT 1) AS plan,
+               (SELECT expanded_sql FROM slow_queries p WHERE p.fingerprint = s.fingerprint
+                ORDER BY p.duration_ms DESC LIMIT 1) AS slowest_example
+        FROM slow_queries s
+        GROUP BY s.fingerprint
+        ORDER BY SUM(s.duration_ms) DESC
+        LIMIT ?
+    ''', (limit,))
+    return [dict(row, full_scans=full_scans(row["plan"], row["sql"])) for row in cur.fetchall()]
+
+
+def slow_queries_view():
+    if session.get("role") != "Admin":
+        return redirect(url_for("main.login"))
+    conn = db.get_db()
+    if request.method == "POST":
+        conn.execute("DELETE FROM slow_queries")
+        conn.commit()
+        return redirect(url_for("slow_queries"))
+    return render_template("slow_queries.html", offenders=top_offenders(conn.cursor()),
+                           enabled=current_app.config["SQL_PROFILE"],
+                           threshold=current_app.config["SLOW_QUERY_MS"])
+
+
+def init_app(app):
+    app.config.setdefault("SQL_PROFILE", os.environ.get("SQL_PROFILE", "") not in ("", "0", "false"))
+    app.config.setdefault("SLOW_QUERY_MS", float(os.environ.get("SLOW_QUERY_MS", DEFAULT_THRESHOLD_MS)))
+    app.add_url_rule("/admin/slow_queries", "slow_queries", slow_queries_view, methods=["GET", "POST"])
+    if app.config["SQL_PROFILE"]:
+        app.extensions["db_connection_factory"] = Connection
+        app.teardown_request(_teardown_request)
@@ -0,0 +1,188 @@
+"""Production progress history.
+
+Every progress update is appended to ``production_events`` as one row per
+stage that changed, holding both the change and the stage's new total.
+``production_progress`` stays the current-state snapshot and is written in
+the same transaction, so nothing that reads it has to look at the log.
+
+Raw events are kept for ``EVENT_RETENTION_DAYS``; ``compact()`` rolls older
+ones into ``production_daily`` (one row per project, stage and day with the
+day's net change and closing total). Since every row carries a running
+total, "as of" a date is a single index seek per stage, and sqm per day
+reads the daily buckets plus the recent events, never the full history.
+"""
+from datetime import date, datetime, timedelta
+
+# (stage, production_progress column, label)
+STAGES = (
+    ('sheet_cutting', 'sheet_cutting_sqm', 'Sheet Cutting'),
+    ('plasma_fabrication', 'plasma_fabrication_sqm', 'Plasma & Fabrication'),
+    ('boxing_assembly', 'boxing_assembly_sqm', 'Boxing & Assembly'),
+)
+EVENT_RETENTION_DAYS = 90
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS production_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        stage TEXT NOT NULL,
+        sqm_delta REAL NOT NULL,
+        sqm REAL NOT NULL,
+        recorded_at TEXT NOT NULL,
+        recorded_by TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS production_daily (
+        project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        stage TEXT NOT NULL,
+        day TEXT NOT NULL,
+        sqm_delta REAL NOT NULL,
+        sqm REAL NOT NULL,
+        events INTEGER NOT NULL,
+        PRIMARY KEY (project_id, stage, day)
+    ) WITHOUT ROWID
+    ''',
+]
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_production_events_project "
+    "ON production_events(project_id, stage, recorded_at)",
+    # Covering, so per-day totals across projects never touch the table.
+    "CREATE INDEX IF NOT EXISTS idx_production_events_time "
+    "ON production_events(recorded_at, stage, sqm_delta)",
+    "CREATE INDEX IF NOT EXISTS idx_production_daily_day "
+    "ON production_daily(day, stage, sqm_delta)",
+]
+
+
+def install(cur):
+    for statement in TABLES + INDEXES:
+        cur.execute(statement)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _day_after(day):
+    return (date.fromisoformat(str(day)[:10]) + timedelta(days=1)).isoformat()
+
+
+def record(cur, project_id, values, recorded_by=None, recorded_at=None):
+    """Log a progress update and refresh the snapshot; returns the number of events.
+
+    ``values`` maps stage names to their new total sqm; stages left out or
+    unchanged get no event. The change is worked out inside the INSERT, so
+    concurrent updates cannot log a change against a stale total. The
+    caller commits.
+    """
+    recorded_at = recorded_at or _now()
+    events = 0
+    for stage, column, _ in STAGES:
+        if stage not in values:
+            continue
+        cur.execute(f'''
+            INSERT INTO production_events (project_id, stage, sqm_delta, sqm, recorded_at, recorded_by)
+            SELECT :project_id, :stage, :sqm - previous, :sqm, :recorded_at, :recorded_by
+            FROM (SELECT IFNULL((SELECT {column} FROM production_progress
+                                 WHERE project_id = :project_id), 0) AS previous)
+            WHERE previous != :sqm
+        ''', {'project_id': project_id, 'stage': stage, 'sqm': float(values[stage]),
+              'recorded_at': recorded_at, 'recorded_by': recorded_by})
+        events += cur.rowcount
+    if events:
+        stages = [(stage, column) for stage, column, _ in STAGES if stage in values]
+        cur.execute(f'''
+            INSERT INTO production_progress (project_id, {', '.join(column for _, column in stages)})
+            VALUES (?, {', '.join('?' * len(stages))})
+            ON CONFLICT(project_id) DO UPDATE SET
+                {', '.join(f'{column} = excluded.{column}' for _, column in stages)}
+        ''', (project_id, *(float(values[stage]) for stage, _ in stages)))
+    return events
+
+
+def compact(conn, keep_days=EVENT_RETENTION_DAYS, today=None):
+    """Roll events from before the last ``keep_days`` days into daily buckets.
+
+    Returns the number of events folded in. Commits.
+    """
+    cutoff = ((today or date.today()) - timedelta(days=keep_days)).isoformat()
+    cur = conn.cursor()
+    # MAX(id) makes the bare ``sqm`` the day's last (closing) total.
+    cur.execute('''
+        INSERT INTO production_daily (project_id, stage, day, sqm_delta, sqm, events)
+        SELECT project_id, stage, day, sqm_delta, sqm, events FROM (
+            SELECT project_id, stage, substr(recorded_at, 1, 10) AS day, SUM(sqm_delta) AS sqm_delta,
+                   sqm, COUNT(*) AS events, MAX(id)
+            FROM production_events
+            WHERE recorded_at < ?
+            GROUP BY project_id, stage, day
+        ) WHERE true
+        ON CONFLICT(project_id, stage, day) DO UPDATE SET
+            sqm_delta = sqm_delta + excluded.sqm_delta,
+            sqm = excluded.sqm,
+            events = events + excluded.events
+    ''', (cutoff,))
+    cur.execute("DELETE FROM production_events WHERE recorded_at < ?", (cutoff,))
+    compacted = cur.rowcount
+    conn.commit()
+    return compacted
+
+
+def as_of(cur, project_id, day):
+    """Each stage's total sqm at the end of ``day`` (an ISO date)."""
+    end = _day_after(day)
+    totals = {}
+    for stage, _, _ in STAGES:
+        cur.execute('''
+            SELECT sqm FROM production_events
+            WHERE project_id = ? AND stage = ? AND recorded_at < ?
+            ORDER BY recorded_at DESC, id DESC LIMIT 1
+        ''', (project_id, stage, end))
+        row = cur.fetchone()
+        if row is None:
+            # Compacted days all precede the first remaining event.
+            cur.execute('''
+                SELECT sqm FROM production_daily
+                WHERE project_id = ? AND stage = ? AND day < ?
+                ORDER BY day DESC LIMIT 1
+            ''', (project_id, stage, end))
+            row = cur.fetchone()
+        totals[stage] = row[0] if row else 0.0
+    return totals
+
+
+def throughput(cur, since, until=None, project_id=None):
+    """Net sqm per day per stage between two ISO dates (inclusive).
+
+    Across all projects unless ``project_id`` is given. Returns rows of
+    ``{'day', 'stage', 'sqm', 'events'}`` ordered by day and stage.
+    """
+    end = _day_after(until or date.today())
+    project_filter = "AND project_id = :project_id" if project_id is not None else ""
+    cur.execute(f'''
+        SELECT day, stage, ROUND(SUM(sqm), 2) AS sqm, SUM(events) AS events FROM (
+            SELECT day, stage, SUM(sqm_delta) AS sqm, SUM(events) AS events
+            FROM production_daily
+            WHERE day >= :since AND day < :end {project_filter}
+            GROUP BY day, stage
+            UNION ALL
+            SELECT substr(recorded_at, 1, 10) AS day, stage, SUM(sqm_delta), COUNT(*)
+            FROM production_events
+            WHERE recorded_at >= :since AND recorded_at < :end {project_filter}
+            GROUP BY 1, stage
+        )
+        GROUP BY day, stage
+        ORDER BY day, stage
+    ''', {'since': str(since)[:10], 'end': end, 'project_id': project_id})
+    return [dict(row) for row in cur.fetchall()]
+
+
+def history(cur, project_id, limit=50):
+    """The project's most recent raw events, newest first."""
+    cur.execute('''
+        SELECT stage, sqm_delta, sqm, recorded_at, recorded_by FROM production_events
+        WHERE project_id = ? ORDER BY recorded_at DESC, id DESC LIMIT ?
+    ''', (project_id, limit))
+    return [dict(row) for row in cur.fetchall()]
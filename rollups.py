@@ -0,0 +1,169 @@
+"""Per-project duct rollups.
+
+``project_totals`` holds one row per project with the summed duct quantities
+and ``project_gauge_totals`` the same per gauge. Both are kept current by
+triggers on ``duct_entries``, so read paths never have to scan or rewrite
+the ducts of a project. A duct with an infinite value is refused outright:
+it could never be subtracted out of the sums again.
+"""
+
+TOTAL_COLUMNS = ('duct_count', 'total_qty', 'total_area', 'total_weight',
+                 'total_nuts_bolts', 'total_cleat', 'total_gasket', 'total_corner_pieces')
+GAUGE_COLUMNS = ('duct_count', 'total_qty', 'total_area', 'total_weight')
+NUMERIC_COLUMNS = ('factor', 'width1', 'height1', 'width2', 'height2', 'length_or_radius', 'quantity',
+                   'degree_or_offset', 'area', 'nuts_bolts', 'cleat', 'gasket', 'corner_pieces', 'weight')
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS project_totals (
+        project_id INTEGER PRIMARY KEY,
+        duct_count INTEGER NOT NULL DEFAULT 0,
+        total_qty INTEGER NOT NULL DEFAULT 0,
+        total_area REAL NOT NULL DEFAULT 0,
+        total_weight REAL NOT NULL DEFAULT 0,
+        total_nuts_bolts REAL NOT NULL DEFAULT 0,
+        total_cleat REAL NOT NULL DEFAULT 0,
+        total_gasket REAL NOT NULL DEFAULT 0,
+        total_corner_pieces REAL NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS project_gauge_totals (
+        project_id INTEGER NOT NULL,
+        gauge TEXT NOT NULL,
+        duct_count INTEGER NOT NULL DEFAULT 0,
+        total_qty INTEGER NOT NULL DEFAULT 0,
+        total_area REAL NOT NULL DEFAULT 0,
+        total_weight REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (project_id, gauge)
+    )
+    ''',
+]
+
+
+def _apply(row, sign):
+    """Trigger body adding (sign='+') or removing (sign='-') one duct row."""
+    n = '1' if sign == '+' else '-1'
+    values = [n,
+              f"{sign}IFNULL({row}.quantity, 0)",
+              f"{sign}IFNULL({row}.area, 0)",
+              f"{sign}IFNULL({row}.weight, 0)",
+              f"{sign}IFNULL(CAST({row}.nuts_bolts AS REAL), 0)",
+              f"{sign}IFNULL(CAST({row}.cleat AS REAL), 0)",
+              f"{sign}IFNULL(CAST({row}.gasket AS REAL), 0)",
+              f"{sign}IFNULL(CAST({row}.corner_pieces AS REAL), 0)"]
+    return f'''
+        INSERT INTO project_totals (project_id, {', '.join(TOTAL_COLUMNS)})
+        VALUES ({row}.project_id, {', '.join(values)})
+        ON CONFLICT(project_id) DO UPDATE SET
+            {', '.join(f'{c} = {c} + excluded.{c}' for c in TOTAL_COLUMNS)};
+        INSERT INTO project_gauge_totals (project_id, gauge, {', '.join(GAUGE_COLUMNS)})
+        VALUES ({row}.project_id, IFNULL({row}.gauge, ''), {', '.join(values[:4])})
+        ON CONFLICT(project_id, gauge) DO UPDATE SET
+            {', '.join(f'{c} = {c} + excluded.{c}' for c in GAUGE_COLUMNS)};
+        DELETE FROM project_gauge_totals
+        WHERE project_id = {row}.project_id AND gauge = IFNULL({row}.gauge, '') AND duct_count <= 0;
+        UPDATE projects SET total_sqm = (
+            SELECT ROUND(total_area, 2) FROM project_totals WHERE project_id = {row}.project_id
+        ) WHERE id = {row}.project_id;
+    '''
+
+
+def _finite(event):
+    # SQLite stores NaN as NULL, but keeps infinities; as text they read 'Inf'.
+    infinite = ' OR '.join(f"CAST(NEW.{c} AS TEXT) IN ('Inf', '-Inf')" for c in NUMERIC_COLUMNS)
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS duct_entries_finite_{event.lower()}
+    BEFORE {event} ON duct_entries
+    WHEN {infinite}
+    BEGIN SELECT RAISE(ABORT, 'duct values must be finite numbers'); END
+    '''
+
+
+TRIGGERS = [
+    _finite('INSERT'),
+    _finite('UPDATE'),
+    f'''
+    CREATE TRIGGER IF NOT EXISTS duct_entries_rollup_insert
+    AFTER INSERT ON duct_entries
+    BEGIN {_apply('NEW', '+')} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS duct_entries_rollup_delete
+    AFTER DELETE ON duct_entries
+    BEGIN {_apply('OLD', '-')} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS duct_entries_rollup_update
+    AFTER UPDATE OF project_id, quantity, area, weight, nuts_bolts, cleat, gasket,
+                    corner_pieces, gauge ON duct_entries
+    BEGIN {_apply('OLD', '-')} {_apply('NEW', '+')} END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS projects_rollup_delete
+    AFTER DELETE ON projects
+    BEGIN
+        DELETE FROM project_totals WHERE project_id = OLD.id;
+        DELETE FROM project_gauge_totals WHERE project_id = OLD.id;
+    END
+    ''',
+]
+
+
+def install(cur):
+    """Create the rollup tables and triggers; backfill them if they are new."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'project_totals'")
+    existed = cur.fetchone() is not None
+    for statement in TABLES + TRIGGERS:
+        cur.execute(statement)
+    if not existed:
+        rebuild(cur)
+
+
+def rebuild(cur, project_id=None):
+    """Recompute the rollups from ``duct_entries`` (all projects, or one)."""
+    where = "WHERE project_id = ?" if project_id is not None else ""
+    params = (project_id,) if project_id is not None else ()
+    cur.execute(f"DELETE FROM project_totals {where}", params)
+    cur.execute(f"DELETE FROM project_gauge_totals {where}", params)
+    cur.execute(f'''
+        INSERT INTO project_totals (project_id, {', '.join(TOTAL_COLUMNS)})
+        SELECT project_id, COUNT(*), IFNULL(SUM(quantity), 0), IFNULL(SUM(area), 0),
+               IFNULL(SUM(weight), 0), IFNULL(SUM(CAST(nuts_bolts AS REAL)), 0),
+               IFNULL(SUM(CAST(cleat AS REAL)), 0), IFNULL(SUM(CAST(gasket AS REAL)), 0),
+               IFNULL(SUM(CAST(corner_pieces AS REAL)), 0)
+        FROM duct_entries {where} GROUP BY project_id
+    ''', params)
+    cur.execute(f'''
+        INSERT INTO project_gauge_totals (project_id, gauge, {', '.join(GAUGE_COLUMNS)})
+        SELECT project_id, IFNULL(gauge, ''), COUNT(*), IFNULL(SUM(quantity), 0),
+               IFNULL(SUM(area), 0), IFNULL(SUM(weight), 0)
+        FROM duct_entries {where} GROUP BY project_id, IFNULL(gauge, '')
+    ''', params)
+    cur.execute(f'''
+        UPDATE projects SET total_sqm = IFNULL((
+            SELECT ROUND(total_area, 2) FROM project_totals WHERE project_id = projects.id
+        ), 0) {"WHERE id = ?" if project_id is not None else ""}
+    ''', params)
+
+
+def project_totals(cur, project_id):
+    """Totals for one project as a dict (zeros if it has no ducts)."""
+    cur.execute(f"SELECT {', '.join(TOTAL_COLUMNS)} FROM project_totals WHERE project_id = ?",
+                (project_id,))
+    row = cur.fetchone()
+    if row is None:
+        return {column: 0 for column in TOTAL_COLUMNS}
+    return {column: (round(row[i], 2) if isinstance(row[i], float) else row[i])
+            for i, column in enumerate(TOTAL_COLUMNS)}
+
+
+def gauge_totals(cur, project_id):
+    """Per-gauge totals for one project, ordered by gauge."""
+    cur.execute(f'''
+        SELECT gauge, {', '.join(GAUGE_COLUMNS)} FROM project_gauge_totals
+        WHERE project_id = ? ORDER BY gauge
+    ''', (project_id,))
+    return [{'gauge': row[0], 'duct_count': row[1], 'total_qty': row[2],
+             'total_area': round(row[3], 2), 'total_weight': round(row[4], 2)}
+            for row in cur.fetchall()]
@@ -0,0 +1,237 @@
+"""Full-text search over projects, vendors and duct numbers (SQLite FTS5).
+
+Three FTS5 indexes are kept in sync by triggers, like the rollups:
+
+* ``projects_fts``: client, site, engineer and enquiry id, as an external
+  content index over ``projects`` (nothing is stored twice);
+* ``vendors_fts``: name, GST, address and the vendor's contacts (names,
+  phones, emails), refreshed whenever the vendor or one of its contacts
+  changes;
+* ``ducts_fts``: duct numbers, external content over ``duct_entries``.
+  '-' and '/' count as part of a word there, so "D-12" is one term.
+
+Every search word is a prefix match and all words must match. Projects and
+vendors are ranked by bm25 with per-column weights; ducts by exact match,
+then newest.
+"""
+from flask import url_for
+
+import listing
+
+KINDS = ('projects', 'vendors', 'ducts')
+PAGE_SIZE = 20
+MAX_OFFSET = 1000   # ranked results past this are not worth paging to
+MAX_TERMS = 8
+
+PROJECT_COLUMNS = ('client_name', 'site_location', 'engineer_name', 'enquiry_id')
+# bm25 weights, per column: a hit on the client or enquiry id counts most.
+PROJECT_WEIGHTS = (10.0, 4.0, 2.0, 8.0)
+VENDOR_WEIGHTS = (10.0, 8.0, 2.0, 3.0)
+
+
+def _vendor_rows(where):
+    """Insert the ``vendors_fts`` rows of the vendors matching ``where``."""
+    return f'''
+        INSERT INTO vendors_fts (rowid, name, gst, address, contacts)
+        SELECT v.id, v.name, v.gst, v.address,
+               (SELECT group_concat(IFNULL(c.name, '') || ' ' || IFNULL(c.phone, '') || ' ' || IFNULL(c.email, ''), ' ')
+                FROM vendor_contacts c WHERE c.vendor_id = v.id)
+        FROM vendors v WHERE {where};
+    '''
+
+
+def _project_values(row):
+    return ', '.join(f'{row}.{column}' for column in PROJECT_COLUMNS)
+
+
+TABLES = [
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS projects_fts USING fts5(
+        {', '.join(PROJECT_COLUMNS)},
+        content='projects', content_rowid='id', prefix='2 3'
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS vendors_fts USING fts5(
+        name, gst, address, contacts, prefix='2 3'
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS ducts_fts USING fts5(
+        duct_no, content='duct_entries', content_rowid='id',
+        tokenize="unicode61 tokenchars '-/'", prefix='2 3'
+    )
+    ''',
+]
+
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS projects_fts_insert AFTER INSERT ON projects BEGIN
+        INSERT INTO projects_fts (rowid, {', '.join(PROJECT_COLUMNS)}) VALUES (NEW.id, {_project_values('NEW')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS projects_fts_delete AFTER DELETE ON projects BEGIN
+        INSERT INTO projects_fts (projects_fts, rowid, {', '.join(PROJECT_COLUMNS)})
+        VALUES ('delete', OLD.id, {_project_values('OLD')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS projects_fts_update AFTER UPDATE OF {', '.join(PROJECT_COLUMNS)} ON projects BEGIN
+        INSERT INTO projects_fts (projects_fts, rowid, {', '.join(PROJECT_COLUMNS)})
+        VALUES ('delete', OLD.id, {_project_values('OLD')});
+        INSERT INTO projects_fts (rowid, {', '.join(PROJECT_COLUMNS)}) VALUES (NEW.id, {_project_values('NEW')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS vendors_fts_insert AFTER INSERT ON vendors BEGIN
+        {_vendor_rows('v.id = NEW.id')}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS vendors_fts_delete AFTER DELETE ON vendors BEGIN
+        DELETE FROM vendors_fts WHERE rowid = OLD.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS vendors_fts_update AFTER UPDATE OF name, gst, address ON vendors BEGIN
+        DELETE FROM vendors_fts WHERE rowid = OLD.id;
+        {_vendor_rows('v.id = NEW.id')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS vendor_contacts_fts_insert AFTER INSERT ON vendor_contacts BEGIN
+        DELETE FROM vendors_fts WHERE rowid = NEW.vendor_id;
+        {_vendor_rows('v.id = NEW.vendor_id')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS vendor_contacts_fts_delete AFTER DELETE ON vendor_contacts BEGIN
+        DELETE FROM vendors_fts WHERE rowid = OLD.vendor_id;
+        {_vendor_rows('v.id = OLD.vendor_id')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS vendor_contacts_fts_update AFTER UPDATE ON vendor_contacts BEGIN
+        DELETE FROM vendors_fts WHERE rowid IN (OLD.vendor_id, NEW.vendor_id);
+        {_vendor_rows('v.id IN (OLD.vendor_id, NEW.vendor_id)')}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ducts_fts_insert AFTER INSERT ON duct_entries BEGIN
+        INSERT INTO ducts_fts (rowid, duct_no) VALUES (NEW.id, NEW.duct_no);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ducts_fts_delete AFTER DELETE ON duct_entries BEGIN
+        INSERT INTO ducts_fts (ducts_fts, rowid, duct_no) VALUES ('delete', OLD.id, OLD.duct_no);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ducts_fts_update AFTER UPDATE OF duct_no ON duct_entries BEGIN
+        INSERT INTO ducts_fts (ducts_fts, rowid, duct_no) VALUES ('delete', OLD.id, OLD.duct_no);
+        INSERT INTO ducts_fts (rowid, duct_no) VALUES (NEW.id, NEW.duct_no);
+    END
+    ''',
+]
+
+
+def install(cur):
+    for statement in TABLES + TRIGGERS:
+        cur.execute(statement)
+    for table, weights in (('projects_fts', PROJECT_WEIGHTS), ('vendors_fts', VENDOR_WEIGHTS)):
+        cur.execute(f"INSERT INTO {table} ({table}, rank) VALUES ('rank', ?)",
+                    (f"bm25({', '.join(map(str, weights))})",))
+    rebuild(cur)
+
+
+def rebuild(cur):
+    """Re-index everything from the base tables (after a bulk load with triggers off)."""
+    cur.execute("INSERT INTO projects_fts (projects_fts) VALUES ('rebuild')")
+    cur.execute("INSERT INTO ducts_fts (ducts_fts) VALUES ('rebuild')")
+    cur.execute("DELETE FROM vendors_fts")
+    cur.execute(_vendor_rows('1'))
+
+
+def match_expression(words, prefix=True):
+    """An FTS5 query for search words: every word must match (as a prefix)."""
+    star = '*' if prefix else ''
+    return ' '.join('"{}"{}'.format(word.replace('"', '""'), star) for word in words)
+
+
+def _ranked(cur, kind, words, limit):
+    """Ids of the best ``limit`` matches of one kind, best first."""
+    if kind != 'ducts':
+        table = f"{kind}_fts"
+        cur.execute(f"SELECT rowid FROM {table} WHERE {table} MATCH ? ORDER BY rank LIMIT ?",
+                    (match_expression(words), limit))
+        return [row[0] for row in cur.fetchall()]
+    # bm25 is no use on one-word documents (it favours the rarest numbers),
+    # and scoring every duct under a short prefix is slow. Exact matches come
+    # first, then prefix matches, newest first: ordered by rowid, FTS5 stops
+    # after ``limit`` rows.
+    ids = {}
+    for expression in (match_expression(words, prefix=False), match_expression(words)):
+        cur.execute("SELECT rowid FROM ducts_fts WHERE ducts_fts MATCH ? ORDER BY rowid DESC LIMIT ?",
+                    (expression, limit))
+        ids.update(dict.fromkeys(row[0] for row in cur.fetchall()))
+    return list(ids)[:limit]
+
+
+def _details(cur, kind, ids):
+    """Display fields of the hits of one kind, by id."""
+    if not ids:
+        return {}
+    marks = ', '.join('?' * len(ids))
+    if kind == 'projects':
+        cur.execute(f'''
+            SELECT p.id, p.client_name, p.site_location, p.engineer_name, p.enquiry_id, p.status,
+                   v.name AS vendor_name
+            FROM projects p LEFT JOIN vendors v ON v.id = p.vendor_id WHERE p.id IN ({marks})
+        ''', ids)
+    elif kind == 'vendors':
+        cur.execute(f"SELECT id, name, gst, address FROM vendors WHERE id IN ({marks})", ids)
+    else:
+        cur.execute(f'''
+            SELECT d.id, d.duct_no, d.duct_type, d.project_id, p.client_name
+            FROM duct_entries d JOIN projects p ON p.id = d.project_id WHERE d.id IN ({marks})
+        ''', ids)
+    return {row['id']: dict(row) for row in cur.fetchall()}
+
+
+def _url(kind, hit):
+    if kind == 'projects':
+        return url_for('main.open_project', project_id=hit['id'])
+    if kind == 'vendors':
+        return url_for('main.get_vendor_info', vendor_id=hit['id'])
+    return url_for('main.open_project', project_id=hit['project_id'])
+
+
+def search(cur, q, kinds=KINDS, args=None):
+    """One page of hits for ``q``. Returns ``(hits, next_cursor)``.
+
+    Each hit is a dict with ``kind``, ``id``, ``url`` and the display fields
+    of its row. Scores from different indexes are not comparable, so the
+    kinds' ranked lists are interleaved. ``args`` supplies ``limit`` and
+    ``cursor`` like the listings.
+    """
+    args = args or {}
+    words = (q or '').split()[:MAX_TERMS]
+    if not words:
+        return [], None
+    cursor = listing.decode_cursor(args.get('cursor'), int)
+    offset = max(cursor[0], 0) if cursor else 0
+    limit = listing.page_size({'limit': args.get('limit') or PAGE_SIZE})
+    wanted = min(offset + limit, MAX_OFFSET) + 1
+    ranked = {kind: _ranked(cur, kind, words, wanted) for kind in kinds}
+    merged = [(kind, ranked[kind][position]) for position in range(wanted)
+              for kind in kinds if position < len(ranked[kind])]
+    page = merged[offset:offset + limit]
+    details = {kind: _details(cur, kind, [rowid for k, rowid in page if k == kind]) for kind in kinds}
+    hits = []
+    for kind, rowid in page:
+        hit = details[kind].get(rowid)
+        if hit is not None:
+            hits.append({'kind': kind, **hit, 'url': _url(kind, hit)})
+    more = len(merged) > offset + limit and offset + limit < MAX_OFFSET
+    return hits, listing.encode_cursor(offset + limit) if more else None
@@ -0,0 +1,175 @@
+"""Change tracking for the site tablets' delta sync.
+
+Every insert, update or delete of a tracked row leaves one entry in
+``sync_changes``, keyed by table and row id. Triggers replace the row's
+entry with a fresh one on each write, and ``version`` is an AUTOINCREMENT
+key, so versions only ever grow and each row shows up once, at its latest
+change. Deletes leave a tombstone (``deleted_at`` set). Each entry also
+carries the row's project, so a tablet can follow just the project it has
+open. Vendors belong to no project and go to every tablet.
+
+A tablet keeps the ``version`` of its last sync and asks for everything
+after it; ``since=0`` is a full copy. Tombstones are pruned after
+``TOMBSTONE_RETENTION_DAYS``. A tablet whose ``since`` predates the pruned
+range could miss a delete, so it is told to ``reset``: drop its copy and
+sync again from 0.
+"""
+# table -> (columns sent to tablets, the row's project id in triggers)
+TRACKED = {
+    'projects': (('id', 'vendor_id', 'quotation_ro', 'start_date', 'end_date', 'location', 'incharge',
+                  'notes', 'file_name', 'enquiry_id', 'client_name', 'site_location', 'engineer_name',
+                  'mobile', 'status', 'total_sqm'), '{row}.id'),
+    'duct_entries': (('id', 'project_id', 'duct_no', 'duct_type', 'factor', 'width1', 'height1', 'width2',
+                      'height2', 'length_or_radius', 'quantity', 'degree_or_offset', 'gauge', 'area',
+                      'nuts_bolts', 'cleat', 'gasket', 'corner_pieces', 'weight', 'created_on'),
+                     '{row}.project_id'),
+    'production_progress': (('id', 'project_id', 'sheet_cutting_sqm', 'plasma_fabrication_sqm',
+                             'boxing_assembly_sqm'), '{row}.project_id'),
+    # Bank details stay on the server.
+    'vendors': (('id', 'name', 'gst', 'address'), 'NULL'),
+}
+PAGE_SIZE = 5000
+MAX_PAGE_SIZE = 20000
+ID_CHUNK = 500
+TOMBSTONE_RETENTION_DAYS = 30
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS sync_changes (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        project_id INTEGER,
+        deleted_at TEXT,
+        UNIQUE (tbl, row_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        pruned_through INTEGER NOT NULL
+    )
+    ''',
+]
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_sync_changes_project ON sync_changes(project_id, version)",
+    "CREATE INDEX IF NOT EXISTS idx_sync_changes_tombstones ON sync_changes(deleted_at) "
+    "WHERE deleted_at IS NOT NULL",
+]
+
+
+def _record(table, row, deleted):
+    project = TRACKED[table][1].format(row=row)
+    return f'''
+        DELETE FROM sync_changes WHERE tbl = '{table}' AND row_id = {row}.id;
+        INSERT INTO sync_changes (tbl, row_id, project_id, deleted_at)
+        VALUES ('{table}', {row}.id, {project}, {"datetime('now')" if deleted else 'NULL'});
+    '''
+
+
+TRIGGERS = [
+    trigger
+    for table in TRACKED
+    for trigger in (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} "
+        f"BEGIN {_record(table, 'NEW', False)} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table} "
+        f"BEGIN {_record(table, 'NEW', False)} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} "
+        f"BEGIN {_record(table, 'OLD', True)} END",
+    )
+]
+
+
+def install(cur):
+    for statement in TABLES + INDEXES + TRIGGERS:
+        cur.execute(statement)
+    cur.execute("INSERT OR IGNORE INTO sync_state (id, pruned_through) VALUES (1, 0)")
+
+
+def backfill(cur):
+    """Enter every existing row as a change, so ``since=0`` returns it."""
+    for table, (_, project) in TRACKED.items():
+        cur.execute(f'''
+            INSERT INTO sync_changes (tbl, row_id, project_id)
+            SELECT '{table}', t.id, {project.format(row='t')} FROM {table} t ORDER BY t.id
+        ''')
+
+
+def current_version(cur):
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sync_changes'")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _pruned_through(cur):
+    cur.execute("SELECT pruned_through FROM sync_state")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _rows(cur, table, ids):
+    columns = TRACKED[table][0]
+    rows = []
+    for start in range(0, len(ids), ID_CHUNK):
+        chunk = ids[start:start + ID_CHUNK]
+        cur.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk)
+        rows.extend(list(row) for row in cur.fetchall())
+    return rows
+
+
+def changes(cur, since=0, project_id=None, limit=PAGE_SIZE):
+    """The changes after version ``since``, oldest first, at most ``limit`` of them.
+
+    Returns ``{'version', 'more', 'reset', 'tables'}`` where ``tables`` maps
+    each table that changed to its ``columns``, the current ``rows`` of the
+    rows changed and the ids ``deleted``. Pass ``version`` back as ``since``
+    for the next page or sync; ``more`` says there is another page. Run it
+    inside ``export_cache.snapshot()`` so the rows match the change log.
+    """
+    current = current_version(cur)
+    reset = since < 0 or since > current or 0 < since < _pruned_through(cur)
+    if reset:
+        since = 0
+    scope, params = "", [since]
+    if project_id is not None:
+        scope, params = "AND (project_id = ? OR project_id IS NULL)", [since, project_id]
+    cur.execute(f'''
+        SELECT version, tbl, row_id, deleted_at IS NOT NULL FROM sync_changes
+        WHERE version > ? {scope} ORDER BY version LIMIT ?
+    ''', params + [limit + 1])
+    entries = cur.fetchall()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    changed, deleted = {}, {}
+    for _, table, row_id, is_deleted in entries:
+        (deleted if is_deleted else changed).setdefault(table, []).append(row_id)
+    tables = {}
+    for table in TRACKED:
+        if table in changed or table in deleted:
+            tables[table] = {
+                'columns': list(TRACKED[table][0]),
+                'rows': _rows(cur, table, changed.get(table, [])),
+                'deleted': deleted.get(table, []),
+            }
+    return {
+        'version': entries[-1][0] if more else current,
+        'more': more,
+        'reset': reset,
+        'tables': tables,
+    }
+
+
+def prune(conn, keep_days=TOMBSTONE_RETENTION_DAYS):
+    """Drop tombstones older than ``keep_days``; returns how many. Commits."""
+    cur = conn.cursor()
+    # Same clock (UTC) the triggers stamp deleted_at with.
+    cur.execute("DELETE FROM sync_changes WHERE deleted_at < datetime('now', ?) RETURNING version",
+                (f"-{keep_days} days",))
+    versions = [row[0] for row in cur.fetchall()]
+    if versions:
+        cur.execute("UPDATE sync_state SET pruned_through = MAX(pruned_through, ?)", (max(versions),))
+    conn.commit()
+    return len(versions)
@@ -0,0 +1,190 @@
+"""Sheet material takeoff: how many standard sheets of each gauge a project needs.
+
+Each duct is unfolded into flat rectangular blanks following the same
+formulas ``duct_calc`` uses for its area (a straight duct is two W x L and
+two H x L panels, a reducer's trapezoid faces are taken at their bounding
+rectangle, and so on). Blanks are then nested onto sheets per gauge with
+first-fit decreasing-height shelf packing: blanks are sorted by their short
+side and laid along the sheet's length in shelves, and the shelves are
+stacked across the sheet's width by first-fit decreasing.
+
+Identical blanks are packed as one group, and identical shelves/sheets are
+tracked together, so the work grows with the number of distinct blank sizes
+rather than the number of pieces.
+"""
+import numpy as np
+
+import duct_calc
+import export_cache
+
+SHEET_LENGTH = 2440  # mm
+SHEET_WIDTH = 1220   # mm
+GRID = 10            # mm; blank sides are rounded up to this for nesting
+CACHE_SIZE = 64      # (project, version) results kept per process
+
+_cache = {}
+
+
+def unfold(duct_type, width1, height1, width2, height2, length_or_radius, quantity,
+           degree_or_offset, factor, sheet=(SHEET_LENGTH, SHEET_WIDTH)):
+    """Flat blanks for whole columns of ducts.
+
+    Returns ``(gauge index, long side, short side, count, area)`` arrays with
+    one entry per distinct blank size. Sides are in ``GRID`` units, rounded
+    up; the area (sq.m) is the blanks' own, before rounding.
+    """
+    kind = np.char.upper(np.asarray([str(t or '') for t in duct_type], dtype=str))
+    w1, h1 = duct_calc._floats(width1), duct_calc._floats(height1)
+    w2, h2 = duct_calc._floats(width2), duct_calc._floats(height2)
+    length = duct_calc._floats(length_or_radius)
+    qty = np.trunc(duct_calc._floats(quantity)).astype(np.int64)
+    deg = duct_calc._floats(degree_or_offset)
+    fac = duct_calc._floats(factor, default=1.0)
+    gauge = duct_calc.gauge_index(w1, h1)
+
+    # Length of the side panels, as in the area formulas.
+    run = np.select(
+        [kind == 'ST', np.isin(kind, ('RED', 'SHOE')), kind == 'OFFSET', kind == 'ELB'],
+        [length, length * fac, (length + deg) * fac,
+         (h1 / 2 + length * np.pi * (deg / 180)) * fac],
+        default=0.0,
+    )
+    reducing = np.isin(kind, ('RED', 'OFFSET'))
+    wide = np.where(reducing, np.maximum(w1, w2), w1)
+    high = np.where(reducing, np.maximum(h1, h2), h1)
+    panelled = np.isin(kind, ('ST', 'RED', 'OFFSET', 'SHOE', 'ELB'))
+
+    # (side a, side b, blanks per duct) for each kind of blank
+    blanks = [
+        (wide, run, np.where(panelled, 2, 0)),
+        (high, run, np.where(panelled, 2, 0)),
+        (w1, h1, np.where(kind == 'DUM', 1, 0)),
+        (w1, np.pi * w1 / 2, np.where(kind == 'VANES', 1, 0)),
+    ]
+    a = np.concatenate([b[0] for b in blanks])
+    b = np.concatenate([b[1] for b in blanks])
+    count = np.concatenate([b[2] * qty for b in blanks])
+    gauges = np.tile(gauge, len(blanks))
+    keep = (count > 0) & (a > 0) & (b > 0)
+    long_side = np.maximum(a, b)[keep]
+    short_side = np.minimum(a, b)[keep]
+    count, gauges = count[keep], gauges[keep]
+
+    # Blanks bigger than a sheet are cut into equal parts and seamed.
+    along = np.ceil(long_side / (sheet[0] // GRID * GRID))
+    across = np.ceil(short_side / (sheet[1] // GRID * GRID))
+    long_side, short_side = long_side / along, short_side / across
+    count = count * (along * across).astype(np.int64)
+    area = long_side * short_side / 1_000_000 * count
+
+    grid_long = np.ceil(np.maximum(long_side, short_side) / GRID).astype(np.int64)
+    grid_short = np.ceil(np.minimum(long_side, short_side) / GRID).astype(np.int64)
+    key = (gauges.astype(np.int64) * 1_000 + grid_long) * 1_000 + grid_short
+    unique, inverse = np.unique(key, return_inverse=True)
+    return (unique // 1_000_000, unique // 1_000 % 1_000, unique % 1_000,
+            np.bincount(inverse, weights=count).astype(np.int64),
+            np.bincount(inverse, weights=area))
+
+
+def _pack(sizes, counts, capacity):
+    """Pack ``counts[i]`` items of ``sizes[i]``, in the given order, into bins.
+
+    Each group goes into the open bins with the least free space that still
+    takes it (best fit), then into new bins. Open bins are only counted per
+    amount of free space, so a group costs O(capacity) however many bins
+    there are. Returns the number of bins each group opened.
+    """
+    free = np.zeros(capacity + 1, dtype=np.int64)  # free[s]: open bins with s left
+    spaces = np.arange(capacity + 1)
+    opened = np.zeros(len(sizes), dtype=np.int64)
+    for i, (size, count) in enumerate(zip(sizes.tolist(), counts.tolist())):
+        space = spaces[size:]
+        per = space // size
+        room = np.cumsum(per * free[size:])
+        k = int(np.searchsorted(room, count))
+        if k:
+            # Bins with less free space than space[k] are filled up.
+            filled = free[size:size + k].copy()
+            free[size:size + k] = 0
+            free[:size] += np.bincount(space[:k] % size, weights=filled, minlength=size).astype(np.int64)
+            count -= int(room[k - 1])
+        if k < len(space):
+            left, per_bin = int(space[k]), int(per[k])
+            full, rest = divmod(count, per_bin)
+            free[left] -= full + (rest > 0)
+            free[left - per_bin * size] += full
+            free[left - rest * size] += rest > 0
+            continue
+        per_bin = capacity // size
+        full, rest = divmod(count, per_bin)
+        free[capacity - per_bin * size] += full
+        free[capacity - rest * size] += rest > 0
+        opened[i] = full + (rest > 0)
+    return opened
+
+
+def nest(long_side, short_side, counts, sheet=(SHEET_LENGTH, SHEET_WIDTH)):
+    """Sheets needed for one gauge's blanks (sides in ``GRID`` units).
+
+    Blanks are laid lengthwise into shelves as tall as their short side,
+    tallest first, and the shelves are then packed across sheets.
+    """
+    order = np.lexsort((-long_side, -short_side))
+    long_side, short_side, counts = long_side[order], short_side[order], counts[order]
+    shelves = _pack(long_side, counts, sheet[0] // GRID)
+    heights = np.bincount(short_side, weights=shelves).astype(np.int64)
+    tallest_first = np.flatnonzero(heights)[::-1]
+    return int(_pack(tallest_first, heights[tallest_first], sheet[1] // GRID).sum())
+
+
+def takeoff(columns, sheet=(SHEET_LENGTH, SHEET_WIDTH)):
+    """Sheet counts per gauge for columns of duct inputs (see ``duct_calc.INPUT_COLUMNS``)."""
+    gauge, long_side, short_side, counts, areas = unfold(**columns, sheet=sheet)
+    sheet_area = sheet[0] * sheet[1] / 1_000_000
+    result = []
+    for g in np.unique(gauge).tolist():
+        mask = gauge == g
+        sheets = nest(long_side[mask], short_side[mask], counts[mask], sheet)
+        blank_area = float(areas[mask].sum())
+        label = duct_calc.GAUGES[g]
+        result.append({
+            'gauge': label,
+            'pieces': int(counts[mask].sum()),
+            'blank_area': round(blank_area, 2),
+            'sheets': sheets,
+            'utilization': round(100 * blank_area / (sheets * sheet_area), 1),
+            'offcut': round(sheets * sheet_area - blank_area, 2),
+            'sheet_weight': round(sheets * sheet_area * duct_calc.SHEET_WEIGHT[label], 2),
+        })
+    return result
+
+
+def project_takeoff(cur, project_id, sheet=(SHEET_LENGTH, SHEET_WIDTH)):
+    """The project's takeoff, recomputed only when its ducts change."""
+    key = (project_id, export_cache.project_version(cur, project_id), sheet)
+    result = _cache.get(key)
+    if result is None:
+        cur.execute(f"SELECT {', '.join(duct_calc.INPUT_COLUMNS)} FROM duct_entries WHERE project_id = ?",
+                    (project_id,))
+        rows = cur.fetchall()
+        columns = dict(zip(duct_calc.INPUT_COLUMNS, zip(*rows))) if rows else \
+            {name: () for name in duct_calc.INPUT_COLUMNS}
+        result = takeoff(columns, sheet)
+        if len(_cache) >= CACHE_SIZE:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = result
+    return result
+
+
+def totals(result):
+    """Sum of a takeoff over all gauges."""
+    blank_area = sum(row['blank_area'] for row in result)
+    sheet_area = sum(row['blank_area'] + row['offcut'] for row in result)
+    return {
+        'pieces': sum(row['pieces'] for row in result),
+        'blank_area': round(blank_area, 2),
+        'sheets': sum(row['sheets'] for row in result),
+        'utilization': round(100 * blank_area / sheet_area, 1) if sheet_area else 0.0,
+        'offcut': round(sheet_area - blank_area, 2),
+        'sheet_weight': round(sum(row['sheet_weight'] for row in result), 2),
+    }
@@ -0,0 +1,273 @@
+"""Content-addressed storage for project drawings.
+
+An upload is copied to a temporary file in ``CHUNK_SIZE`` pieces while it
+is hashed, so memory use does not depend on its size, and anything over
+the size cap is rejected before it has been read in full. The finished
+file is stored once per distinct content under its SHA-256
+(``<UPLOAD_DIR>/ab/cd/abcd...``); uploading the same drawing again, to the
+same or another project, only adds a ``project_files`` reference row.
+
+Stored files never change, so downloads are served with Range support and
+immutable cache headers. Thumbnails of image uploads are made by the
+background job threads (see jobs.py); other formats get none. Without
+Pillow image uploads wait as pending, and a warning is logged.
+Unreferenced files are removed by ``collect_garbage()`` once
+``ORPHAN_GRACE_HOURS`` have passed.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from werkzeug.utils import secure_filename
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DIR = "uploads"
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+THUMBNAIL_SIZE = 320
+ORPHAN_GRACE_HOURS = 24
+# Served inline; anything else is sent as an attachment so an uploaded
+# HTML or SVG file can never run in the app's origin.
+INLINE_MIMETYPES = {"application/pdf", "image/png", "image/jpeg", "image/gif", "image/webp"}
+THUMBNAIL_MIMETYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS uploads (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mimetype TEXT NOT NULL,
+        thumbnail TEXT NOT NULL DEFAULT 'pending',
+        stored_at TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS project_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        sha256 TEXT NOT NULL REFERENCES uploads(sha256),
+        file_name TEXT NOT NULL,
+        uploaded_at TEXT NOT NULL,
+        uploaded_by TEXT,
+        UNIQUE (project_id, sha256)
+    )
+    ''',
+]
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_project_files_sha256 ON project_files(sha256)",
+    "CREATE INDEX IF NOT EXISTS idx_uploads_thumbnail_pending ON uploads(stored_at) "
+    "WHERE thumbnail = 'pending'",
+]
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the size cap."""
+
+
+class Received:
+    """An upload copied to a temporary file, not yet stored."""
+
+    def __init__(self, path, sha256, size, file_name):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.file_name = file_name
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def install(cur):
+    for statement in TABLES + INDEXES:
+        cur.execute(statement)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def path(directory, sha256):
+    return os.path.join(directory, sha256[:2], sha256[2:4], sha256)
+
+
+def thumbnail_path(directory, sha256):
+    return path(directory, sha256) + ".thumb.jpg"
+
+
+def receive(stream, directory, file_name, max_bytes=DEFAULT_MAX_BYTES):
+    """Copy ``stream`` to a temporary file under ``directory``, hashing it on the way.
+
+    Raises ``UploadTooLarge`` (and keeps nothing) past ``max_bytes``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Uploads are limited to {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                fh.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return Received(tmp_path, digest.hexdigest(), size, secure_filename(file_name or "") or "drawing")
+
+
+def attach(conn, directory, received, project_id, uploaded_by=None):
+    """Store a received upload and reference it from a project; returns the file id.
+
+    The file is moved into place inside the write transaction that records
+    it, so ``collect_garbage()`` cannot delete it in between. The caller
+    commits.
+    """
+    cur = conn.cursor()
+    mimetype = mimetypes.guess_type(received.file_name)[0] or "application/octet-stream"
+    cur.execute('''
+        INSERT INTO uploads (sha256, size, mimetype, stored_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(sha256) DO UPDATE SET stored_at = excluded.stored_at
+    ''', (received.sha256, received.size, mimetype, _now()))
+    target = path(directory, received.sha256)
+    if os.path.exists(target):
+        received.discard()
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(received.path, target)
+    cur.execute('''
+        INSERT INTO project_files (project_id, sha256, file_name, uploaded_at, uploaded_by)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(project_id, sha256) DO UPDATE SET
+            file_name = excluded.file_name, uploaded_at = excluded.uploaded_at,
+            uploaded_by = excluded.uploaded_by
+        RETURNING id
+    ''', (project_id, received.sha256, received.file_name, _now(), uploaded_by))
+    return cur.fetchone()[0]
+
+
+def project_files(cur, project_id):
+    """A project's drawings, newest first."""
+    cur.execute('''
+        SELECT f.id, f.file_name, f.uploaded_at, f.uploaded_by, u.sha256, u.size, u.mimetype, u.thumbnail
+        FROM project_files f JOIN uploads u ON u.sha256 = f.sha256
+        WHERE f.project_id = ? ORDER BY f.uploaded_at DESC, f.id DESC
+    ''', (project_id,))
+    return [dict(row) for row in cur.fetchall()]
+
+
+def get_file(cur, file_id):
+    cur.execute('''
+        SELECT f.id, f.project_id, f.file_name, u.sha256, u.size, u.mimetype, u.thumbnail
+        FROM project_files f JOIN uploads u ON u.sha256 = f.sha256 WHERE f.id = ?
+    ''', (file_id,))
+    return cur.fetchone()
+
+
+# ---------- Thumbnails ----------
+
+_pillow_available = None
+
+
+def _has_pillow():
+    """Whether Pillow can be imported; warns once per process when it cannot."""
+    global _pillow_available
+    if _pillow_available is None:
+        try:
+            import PIL  # noqa: F401
+            _pillow_available = True
+        except ImportError:
+            _pillow_available = False
+            log.warning("Pillow is not installed; thumbnails of uploaded drawings stay pending")
+    return _pillow_available
+
+
+def _render_thumbnail(source, target):
+    from PIL import Image
+
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with Image.open(source) as image:
+            image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            image.convert("RGB").save(tmp_path, "JPEG", quality=80)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def make_next_thumbnail(conn, directory):
+    """Make one pending thumbnail; returns False when none are pending.
+
+    Rendering is idempotent (write, then rename), so two threads picking
+    the same upload only waste a little work.
+    """
+    cur = conn.cursor()
+    skip, params = "", ()
+    if not _has_pillow():
+        # Images are left pending, so they get thumbnails once Pillow is installed.
+        skip = f"AND mimetype NOT IN ({', '.join('?' * len(THUMBNAIL_MIMETYPES))})"
+        params = tuple(sorted(THUMBNAIL_MIMETYPES))
+    cur.execute(f"SELECT sha256, mimetype FROM uploads WHERE thumbnail = 'pending' {skip} "
+                f"ORDER BY stored_at LIMIT 1", params)
+    upload = cur.fetchone()
+    if upload is None:
+        return False
+    status = "none"
+    if upload["mimetype"] in THUMBNAIL_MIMETYPES:
+        try:
+            _render_thumbnail(path(directory, upload["sha256"]), thumbnail_path(directory, upload["sha256"]))
+            status = "done"
+        except Exception as e:
+            log.warning("thumbnail of %s failed: %s", upload["sha256"], e)
+            status = "failed"
+    cur.execute("UPDATE uploads SET thumbnail = ? WHERE sha256 = ? AND thumbnail = 'pending'",
+                (status, upload["sha256"]))
+    conn.commit()
+    return True
+
+
+# ---------- Garbage collection ----------
+
+def collect_garbage(conn, directory, grace_hours=ORPHAN_GRACE_HOURS):
+    """Delete stored files no project has referenced for ``grace_hours``; returns how many.
+
+    Runs in one write transaction, like ``attach()``. Commits.
+    """
+    cutoff = (datetime.now() - timedelta(hours=grace_hours)).isoformat(timespec="seconds")
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute('''
+            DELETE FROM uploads
+            WHERE stored_at < ? AND NOT EXISTS (SELECT 1 FROM project_files f WHERE f.sha256 = uploads.sha256)
+            RETURNING sha256
+        ''', (cutoff,))
+        removed = [row[0] for row in cur.fetchall()]
+        for sha256 in removed:
+            for stale in (path(directory, sha256), thumbnail_path(directory, sha256)):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(removed)
+
+
+def init_app(app):
+    app.config.setdefault("UPLOAD_DIR", os.environ.get("UPLOAD_DIR", DEFAULT_DIR))
+    app.config.setdefault("UPLOAD_MAX_BYTES", int(os.environ.get("UPLOAD_MAX_BYTES", DEFAULT_MAX_BYTES)))
+    # Werkzeug refuses larger request bodies outright (413) before they are parsed.
+    app.config.setdefault("MAX_CONTENT_LENGTH", app.config["UPLOAD_MAX_BYTES"] + CHUNK_SIZE)
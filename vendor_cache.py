@@ -0,0 +1,143 @@
+"""In-process cache of vendor records for the vendor lookups.
+
+The projects form looks a vendor up every time its vendor picker changes,
+and vendors change rarely. Each process keeps up to ``CACHE_SIZE`` records
+(name, GST, address and contacts) in LRU order.
+
+Triggers on ``vendors`` and ``vendor_contacts`` bump a single generation
+number. Records are loaded together with the generation they were read at.
+A process compares its generation with the database at most every
+``CHECK_INTERVAL`` seconds and drops everything when it has moved, so a
+write in one gunicorn worker reaches the others within that interval. The
+writing process calls ``invalidate()`` and sees its own write at once.
+Lookups served entirely from the cache do not touch the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import export_cache
+import metrics
+
+CACHE_SIZE = 1024
+CHECK_INTERVAL = 5.0  # seconds a process trusts its generation without asking
+ID_CHUNK = 500
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS vendor_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+    ''',
+]
+
+_BUMP = "UPDATE vendor_generation SET generation = generation + 1;"
+TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {table}_generation_{event.lower()} AFTER {event} ON {table} "
+    f"BEGIN {_BUMP} END"
+    for table in ('vendors', 'vendor_contacts')
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+_lock = threading.Lock()
+_records = OrderedDict()  # vendor id -> record
+_generation = None
+_checked_at = 0.0
+
+
+def install(cur):
+    for statement in TABLES + TRIGGERS:
+        cur.execute(statement)
+    cur.execute("INSERT OR IGNORE INTO vendor_generation (id, generation) VALUES (1, 0)")
+
+
+def invalidate():
+    """Forget everything; call after writing vendors or their contacts."""
+    global _checked_at
+    with _lock:
+        _records.clear()
+        _checked_at = 0.0
+
+
+def _generation_of(cur):
+    cur.execute("SELECT generation FROM vendor_generation")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _sync(generation):
+    """Adopt ``generation``, dropping the records of older ones."""
+    global _generation, _checked_at
+    with _lock:
+        if _generation is None or generation > _generation:
+            _records.clear()
+            _generation = generation
+        _checked_at = time.monotonic()
+
+
+def _load(cur, ids):
+    records = {}
+    for start in range(0, len(ids), ID_CHUNK):
+        chunk = ids[start:start + ID_CHUNK]
+        marks = ', '.join('?' * len(chunk))
+        cur.execute(f"SELECT id, name, gst, address FROM vendors WHERE id IN ({marks})", chunk)
+        for row in cur.fetchall():
+            records[row['id']] = {**dict(row), 'contacts': []}
+        cur.execute(f'''
+            SELECT vendor_id, name, phone, email FROM vendor_contacts
+            WHERE vendor_id IN ({marks}) ORDER BY id
+        ''', chunk)
+        for row in cur.fetchall():
+            records[row['vendor_id']]['contacts'].append(
+                {'name': row['name'], 'phone': row['phone'], 'email': row['email']})
+    return records
+
+
+def _cached(ids):
+    with _lock:
+        if time.monotonic() - _checked_at >= CHECK_INTERVAL:
+            return None
+        found = {}
+        for vendor_id in ids:
+            record = _records.get(vendor_id)
+            if record is not None:
+                _records.move_to_end(vendor_id)
+                found[vendor_id] = record
+        return found
+
+
+def lookup(get_conn, ids):
+    """Vendor records by id as ``{id: record}``; unknown ids are left out.
+
+    ``get_conn`` is called for a connection only when the cache cannot
+    answer on its own.
+    """
+    ids = list(dict.fromkeys(ids))
+    found = _cached(ids)
+    if found is None:
+        _sync(_generation_of(get_conn().cursor()))
+        found = _cached(ids)
+    missing = [vendor_id for vendor_id in ids if vendor_id not in found]
+    metrics.inc("erp_vendor_cache_total", {"result": "hit"}, len(found))
+    metrics.inc("erp_vendor_cache_total", {"result": "miss"}, len(missing))
+    if not missing:
+        return found
+
+    conn = get_conn()
+    with export_cache.snapshot(conn):
+        cur = conn.cursor()
+        generation = _generation_of(cur)
+        loaded = _load(cur, missing)
+    _sync(generation)
+    with _lock:
+        if generation == _generation:
+            _records.update(loaded)
+            while len(_records) > CACHE_SIZE:
+                _records.popitem(last=False)
+    return {**found, **loaded}
+
+
+def get(get_conn, vendor_id):
+    """One vendor record, or None."""
+    return lookup(get_conn, [vendor_id]).get(vendor_id)
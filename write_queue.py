@@ -0,0 +1,187 @@
+"""Group-commit write coordinator.
+
+Small writes from the request threads of a worker are funnelled through one
+writer thread with its own connection. The writer takes every operation
+waiting in its queue (up to ``MAX_GROUP``) and runs them in a single
+``BEGIN IMMEDIATE`` transaction, each inside its own savepoint, then
+commits once. An operation that fails is undone on its own and its error
+goes back to its caller only. Under load N concurrent writes cost one lock
+acquisition and one commit instead of N, and while a group commits the
+next one gathers in the queue, so groups grow with the load.
+
+Between gunicorn workers the writers still take turns on the SQLite write
+lock, but they always ask for it up front and only ever hold it for one
+group. A writer that cannot get the lock within ``BUSY_TIMEOUT_MS`` backs
+off (exponentially, with jitter, at most ``MAX_RETRIES`` times) and retries
+the whole group.
+
+Operations are callables taking a cursor; they run on the writer thread,
+so they must not touch ``request``/``session`` and must not commit.
+"""
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent import futures
+
+from flask import current_app
+
+import db
+import metrics
+
+log = logging.getLogger(__name__)
+
+MAX_GROUP = 64
+BUSY_TIMEOUT_MS = 250     # per attempt; the backoff below adds to it
+MAX_RETRIES = 8
+BACKOFF_BASE = 0.005      # seconds, doubled per retry
+BACKOFF_MAX = 0.25
+RESULT_TIMEOUT = 30.0     # seconds a request waits for its write
+
+_queue_for_pid = None
+_queue_lock = threading.Lock()
+
+
+class WriteQueue:
+    """One writer thread applying queued operations in group commits."""
+
+    def __init__(self, database, max_group=MAX_GROUP):
+        self.database = database
+        self.max_group = max_group
+        self.pending = queue.Queue()
+        self.commits = 0
+        self.writes = 0
+        self.thread = threading.Thread(target=self._loop, name="write-queue", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, operation):
+        """Queue ``operation(cur)``; returns a Future for its result."""
+        future = futures.Future()
+        self.pending.put((operation, future))
+        return future
+
+    def run(self, operation, timeout=RESULT_TIMEOUT):
+        """Apply ``operation(cur)`` in the next group commit and return its result.
+
+        Raises ``TimeoutError`` only if the operation was withdrawn unapplied;
+        one that a group has already started is waited for, so a caller never
+        sees an error for a write that then commits.
+        """
+        future = self.submit(operation)
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            if future.cancel():
+                raise
+            return future.result()
+
+    def _take_group(self):
+        group = [self.pending.get()]
+        while len(group) < self.max_group:
+            try:
+                group.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return [(operation, future) for operation, future in group if future.set_running_or_notify_cancel()]
+
+    def _begin(self, conn):
+        """Take the write lock, backing off while another process holds it."""
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                if attempt == MAX_RETRIES:
+                    raise
+                metrics.inc("erp_write_retries_total", {})
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _apply(self, conn, group):
+        self._begin(conn)
+        cur = conn.cursor()
+        outcomes = []
+        try:
+            for operation, _ in group:
+                cur.execute("SAVEPOINT write_queue_op")
+                try:
+                    outcomes.append((True, operation(cur)))
+                    cur.execute("RELEASE write_queue_op")
+                except Exception as e:
+                    cur.execute("ROLLBACK TO write_queue_op")
+                    cur.execute("RELEASE write_queue_op")
+                    outcomes.append((False, e))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self.commits += 1
+        self.writes += len(group)
+        metrics.observe("erp_write_group_size", {}, len(group))
+        for (_, future), (ok, value) in zip(group, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _loop(self):
+        conn = db.connect(self.database, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        try:
+            while True:
+                group = self._take_group()
+                if not group:
+                    continue
+                try:
+                    self._apply(conn, group)
+                except Exception as e:
+                    log.exception("write group of %d failed", len(group))
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            conn.close()
+
+
+def writer(app=None):
+    """This process's write queue, started on first use (after gunicorn forks)."""
+    global _queue_for_pid
+    if _queue_for_pid is not None and _queue_for_pid[0] == os.getpid():
+        return _queue_for_pid[1]
+    with _queue_lock:
+        if _queue_for_pid is None or _queue_for_pid[0] != os.getpid():
+            app = app or current_app
+            _queue_for_pid = (os.getpid(), WriteQueue(db.database_path(app),
+                                                      app.config["WRITE_GROUP_SIZE"]).start())
+    return _queue_for_pid[1]
+
+
+def write(operation):
+    """Run ``operation(cur)`` as one write and return its result.
+
+    Goes through the group-commit queue unless ``WRITE_QUEUE`` is off, in
+    which case it runs and commits on the request's own connection.
+    """
+    if not current_app.config["WRITE_QUEUE"]:
+        conn = db.get_db()
+        try:
+            result = operation(conn.cursor())
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result
+    return writer().run(operation)
+
+
+def init_app(app):
+    app.config.setdefault("WRITE_QUEUE", os.environ.get("WRITE_QUEUE", "1") not in ("0", "false", "off"))
+    app.config.setdefault("WRITE_GROUP_SIZE", int(os.environ.get("WRITE_GROUP_SIZE", MAX_GROUP)))